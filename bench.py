@@ -0,0 +1,634 @@
+"""
+Benchmarks for the data-access helpers in bot.py.
+
+Usage: python bench.py [--backend postgres|sqlite] [--sizes 1000,10000,100000,1000000]
+                       [--concurrency 1,4,16] [--ops N] [--baseline FILE] [--save-baseline]
+                       [--tolerance PCT]
+
+Runs against a throwaway Postgres given by BENCH_DATABASE_URL, or with --backend sqlite
+against a scratch SQLite file (--sqlite-path) - every table is truncated and re-seeded,
+so never point it at a real database. The conformance suite checks that the backend
+honours the storage contract bot.py relies on; both backends must pass it. For each table
+size and concurrency level, each helper is called --ops times from a thread pool
+and timed, and the hot queries are EXPLAINed to check they still use their
+indexes. The prepared suite times each hot statement as plain SQL and as a
+prepared EXECUTE, with the planning time Postgres reports for each. The embeds suite times
+one render of each embed the bot sends, with its CPU time and peak allocation. Results are compared against the baseline file (bench_baseline.json by
+default) and the run fails if throughput or p99 latency regressed past --tolerance.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import discord
+import psycopg2
+import bot as mmbot
+
+BENCH_GUILD_ID = 900000000000000002
+CONFORMANCE_GUILD_ID = 900000000000000003
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILES = {  # Each backend is compared against its own numbers
+    'postgres': os.path.join(BASE_DIR, 'bench_baseline.json'),
+    'sqlite': os.path.join(BASE_DIR, 'bench_baseline_sqlite.json'),
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list (0.0 when empty); loadtest.py uses it too"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(name, calls, concurrency):
+    """Run every call on a thread pool and summarise the latencies"""
+    def timed(call):
+        started = time.perf_counter()
+        call()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(timed, calls))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'name': name,
+        'ops': len(calls),
+        'ops_per_sec': round(len(calls) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+# Database Suite
+def reset_tables(size):
+    """Empty the tables and seed them with `size` tickets and MM stats rows"""
+    if mmbot.storage_backend == 'sqlite':
+        return reset_sqlite_tables(size)
+    conn = mmbot.get_db()
+    cur = conn.cursor()
+    cur.execute("TRUNCATE tickets, mm_stats, ticket_history")
+    cur.execute("""
+        INSERT INTO tickets (channel_id, user_id, ticket_type, guild_id, tier, trader, giving, receiving, tip, created_at)
+        SELECT g, 1000000 + (g %% 5000),
+               CASE WHEN g %% 3 = 0 THEN 'support' ELSE 'mm' END,
+               %s,
+               (ARRAY['basic', 'advanced', 'premium', 'og'])[1 + g %% 4],
+               'trader' || g, '500 rbx', '$50 PayPal', 'None',
+               CURRENT_TIMESTAMP - make_interval(secs => g)
+        FROM generate_series(1, %s) AS g
+    """, (BENCH_GUILD_ID, size))
+    cur.execute("""
+        INSERT INTO mm_stats (user_id, tickets_completed, last_updated)
+        SELECT g, (random() * 1000)::int, CURRENT_TIMESTAMP
+        FROM generate_series(1, %s) AS g
+    """, (size,))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    # Fresh statistics so the planner sees the real table size
+    conn = mmbot.get_db()
+    conn.autocommit = True
+    conn.cursor().execute("ANALYZE tickets, mm_stats")
+    conn.close()
+
+
+def reset_sqlite_tables(size):
+    """reset_tables for the SQLite backend"""
+    with mmbot.sqlite_store.transaction() as conn:
+        conn.execute("DELETE FROM tickets")
+        conn.execute("DELETE FROM mm_stats")
+        conn.execute("DELETE FROM ticket_history")
+        conn.execute("DELETE FROM ticket_search")
+        conn.execute("""
+            WITH RECURSIVE g(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM g WHERE n < ?)
+            INSERT INTO tickets (channel_id, user_id, ticket_type, guild_id, tier, trader, giving, receiving, tip, created_at)
+            SELECT n, 1000000 + (n % 5000),
+                   CASE WHEN n % 3 = 0 THEN 'support' ELSE 'mm' END,
+                   ?,
+                   CASE n % 4 WHEN 0 THEN 'basic' WHEN 1 THEN 'advanced' WHEN 2 THEN 'premium' ELSE 'og' END,
+                   'trader' || n, '500 rbx', '$50 PayPal', 'None',
+                   strftime('%Y-%m-%d %H:%M:%f000', 'now', '-' || n || ' seconds')
+            FROM g
+        """, (size, BENCH_GUILD_ID))
+        conn.execute("""
+            WITH RECURSIVE g(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM g WHERE n < ?)
+            INSERT INTO mm_stats (user_id, tickets_completed, last_updated)
+            SELECT n, abs(random()) % 1000, strftime('%Y-%m-%d %H:%M:%f000', 'now') FROM g
+        """, (size,))
+        conn.execute("ANALYZE")
+
+
+def db_cases(size, ops):
+    """Helper calls to time for one table size, as (name, [calls]) pairs.
+
+    Write cases use IDs reserved for them so every call does real work:
+    save_ticket inserts above the seeded range and delete_ticket_db archives
+    seeded rows that no other case touches.
+    """
+    existing = lambda: random.randint(ops + 1, size)
+    new_ids = iter(range(size + 1, size + 1 + ops))
+    delete_ids = iter(range(1, ops + 1))
+
+    return [
+        ('save_ticket', [
+            (lambda channel_id=next(new_ids): mmbot.save_ticket(
+                channel_id, 42, 'mm', guild_id=BENCH_GUILD_ID, tier='basic',
+                trader='bench', giving='500 rbx', receiving='$50 PayPal', tip='None'
+            )) for _ in range(ops)
+        ]),
+        ('get_ticket', [lambda: mmbot.get_ticket(existing()) for _ in range(ops)]),
+        ('claim_ticket_db', [lambda: mmbot.claim_ticket_db(existing(), 42) for _ in range(ops)]),
+        ('delete_ticket_db', [
+            (lambda channel_id=next(delete_ids): mmbot.delete_ticket_db(channel_id, 42)) for _ in range(ops)
+        ]),
+        ('increment_mm_stats', [lambda: mmbot.increment_mm_stats(random.randint(1, size)) for _ in range(ops)]),
+        ('get_mm_stats_db', [lambda: mmbot.get_mm_stats_db(random.randint(1, size)) for _ in range(ops)]),
+        ('get_mm_leaderboard_db', [lambda: mmbot.get_mm_leaderboard_db(10) for _ in range(ops)]),
+        ('get_mm_leaderboard_db_page', [
+            lambda: mmbot.get_mm_leaderboard_db(10, (random.randint(0, 999), random.randint(1, size))) for _ in range(ops)
+        ]),
+    ]
+
+
+plan_problems = []
+
+
+def check_plans(size):
+    """EXPLAIN the hot queries at this table size and remember any problems"""
+    for entry in mmbot.check_query_plans():
+        status = 'ok' if not entry['problems'] else ', '.join(entry['problems'])
+        print(f"  plan/{entry['query']:<25} {status:<20} {entry['plan']}")
+        if entry['problems']:
+            plan_problems.append(f"{entry['query']} at {size:,} rows: {status}")
+
+
+def run_db_suite(args):
+    results = []
+    for size in args.sizes:
+        if size <= args.ops:
+            raise SystemExit(f'❌ Table size {size} must be larger than --ops {args.ops}')
+        for i, concurrency in enumerate(args.concurrency):
+            # Write cases consume their reserved IDs, so every run starts from a fresh seed
+            print(f'🌱 Seeding {size:,} rows...')
+            reset_tables(size)
+            if i == 0:
+                check_plans(size)
+            for name, calls in db_cases(size, args.ops):
+                result = measure(name, calls, concurrency)
+                result['key'] = f'db/{name}/{size}/c{concurrency}'
+                result['size'] = size
+                result['concurrency'] = concurrency
+                results.append(result)
+                print_result(result)
+    return results
+
+
+# Prepared Statement Suite
+# Sample parameters for each statement in bot.PREPARED_STATEMENTS
+PREPARED_SAMPLES = {
+    'get_ticket': lambda size: (random.randint(1, size),),
+    'claim_ticket': lambda size: (random.randint(1, size), 42),
+    'unclaim_ticket': lambda size: (random.randint(1, size),),
+    'increment_mm_stats': lambda size: (random.randint(1, size),),
+    'get_mm_stats': lambda size: (random.randint(1, size),),
+}
+PLANNING_RUNS = 20
+
+
+def planning_ms(cur, sql, params):
+    """Average planning time Postgres reports for a statement"""
+    total = 0.0
+    for _ in range(PLANNING_RUNS):
+        cur.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql, params)
+        total += cur.fetchone()[0][0]['Planning Time']
+        cur.connection.rollback()
+    return round(total / PLANNING_RUNS, 4)
+
+
+def run_prepared_suite(args):
+    """Compare each hot statement sent as plain SQL against EXECUTE by handle"""
+    size = args.sizes[0]
+    print(f'🌱 Seeding {size:,} rows...')
+    reset_tables(size)
+
+    conn = psycopg2.connect(mmbot.DATABASE_URL, connection_factory=mmbot.PreparedConnection,
+                            options=mmbot.DB_SESSION_OPTIONS)
+    cur = conn.cursor()
+    results = []
+    for name, (types, sql) in mmbot.PREPARED_STATEMENTS.items():
+        make_params = PREPARED_SAMPLES[name]
+        plain_sql = re.sub(r'\$(\d+)', r'%(p\1)s', sql)
+
+        def plain():
+            params = make_params(size)
+            cur.execute(plain_sql, {f'p{i + 1}': value for i, value in enumerate(params)})
+            conn.commit()
+
+        def prepared():
+            mmbot.execute_prepared(cur, name, make_params(size))
+            conn.commit()
+
+        sample = make_params(size)
+        plain_planning = planning_ms(cur, plain_sql, {f'p{i + 1}': value for i, value in enumerate(sample)})
+        mmbot.execute_prepared(cur, name, sample)  # Make sure it is prepared before timing
+        conn.rollback()
+        prepared_planning = planning_ms(cur, f"EXECUTE {name} ({', '.join(['%s'] * len(sample))})", sample)
+
+        for mode, call, planning in (('plain', plain, plain_planning), ('prepared', prepared, prepared_planning)):
+            result = measure(name, [call] * args.ops, 1)
+            result['key'] = f'prepared/{name}/{mode}'
+            result['planning_ms'] = planning
+            results.append(result)
+            print_result(result)
+
+        plain_result, prepared_result = results[-2], results[-1]
+        gain = (1 - prepared_result['p50_ms'] / plain_result['p50_ms']) * 100 if plain_result['p50_ms'] else 0.0
+        print(f"  {'':<45} planning {plain_planning:.4f}ms -> {prepared_planning:.4f}ms, p50 {gain:+.1f}% faster")
+
+    cur.close()
+    conn.close()
+    return results
+
+
+# Embed Suite
+# Every embed the bot sends on a command or ticket path, as it is made per send. Sending
+# serializes the embed, so each render includes to_dict(). Static embeds are also timed
+# as the shared instance the bot actually sends, against building them per send.
+EMBED_ALLOC_RUNS = 200
+
+
+def substituted_mm_welcome(tier):
+    """mm_welcome made from a payload cached once per tier: Embed.from_dict of a copy, then fill.
+
+    The alternative to building the embed per send - timed next to mm_welcome to keep the
+    comparison reproducible (from_dict keeps the dict's lists, so every send needs a deep copy).
+    """
+    blank = SimpleNamespace(mention='', name='', display_avatar=SimpleNamespace(url=''))
+    payload = mmbot.mm_welcome_embed(tier, blank, '-', '-', '-', None, 0).to_dict()
+
+    def make(user, trader, giving, receiving, tip, ticket_number):
+        embed = discord.Embed.from_dict(copy.deepcopy(payload))
+        embed.description = f"Welcome {user.mention}!\n\nOur team will be with you shortly."
+        for index, value in enumerate((trader, giving, receiving, tip if tip else "None")):
+            embed.set_field_at(index, name=payload['fields'][index]['name'], value=value,
+                               inline=payload['fields'][index]['inline'])
+        embed.set_footer(text=f'Ticket #{ticket_number}')
+        return embed
+    return make
+
+
+def embed_cases():
+    user = SimpleNamespace(
+        mention='<@123456789012345678>', name='someone',
+        display_avatar=SimpleNamespace(url='https://cdn.discordapp.com/embed/avatars/0.png')
+    )
+    tier = next(iter(mmbot.MM_TIERS.values()))
+    substituted = substituted_mm_welcome(tier)
+    return [
+        ('help/built', mmbot.help_embed),
+        ('help/shared', lambda: mmbot.HELP_EMBED),
+        ('mm_panel', lambda: mmbot.mm_panel_embed(mmbot.MM_TIERS)),
+        ('support_panel', mmbot.support_panel_embed),
+        ('mm_welcome', lambda: mmbot.mm_welcome_embed(tier, user, 'someone', '500 robux', '$5 paypal', None, 1234)),
+        ('mm_welcome/substituted', lambda: substituted(user, 'someone', '500 robux', '$5 paypal', None, 1234)),
+        ('support_welcome', lambda: mmbot.support_welcome_embed(user, 'Claiming a Prize', 'Won the giveaway', 1234)),
+        ('choose_side', lambda: mmbot.coinflip_challenge_embed(user, user, 3, False)),
+    ]
+
+
+def allocated_bytes(call):
+    """Average peak memory tracemalloc sees during one call"""
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(EMBED_ALLOC_RUNS):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            call()
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total // EMBED_ALLOC_RUNS
+
+
+def run_embed_suite(args):
+    """Time and measure the allocations of one render of each embed"""
+    results = []
+    for name, make in embed_cases():
+        def call(make=make):
+            make().to_dict()
+
+        cpu_started = time.process_time()
+        for _ in range(args.ops):
+            call()
+        cpu_us = (time.process_time() - cpu_started) / args.ops * 1e6
+
+        result = measure(name, [call] * args.ops, 1)
+        result['key'] = f'embeds/{name}'
+        result['cpu_us'] = round(cpu_us, 2)
+        result['alloc_bytes'] = allocated_bytes(call)
+        results.append(result)
+        print_result(result)
+        print(f"  {'':<45} cpu {result['cpu_us']:.2f}us, peak alloc {result['alloc_bytes']:,}B per render")
+    return results
+
+
+# Conformance Suite
+# Both backends must give the same answers through the same helpers. Every check uses its
+# own guild and IDs above the seeded range, and cleans up after itself.
+conformance_failures = []
+
+
+def conformance_checks():
+    """(name, check) pairs; a check raises AssertionError when the backend gets it wrong"""
+    guild_id = CONFORMANCE_GUILD_ID
+    base = 10 ** 15
+
+    def save(offset, **kwargs):
+        fields = dict(guild_id=guild_id, tier='basic', trader='conformance', giving='500 rbx',
+                      receiving='$50 PayPal', tip='None')
+        fields.update(kwargs)
+        return mmbot.save_ticket(base + offset, 42, 'mm', **fields)
+
+    def ticket_roundtrip():
+        row = save(1, ticket_number=base + 1)
+        assert row['channel_id'] == base + 1 and row['ticket_number'] == base + 1
+        assert row['claimed_by'] is None and row['created_at'] is not None
+        assert mmbot.get_ticket(base + 1) == row
+        assert mmbot.get_ticket(base + 999) is None
+
+    def claim_unclaim():
+        save(2)
+        waited = mmbot.claim_ticket_db(base + 2, 7)
+        assert isinstance(waited, float) and waited >= 0
+        assert mmbot.get_ticket(base + 2)['claimed_by'] == 7
+        mmbot.unclaim_ticket_db(base + 2)
+        row = mmbot.get_ticket(base + 2)
+        assert row['claimed_by'] is None and row['claimed_at'] is None
+        assert mmbot.claim_ticket_db(base + 999, 7) is None
+
+    def ticket_number_blocks():
+        first, second = mmbot.fetch_ticket_number_block(), mmbot.fetch_ticket_number_block()
+        assert first[1] - first[0] == mmbot.TICKET_NUMBER_BLOCK
+        assert second[0] >= first[1]
+
+    def close_and_archive():
+        save(3)
+        mmbot.claim_ticket_db(base + 3, 7)
+        closed = mmbot.delete_ticket_db(base + 3, 8)
+        assert closed['channel_id'] == base + 3 and closed['claimed_by'] == 7
+        assert closed['guild_id'] == guild_id and closed['open_seconds'] >= 0
+        assert mmbot.get_ticket(base + 3) is None
+        assert mmbot.delete_ticket_db(base + 3, 8) is None
+        for offset in (4, 5):
+            save(offset)
+        archived = mmbot.archive_orphan_tickets_db([base + 4, base + 5, base + 999])
+        assert sorted(row['channel_id'] for row in archived) == [base + 4, base + 5]
+
+    def activity_and_backfill():
+        save(6, guild_id=None)
+        seen = datetime.utcnow().replace(microsecond=0)
+        mmbot.save_ticket_activity_db([(base + 6, seen)])
+        mmbot.backfill_ticket_guilds_db([(base + 6, guild_id)])
+        row = mmbot.get_ticket(base + 6)
+        assert row['last_activity_at'] == seen and row['guild_id'] == guild_id
+        assert any(row['channel_id'] == base + 6 for row in mmbot.get_live_tickets_db())
+
+    def search_pages():
+        for offset in range(10, 10 + mmbot.SEARCH_PAGE_SIZE + 2):
+            save(offset, trader=f'searcher{offset}', details='zebra escrow')
+        mmbot.delete_ticket_db(base + 10, 8)
+        seen = []
+        before = None
+        while True:
+            rows = mmbot.search_tickets_db(guild_id, 'Zebra  escrow', before)
+            page = rows[:mmbot.SEARCH_PAGE_SIZE]
+            seen.extend(row['channel_id'] for row in page)
+            if len(rows) <= mmbot.SEARCH_PAGE_SIZE:
+                break
+            before = (page[-1]['created_at'], page[-1]['channel_id'])
+        assert sorted(seen) == list(range(base + 10, base + 12 + mmbot.SEARCH_PAGE_SIZE)), seen
+        assert len(seen) == len(set(seen))
+        closed = mmbot.search_tickets_db(guild_id, f'searcher{10}')
+        assert len(closed) == 1 and closed[0]['closed_at'] is not None
+        assert mmbot.search_tickets_db(guild_id, 'zebra nonexistentword') == []
+
+    def events_and_rollups():
+        now = datetime.utcnow()
+        event = lambda name, seconds, actor_id=None, target_id=None: {
+            'occurred_at': now, 'event': name, 'guild_id': guild_id, 'channel_id': base + 20,
+            'ticket_number': None, 'tier': 'basic', 'actor_id': actor_id, 'target_id': target_id, 'seconds': seconds
+        }
+        mmbot.write_ticket_events_db([event('created', None), event('claimed', 10.0, 7), event('closed', 100.0, 8, 7)])
+        mmbot.write_ticket_events_db([event('claimed', 20.0, 7)])
+        [totals] = mmbot.get_ticket_rollups_db(guild_id, now.date(), 7)
+        assert (totals['tier'], totals['claims'], totals['closes']) == ('basic', 2, 1)
+        assert float(totals['claim_seconds']) == 30.0 and float(totals['close_seconds']) == 100.0
+        assert mmbot.get_ticket_rollups_db(guild_id, now.date(), 9) == []
+
+    def mm_stats():
+        user_ids = [base + 30 + i for i in range(6)]  # Enough rows for two keyset pages, even on an empty table
+        try:
+            assert mmbot.get_mm_stats_db(user_ids[0])['tickets_completed'] == 0
+            mmbot.increment_mm_stats(user_ids[0])
+            mmbot.increment_mm_stats(user_ids[0])
+            assert mmbot.get_mm_stats_db(user_ids[0])['tickets_completed'] == 2
+            for user_id in user_ids[1:]:
+                mmbot.increment_mm_stats(user_id)
+            top = mmbot.get_mm_leaderboard_db(3)
+            assert len(top) == 3 and top == sorted(top, key=lambda row: (row['tickets_completed'], row['user_id']), reverse=True)
+            # Keyset pages continue exactly where the previous one stopped
+            first = mmbot.get_mm_leaderboard_db(6)
+            after = (first[2]['tickets_completed'], first[2]['user_id'])
+            assert mmbot.get_mm_leaderboard_db(3, after) == first[3:6]
+            assert mmbot.count_mm_stats_db() >= len(first) == 6
+        finally:
+            mmbot.delete_mm_stats_db(user_ids)
+        assert mmbot.get_mm_stats_db(user_ids[0])['tickets_completed'] == 0
+
+    def guild_config():
+        tiers = {'basic': {'name': 'Basic', 'range': '$0-$50', 'level': 1}}
+        mmbot.set_guild_config_db(guild_id, 'mm_tiers', tiers)
+        mmbot.set_guild_config_db(guild_id, 'staff_role_id', 123)
+        [row] = mmbot.get_guild_config_rows_db(guild_id)
+        assert row['mm_tiers'] == tiers and row['staff_role_id'] == 123 and row['proof_channel_id'] is None
+        assert any(row['guild_id'] == guild_id for row in mmbot.get_guild_config_rows_db())
+
+    def cluster_health():
+        mmbot.save_cluster_health_db({
+            'cluster_id': 0, 'pid': os.getpid(), 'shard_ids': [0], 'shard_count': 1, 'guilds': 3,
+            'latencies': {'0': 41.5}, 'metrics': {'dispatch': {}}, 'started_at': time.time()
+        })
+        [row] = [row for row in mmbot.get_cluster_health_db() if row['cluster_id'] == 0]
+        assert row['healthy'] and row['latencies'] == {'0': 41.5} and row['shard_ids'] == [0]
+
+    def app_command_hash():
+        application_id = base + random.randrange(10 ** 9)  # Random so concurrent runs never share a row
+        assert mmbot.get_app_command_hash_db(application_id) is None
+        try:
+            mmbot.set_app_command_hash_db(application_id, 'a' * 64)
+            mmbot.set_app_command_hash_db(application_id, 'b' * 64)
+            assert mmbot.get_app_command_hash_db(application_id) == 'b' * 64
+        finally:
+            mmbot.delete_app_command_hash_db(application_id)
+        assert mmbot.get_app_command_hash_db(application_id) is None
+
+    def query_plans():
+        names = [entry['query'] for entry in mmbot.check_query_plans()]
+        assert names == [name for name, *_ in mmbot.HOT_QUERIES], names
+
+    return [
+        ('ticket_roundtrip', ticket_roundtrip),
+        ('claim_unclaim', claim_unclaim),
+        ('ticket_number_blocks', ticket_number_blocks),
+        ('close_and_archive', close_and_archive),
+        ('activity_and_backfill', activity_and_backfill),
+        ('search_pages', search_pages),
+        ('events_and_rollups', events_and_rollups),
+        ('mm_stats', mm_stats),
+        ('guild_config', guild_config),
+        ('cluster_health', cluster_health),
+        ('app_command_hash', app_command_hash),
+        ('query_plans', query_plans),
+    ]
+
+
+def run_conformance_suite(args):
+    """Run every contract check against the selected backend"""
+    mmbot.delete_guild_data_db(CONFORMANCE_GUILD_ID)
+    try:
+        for name, check in conformance_checks():
+            try:
+                check()
+                print(f'  conformance/{name:<33} ✅')
+            except Exception as e:
+                print(f'  conformance/{name:<33} ❌ {type(e).__name__}: {e}')
+                conformance_failures.append(name)
+    finally:
+        mmbot.delete_guild_data_db(CONFORMANCE_GUILD_ID)
+    return []
+
+
+SUITES = {
+    'conformance': run_conformance_suite,
+    'db': run_db_suite,
+    'embeds': run_embed_suite,
+    'prepared': run_prepared_suite,
+}
+POSTGRES_ONLY_SUITES = {'prepared'}
+
+
+# Reporting
+def print_result(r):
+    print(f"  {r['key']:<45} {r['ops_per_sec']:>10.1f} ops/s   p50 {r['p50_ms']:>8.3f}ms   "
+          f"p95 {r['p95_ms']:>8.3f}ms   p99 {r['p99_ms']:>8.3f}ms")
+
+
+def compare(results, baseline, tolerance):
+    """Return regressions of results against the baseline"""
+    regressions = []
+    for r in results:
+        base = baseline.get(r['key'])
+        if not base:
+            continue
+        if r['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append(f"{r['key']}: {r['ops_per_sec']} ops/s (baseline {base['ops_per_sec']})")
+        if r['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{r['key']}: p99 {r['p99_ms']}ms (baseline {base['p99_ms']}ms)")
+    return regressions
+
+
+def int_list(value):
+    return [int(part) for part in value.split(',') if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bot\'s data-access helpers')
+    parser.add_argument('--backend', choices=['postgres', 'sqlite'], default='postgres', help='Storage backend to run against')
+    parser.add_argument('--sqlite-path', default=os.path.join(tempfile.gettempdir(), 'mmbot-bench.db'), help='Scratch SQLite file')
+    parser.add_argument('--suite', action='append', choices=sorted(SUITES), help='Suites to run (default: all)')
+    parser.add_argument('--sizes', type=int_list, default=[1000, 10000, 100000, 1000000], help='Table sizes to seed')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 4, 16], help='Thread counts to run at')
+    parser.add_argument('--ops', type=int, default=500, help='Calls per helper per run')
+    parser.add_argument('--baseline', help='Baseline results file (default: one per backend)')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=20, help='Allowed regression in percent')
+    args = parser.parse_args()
+
+    args.baseline = args.baseline or BASELINE_FILES[args.backend]
+    mmbot.setup_logging()
+
+    if args.backend == 'postgres':
+        dsn = os.getenv('BENCH_DATABASE_URL')
+        if not dsn:
+            print('❌ ERROR: Set BENCH_DATABASE_URL to a throwaway database (tables are truncated)')
+            return 1
+        mmbot.DATABASE_URL = dsn
+    mmbot.use_storage_backend(args.backend, args.sqlite_path)
+    started = time.perf_counter()
+    mmbot.init_database()
+    print(f'🗄️ {args.backend} ready in {(time.perf_counter() - started) * 1000:.1f}ms')
+
+    results = []
+    for suite in args.suite or sorted(SUITES):
+        if args.backend != 'postgres' and suite in POSTGRES_ONLY_SUITES:
+            print(f'\n⏭️ Suite: {suite} (postgres only)')
+            continue
+        print(f'\n📊 Suite: {suite}')
+        results.extend(SUITES[suite](args))
+
+    if conformance_failures:
+        print(f"\n❌ {args.backend} fails the storage contract: {', '.join(conformance_failures)}")
+        return 1
+
+    if plan_problems:
+        print('\n❌ Hot queries no longer use their indexes:')
+        for line in plan_problems:
+            print(f'  {line}')
+        return 1
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({r['key']: r for r in results}, f, indent=2, sort_keys=True)
+        print(f'\n💾 Baseline saved to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('\nℹ️ No baseline yet - run with --save-baseline to store one')
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance / 100)
+    if regressions:
+        print('\n❌ Regressions against baseline:')
+        for line in regressions:
+            print(f'  {line}')
+        return 1
+    print('\n✅ No regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    finally:
+        mmbot.stop_logging()  # Flush queued log records before the writer thread dies with the process
@@ -1,18 +1,122 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+from discord import app_commands
 from discord.ui import Button, View, Select, Modal, TextInput
+import io
 import os
+import sys
+import copy
+import hashlib
+import time
+import json
+import queue
+import random
 import secrets
-from datetime import datetime
+import logging
+import logging.handlers
+import contextvars
+from datetime import datetime, timedelta
 import asyncio
+import signal
+import resource
+import heapq
+from collections import Counter, OrderedDict, deque
 from flask import Flask
-from threading import Thread
+from threading import Thread, Semaphore, Event as ThreadEvent, get_ident
+from contextlib import contextmanager
 import psycopg2  
-from psycopg2.extras import RealDictCursor  
+import psycopg2.extras
+import psycopg2.extensions
+import psycopg2.errors
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import RealDictCursor, Json
 from dotenv import load_dotenv  
 
 load_dotenv()  # NEW: Load .env file
 
+# Logging
+# Records go onto an in-memory queue from the event loop; a background thread formats
+# them as JSON lines and writes them, so the loop never waits on stdout.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATES = {  # event -> fraction of records kept
+    'coinflip_round': float(os.getenv('LOG_SAMPLE_COINFLIP', '0.05')),
+}
+
+log = logging.getLogger('mmbot')
+log_context = contextvars.ContextVar('log_context', default={})  # guild/channel/user/command of the current task
+_STANDARD_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any extra= fields"""
+    def format(self, record):
+        payload = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_FIELDS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+class ContextFilter(logging.Filter):
+    """Attach the current task's log context and drop unsampled high-volume events"""
+    def filter(self, record):
+        rate = LOG_SAMPLE_RATES.get(getattr(record, 'event', None))
+        if rate is not None:
+            if random.random() >= rate:
+                return False
+            record.sample_rate = rate
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class LoopSafeQueueHandler(logging.handlers.QueueHandler):
+    """Queue the record untouched - formatting happens on the listener thread"""
+    def prepare(self, record):
+        return record
+
+_log_queue = queue.SimpleQueue()
+_log_listener = None
+
+def setup_logging():
+    """Route every logger (ours, discord.py, Flask) through the JSON queue"""
+    global _log_listener
+    if _log_listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    _log_listener = logging.handlers.QueueListener(_log_queue, stream, respect_handler_level=True)
+    _log_listener.start()
+    
+    handler = LoopSafeQueueHandler(_log_queue)
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # Keep-alive pings are noise
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+def log_fields(guild=None, channel=None, user=None, **fields):
+    """Build extra= fields from Discord objects"""
+    if guild is not None:
+        fields['guild'] = guild.id
+    if channel is not None:
+        fields['channel'] = channel.id
+    if user is not None:
+        fields['user'] = user.id
+    return fields
+
 # Keep bot alive
 app = Flask('')
 
@@ -20,6 +124,15 @@ app = Flask('')
 def home():
     return "<h1 style='text-align:center; margin-top:50px; font-family:Arial;'>Bot is Active</h1>"
 
+@app.route('/health')
+def health():
+    """Latest heartbeat from every cluster (or the single process)"""
+    try:
+        clusters = get_cluster_health_db()
+    except Exception as e:
+        return {'ok': False, 'error': str(e)}, 503
+    return {'ok': bool(clusters) and all(c['healthy'] for c in clusters), 'clusters': clusters}
+
 def run():
     app.run(host='0.0.0.0', port=5000)
 
@@ -29,229 +142,2235 @@ def keep_alive():
 
 # Bot Configuration
 PREFIX = '$'
+PREFIX_COMMANDS = os.getenv('PREFIX_COMMANDS', '1') != '0'  # 0 = slash commands (and @mentions) only, no message content intent
 DATABASE_URL = os.getenv('DATABASE_URL')
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'postgres')  # postgres, or sqlite for a single node with no database server
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'mmbot.db')
 TICKET_CATEGORY = 'MM Tickets'
 PROOF_CHANNEL_ID = 1472858074086768774  # CHANGE THIS TO YOUR PROOF CHANNEL ID
 
-# Bot Setup
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+# Sharding - cluster.py sets these for each worker process
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))  # 0 = one unsharded process
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id]
+CLUSTER_ID = int(os.getenv('CLUSTER_ID', '0'))
+CLUSTER_COUNT = int(os.getenv('CLUSTER_COUNT', '1'))
+HEALTH_INTERVAL_SECONDS = 30
+
+# Member cache - 'full' lets discord.py keep every member of every guild in memory;
+# 'lazy' caches none and resolves members on demand into a bounded LRU instead
+MEMBER_CACHE = os.getenv('MEMBER_CACHE', 'full')
+MEMBER_LRU_SIZE = int(os.getenv('MEMBER_LRU_SIZE', '5000'))
+MEMBER_LRU_TTL = 300           # Seconds a resolved member (or "not in guild") is trusted
+MEMBER_QUERY_BATCH = 100       # Most user IDs one gateway member request may carry
+
+# Shared state contract (holds for every process in a cluster deployment):
+# - A guild lives on exactly one shard, so state keyed by guild or channel (config cache,
+#   ticket cache, permission cache) is owned by the one process serving that shard. Each
+#   process only loads and mutates rows for guilds it owns (see owns_guild).
+# - Cross-guild state such as mm_stats and the leaderboard is only ever read from Postgres.
+#   Any cache of it must be short-lived or invalidated with NOTIFY, never shared memory.
+# - Discord's global rate limit is per token, not per process. Background batch workers
+#   pace themselves with shared_rate_delay() so the whole cluster stays under one budget.
+
+# Bot Setup
+intents = discord.Intents.default()
+intents.message_content = PREFIX_COMMANDS
+intents.members = True
+# Without message content Discord only shows the bot messages that mention it
+command_prefix = PREFIX if PREFIX_COMMANDS else commands.when_mentioned
+bot_options = {'command_prefix': command_prefix, 'intents': intents, 'help_command': None}
+if MEMBER_CACHE == 'lazy':
+    bot_options.update(member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(**bot_options, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None)
+else:
+    bot = commands.Bot(**bot_options)
+bot.started_at = time.time()
+
+def shard_for_guild(guild_id):
+    """Shard a guild lives on (Discord's sharding formula)"""
+    return (guild_id >> 22) % SHARD_COUNT if SHARD_COUNT else 0
+
+def owns_guild(guild_id):
+    """Check if this process serves the given guild"""
+    if not SHARD_COUNT or not SHARD_IDS:
+        return True
+    return shard_for_guild(guild_id) in SHARD_IDS
+
+def shared_rate_delay(delay):
+    """Scale a per-process delay so the whole cluster shares one rate budget"""
+    return delay * CLUSTER_COUNT
+
+# Color
+MM_COLOR = 0xFEE75C
+
+# MM Tier definitions with hierarchy
+MM_TIERS = {
+    'basic': {
+        'name': '$1-$15 Middleman',
+        'range': '$1-$15 Worth of Stuff',
+        'emoji': '💲',
+        'level': 1
+    },
+    'advanced': {
+        'name': '$15-$50 Middleman',
+        'range': '$15-$50 Worth of Stuff',
+        'emoji': '💸',
+        'level': 2
+    },
+    'premium': {
+        'name': '$50-$150 Middleman',
+        'range': '$50-$150 Worth of Stuff',
+        'emoji': '💰',
+        'level': 3
+    },
+    'og': {
+        'name': '$150+ Middleman',
+        'range': '$150+ Worth of Stuff',
+        'emoji': '💳',
+        'level': 4
+    }
+}
+
+# MM Role IDs - UPDATE THESE WITH YOUR ROLE IDS
+MM_ROLE_IDS = {
+    "basic": 1427769765484695666,        # 0-150M role ID
+    "advanced": 1424908470075003032,     # 150-500M role ID
+    "premium": 1426475143924027393,      # 500M+ role ID
+    "og": 1425251754584309905         # OG MM role ID
+}
+
+SUPPORT_CATEGORY = 'Support Tickets'
+STAFF_ROLE_ID = 1407252499760680960
+
+# Database connection pool
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_WAIT = float(os.getenv('DB_POOL_WAIT', '10'))  # Seconds to wait for a free connection before giving up
+# Every session runs in UTC, so CURRENT_TIMESTAMP defaults land in the TIMESTAMP columns in
+# the same clock as the datetime.utcnow() the bot compares them with (SLA, inactivity, partitions)
+DB_SESSION_OPTIONS = '-c timezone=UTC'
+
+# Ticket numbers - each process takes a block of numbers from the sequence at a time
+TICKET_NUMBER_BLOCK = 50       # Sequence increment (set by migration 6; later changes need a new migration)
+TICKET_NUMBER_PREFETCH_AT = 10  # Fetch the next block in the background when this many are left
+
+# Trade search - the document every ticket is indexed under (migration 7 indexes exactly
+# this expression, so changing it needs a new migration that rebuilds the indexes)
+SEARCH_DOCUMENT = (
+    "to_tsvector('simple', coalesce(trader, '') || ' ' || coalesce(giving, '') || ' ' || "
+    "coalesce(receiving, '') || ' ' || coalesce(reason, '') || ' ' || coalesce(details, ''))"
+)
+SEARCH_PAGE_SIZE = 5
+SEARCH_QUERY_MAX = 100         # Longest $search query accepted
+
+# Discord rejects a whole message when one of its embeds is over these
+EMBED_TITLE_MAX = 256
+EMBED_FIELD_MAX = 1024
+EMBED_TOTAL_MAX = 6000
+
+# MM leaderboard - pages are filled with members still in the guild, so rows are read
+# in chunks until a page is full (departed MMs are skipped, never shown as gaps)
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_FETCH = 25         # mm_stats rows read (and members resolved) per round trip
+LEADERBOARD_MAX_SCAN = 200     # Most rows one page may read (mm_stats is global); a page short of members then ends early
+
+# Ticket event log - events are buffered in memory and written in bulk
+EVENT_FLUSH_SECONDS = 5        # Flush at least this often
+EVENT_FLUSH_SIZE = 200         # ...or as soon as this many are waiting
+EVENT_BUFFER_MAX = 10000       # If the database is down, keep at most this many (oldest dropped)
+
+# Dispatcher - offers each new MM ticket to one available middleman at a time
+DISPATCH_OFFER_SECONDS = 60    # How long an MM has to accept before the next one is asked
+DISPATCH_METRIC_WINDOW = 200   # Recent claims per tier kept for the time-to-claim percentiles
+
+# SLA escalation - minutes an MM ticket may sit unclaimed (tiers can override with
+# `$config tier <tier> reping_after|escalate_after <minutes>`)
+SLA_REPING_MINUTES = 15        # Re-ping the tier's roles
+SLA_ESCALATE_MINUTES = 45      # Ping the next tier up, or staff from the top tier
+SLA_TICK_SECONDS = 10          # Timing wheel resolution
+SLA_WHEEL_SLOTS = 360          # One turn of the wheel = an hour at 10s ticks
+
+# Inactivity auto-close - per guild with `$config inactivity_hours <hours>` (0 = never)
+INACTIVITY_CLOSE_HOURS = 48    # Default idle time before a ticket is closed
+INACTIVITY_WARN_AT = 0.75      # Warn once a ticket has been idle this fraction of that
+INACTIVITY_SWEEP_MINUTES = 10
+ACTIVITY_FLUSH_SECONDS = 60    # Last-activity times are written in one batch this often
+
+# Ticket history - closed tickets are kept in monthly partitions
+HISTORY_PARTITIONS_AHEAD = 2  # Months of partitions to create in advance
+HISTORY_RETENTION_MONTHS = int(os.getenv('HISTORY_RETENTION_MONTHS', '0'))  # 0 = never detach
+
+# Delays (seconds) - kept as settings so the load-test harness can shorten them
+CLOSE_DELETE_DELAY = 5         # Time to read the close message before the channel goes
+COINFLIP_CHOICE_DELAY = 1      # Pause after both sides are picked
+COINFLIP_START_DELAY = 2       # Pause on the "Coinflip Starting!" embed
+COINFLIP_ROUND_DELAY = 1.5     # Pause between rounds
+
+# Reconciler - repairs drift between ticket rows and ticket channels
+RECONCILE_INTERVAL_MINUTES = 30
+RECONCILE_GRACE_SECONDS = 300  # Channels younger than this may still be mid-creation
+RECONCILE_BATCH_SIZE = 100     # Orphan rows archived per query
+RECONCILE_DELETE_DELAY = 1.0   # Seconds between orphan channel deletions
+
+# Shutdown - everything in flight must drain within this (keep it under the deploy's kill timeout)
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '25'))
+
+# Profiling - $profile samples the event loop thread; the lag monitor runs all the time
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 120
+PROFILE_INTERVAL_MS = 5        # One stack sample this often (~200 Hz)
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')  # Collapsed-stack files are kept here too
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '20'))  # Newest files kept per cluster; older ones are deleted
+LOOP_LAG_TICK_MS = 100         # Heartbeat period of the lag monitor
+LOOP_LAG_THRESHOLD_MS = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '250'))  # Stalls longer than this are recorded
+LOOP_LAG_KEEP = 50             # Slow callbacks remembered for $looplag
+
+
+# Schema Migrations
+# Each migration runs once, in order, in its own transaction. Never edit one that has
+# shipped - add a new one. Early migrations use IF NOT EXISTS so databases created
+# before migrations were versioned pick up cleanly.
+MIGRATION_LOCK_ID = 727001  # Advisory lock so only one process migrates at a time
+
+MIGRATIONS = [
+    (1, 'create tickets and mm_stats', [
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            channel_id BIGINT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            ticket_type VARCHAR(50) NOT NULL,
+            tier VARCHAR(50),
+            trader TEXT,
+            giving TEXT,
+            receiving TEXT,
+            tip TEXT,
+            reason TEXT,
+            details TEXT,
+            claimed_by BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS mm_stats (
+            user_id BIGINT PRIMARY KEY,
+            tickets_completed INTEGER DEFAULT 0,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]),
+    (2, 'ticket history', [
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP",
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS guild_id BIGINT",
+        # Append-only, one partition per month of closed_at
+        """
+        CREATE TABLE IF NOT EXISTS ticket_history (
+            channel_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            ticket_type VARCHAR(50) NOT NULL,
+            tier VARCHAR(50),
+            trader TEXT,
+            giving TEXT,
+            receiving TEXT,
+            tip TEXT,
+            reason TEXT,
+            details TEXT,
+            created_at TIMESTAMP,
+            guild_id BIGINT,
+            claimed_by BIGINT,
+            claimed_at TIMESTAMP,
+            closed_by BIGINT,
+            closed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) PARTITION BY RANGE (closed_at)
+        """,
+        "ALTER TABLE ticket_history ADD COLUMN IF NOT EXISTS guild_id BIGINT"
+    ]),
+    (3, 'guild config', [
+        # NULL columns fall back to the defaults at the top of this file
+        """
+        CREATE TABLE IF NOT EXISTS guild_config (
+            guild_id BIGINT PRIMARY KEY,
+            proof_channel_id BIGINT,
+            staff_role_id BIGINT,
+            ticket_category TEXT,
+            support_category TEXT,
+            mm_role_ids JSONB,
+            mm_tiers JSONB,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]),
+    (4, 'cluster health', [
+        # One heartbeat row per process
+        """
+        CREATE TABLE IF NOT EXISTS cluster_health (
+            cluster_id INTEGER PRIMARY KEY,
+            pid INTEGER,
+            shard_ids INTEGER[],
+            shard_count INTEGER,
+            guilds INTEGER,
+            latencies JSONB,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]),
+    (5, 'indexes for hot queries', [
+        # Leaderboard: walks the index in order and stops at LIMIT (index-only, no sort)
+        "CREATE INDEX IF NOT EXISTS mm_stats_leaderboard_idx ON mm_stats (tickets_completed DESC, user_id DESC)",
+        # Open tickets per user / per claimer / per guild
+        "CREATE INDEX IF NOT EXISTS tickets_user_idx ON tickets (user_id)",
+        "CREATE INDEX IF NOT EXISTS tickets_claimed_by_idx ON tickets (claimed_by) WHERE claimed_by IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS tickets_guild_idx ON tickets (guild_id)",
+        "CREATE INDEX IF NOT EXISTS tickets_created_at_idx ON tickets (created_at)",
+        # Unclaimed MM tickets per tier, oldest first - only holds rows waiting for a middleman
+        """
+        CREATE INDEX IF NOT EXISTS tickets_unclaimed_tier_idx ON tickets (tier, created_at)
+        WHERE claimed_by IS NULL AND ticket_type = 'mm'
+        """,
+        # History lookups (created on every partition)
+        "CREATE INDEX IF NOT EXISTS ticket_history_user_idx ON ticket_history (user_id)",
+        "CREATE INDEX IF NOT EXISTS ticket_history_claimed_by_idx ON ticket_history (claimed_by)",
+        "CREATE INDEX IF NOT EXISTS ticket_history_channel_idx ON ticket_history (channel_id)"
+    ]),
+    (6, 'ticket numbers', [
+        f"CREATE SEQUENCE IF NOT EXISTS ticket_number_seq INCREMENT BY {TICKET_NUMBER_BLOCK}",
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS ticket_number BIGINT",
+        "ALTER TABLE ticket_history ADD COLUMN IF NOT EXISTS ticket_number BIGINT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS tickets_number_idx ON tickets (ticket_number)",
+        "CREATE INDEX IF NOT EXISTS ticket_history_number_idx ON ticket_history (ticket_number)"
+    ]),
+    (7, 'trade search', [
+        # Expression indexes rather than stored tsvector columns, so rows read with SELECT * stay small
+        f"CREATE INDEX IF NOT EXISTS tickets_search_idx ON tickets USING GIN (({SEARCH_DOCUMENT}))",
+        f"CREATE INDEX IF NOT EXISTS ticket_history_search_idx ON ticket_history USING GIN (({SEARCH_DOCUMENT}))"
+    ]),
+    (8, 'ticket event log and rollups', [
+        # Append-only: rows are only ever inserted
+        """
+        CREATE TABLE IF NOT EXISTS ticket_events (
+            id BIGSERIAL PRIMARY KEY,
+            occurred_at TIMESTAMP NOT NULL,
+            event TEXT NOT NULL,
+            guild_id BIGINT,
+            channel_id BIGINT NOT NULL,
+            ticket_number BIGINT,
+            tier TEXT,
+            actor_id BIGINT,
+            target_id BIGINT,
+            seconds DOUBLE PRECISION
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ticket_events_channel_idx ON ticket_events (channel_id)",
+        # Daily time-to-claim / time-to-close totals per tier and MM (mm_id 0 = never claimed),
+        # updated in the same transaction as the events they count
+        """
+        CREATE TABLE IF NOT EXISTS ticket_rollups (
+            guild_id BIGINT NOT NULL,
+            day DATE NOT NULL,
+            tier TEXT NOT NULL,
+            mm_id BIGINT NOT NULL,
+            claims INTEGER NOT NULL DEFAULT 0,
+            claim_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            closes INTEGER NOT NULL DEFAULT 0,
+            close_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, day, tier, mm_id)
+        )
+        """
+    ]),
+    (9, 'cluster health metrics', [
+        "ALTER TABLE cluster_health ADD COLUMN IF NOT EXISTS metrics JSONB"
+    ]),
+    (10, 'ticket inactivity', [
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMP",
+        "ALTER TABLE guild_config ADD COLUMN IF NOT EXISTS inactivity_hours REAL"
+    ]),
+    (11, 'app command sync', [
+        # Hash of the slash command tree last pushed to Discord, per application
+        """
+        CREATE TABLE IF NOT EXISTS app_command_sync (
+            application_id BIGINT PRIMARY KEY,
+            command_hash TEXT NOT NULL,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def run_migrations(conn, cur):
+    """Apply every migration newer than the database, returning their versions"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    
+    newly_applied = []
+    for version, name, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        for statement in statements:
+            cur.execute(statement)
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        conn.commit()
+        newly_applied.append(version)
+    return newly_applied
+
+def migrate_database_db():
+    """Apply pending migrations under the migration lock, returning their versions"""
+    conn = psycopg2.connect(DATABASE_URL, options=DB_SESSION_OPTIONS)
+    cur = conn.cursor()
+    
+    # Session lock - released when the connection closes
+    cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    applied = run_migrations(conn, cur)
+    ensure_history_partitions(cur)
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    return applied
+
+def init_database():
+    """Brings the database schema up to date when bot starts"""
+    try:
+        applied = migrate_database_db()
+        if applied:
+            log.info('Applied migrations', extra={'event': 'migrations_applied', 'versions': applied})
+        log.info('Database ready', extra={'event': 'db_ready', 'backend': storage_backend, 'schema_version': SCHEMA_VERSION})
+    except Exception:
+        log.exception('Database error', extra={'event': 'db_error'})
+
+def get_db():
+    """Get a dedicated database connection (for LISTEN, DDL and other one-offs)"""
+    return psycopg2.connect(DATABASE_URL, options=DB_SESSION_OPTIONS)
+
+# Connection Pool & Prepared Statements
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection that remembers which statements it has prepared"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+# name -> (parameter types, statement). Prepared once per pooled connection on first use.
+PREPARED_STATEMENTS = {
+    'get_ticket': ('(BIGINT)', "SELECT * FROM tickets WHERE channel_id = $1"),
+    'claim_ticket': ('(BIGINT, BIGINT)', """
+        UPDATE tickets SET claimed_by = $2, claimed_at = CURRENT_TIMESTAMP WHERE channel_id = $1
+        RETURNING EXTRACT(EPOCH FROM claimed_at - created_at)
+    """),
+    'unclaim_ticket': ('(BIGINT)', "UPDATE tickets SET claimed_by = NULL, claimed_at = NULL WHERE channel_id = $1"),
+    'increment_mm_stats': ('(BIGINT)', """
+        INSERT INTO mm_stats (user_id, tickets_completed, last_updated)
+        VALUES ($1, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET
+            tickets_completed = mm_stats.tickets_completed + 1,
+            last_updated = CURRENT_TIMESTAMP
+    """),
+    'get_mm_stats': ('(BIGINT)', "SELECT * FROM mm_stats WHERE user_id = $1"),
+}
+
+_pool = None
+_pool_slots = Semaphore(DB_POOL_MAX)  # ThreadedConnectionPool errors when empty - wait instead
+
+def get_pool():
+    """Get the shared connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL, connection_factory=PreparedConnection,
+                                       options=DB_SESSION_OPTIONS)
+    return _pool
+
+def close_pool():
+    """Close every pooled connection"""
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+@contextmanager
+def pooled_db():
+    """Borrow a pooled connection; commits on success, rolls back on error
+    
+    Blocks until a connection is free, so call it from a worker thread (asyncio.to_thread).
+    """
+    if not _pool_slots.acquire(timeout=DB_POOL_WAIT):
+        raise RuntimeError(f'No database connection free after {DB_POOL_WAIT:g}s (all {DB_POOL_MAX} in use)')
+    try:
+        pool = get_pool()
+        conn = pool.getconn()
+    except Exception:
+        _pool_slots.release()  # Server unreachable - hand the slot back or the pool drains for good
+        raise
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+        _pool_slots.release()
+
+def execute_prepared(cur, name, params):
+    """Run a statement from PREPARED_STATEMENTS by handle, preparing it if needed.
+    
+    Only use for single-statement transactions: if a migration changed a table
+    under a prepared SELECT *, the transaction is rolled back and the statement
+    is re-prepared and run again.
+    """
+    conn = cur.connection
+    placeholders = ', '.join(['%s'] * len(params))
+    for attempt in range(2):
+        if name not in conn.prepared:
+            types, sql = PREPARED_STATEMENTS[name]
+            cur.execute(f"PREPARE {name} {types} AS {sql}")
+            conn.prepared.add(name)
+        try:
+            cur.execute(f"EXECUTE {name} ({placeholders})", params)
+            return
+        except psycopg2.errors.FeatureNotSupported:
+            # "cached plan must not change result type"
+            if attempt:
+                raise
+            conn.rollback()
+            cur.execute(f"DEALLOCATE {name}")
+            conn.prepared.discard(name)
+
+# Ticket History Partitions
+_history_partitions = set()  # Partitions we know exist, so the close path never re-checks
+
+def month_start(dt):
+    """Get the first instant of the month containing dt"""
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(dt):
+    """Get the first instant of the month after dt"""
+    return month_start(month_start(dt) + timedelta(days=32))
+
+def history_partition_name(month):
+    """Name of the ticket_history partition holding the given month"""
+    return f"ticket_history_{month:%Y_%m}"
+
+def ensure_history_partitions(cur, months_ahead=HISTORY_PARTITIONS_AHEAD):
+    """Create ticket_history partitions for this month and the next few"""
+    month = month_start(datetime.utcnow())
+    for _ in range(months_ahead + 1):
+        name = history_partition_name(month)
+        if name not in _history_partitions:
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF ticket_history FOR VALUES FROM (%s) TO (%s)",
+                (month, next_month(month))
+            )
+            _history_partitions.add(name)
+        month = next_month(month)
+
+def detach_old_history_partitions(keep_months=HISTORY_RETENTION_MONTHS):
+    """Detach ticket_history partitions older than keep_months.
+    
+    Uses DETACH PARTITION CONCURRENTLY (Postgres 14+) so live inserts into
+    ticket_history are never blocked. Detached tables are left in place for
+    archiving or dropping by hand. Returns the detached table names.
+    """
+    if keep_months <= 0:
+        return []
+    
+    cutoff = month_start(datetime.utcnow())
+    for _ in range(keep_months):
+        cutoff = month_start(cutoff - timedelta(days=1))
+    
+    conn = get_db()
+    conn.autocommit = True  # CONCURRENTLY cannot run inside a transaction block
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'ticket_history'
+    """)
+    partitions = [row[0] for row in cur.fetchall()]
+    
+    detached = []
+    for name in sorted(partitions):
+        if name >= history_partition_name(cutoff):
+            continue
+        cur.execute(f"ALTER TABLE ticket_history DETACH PARTITION {name} CONCURRENTLY")
+        _history_partitions.discard(name)
+        detached.append(name)
+    
+    cur.close()
+    conn.close()
+    return detached
+
+def maintain_history_db():
+    """Create upcoming history partitions and detach expired ones, returning the detached names"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        ensure_history_partitions(cur)
+        cur.close()
+    return detach_old_history_partitions()
+
+# Ticket Numbers
+# Hi/lo allocation: one nextval() reserves a whole block (the sequence increments by the
+# block size) and numbers inside it are handed out from memory. The next block is fetched
+# in the background before this one runs out, so creating a ticket never waits on it.
+# Numbers are unique across processes and increase within each one; a block left unused
+# at shutdown is simply skipped.
+_ticket_numbers = {'next': 0, 'end': 0, 'spare': None}  # Current block [next, end) and the prefetched one
+_number_prefetch = None
+ticket_number_fallbacks = 0  # Times the prefetch fell behind (raise TICKET_NUMBER_BLOCK if this grows)
+
+def fetch_ticket_number_block():
+    """Reserve the next block of ticket numbers, returned as (start, end)"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT nextval('ticket_number_seq'), increment_by FROM pg_sequences
+            WHERE schemaname = current_schema() AND sequencename = 'ticket_number_seq'
+        """)
+        start, size = cur.fetchone()
+        cur.close()
+    return start, start + size
+
+async def prefetch_ticket_numbers():
+    """Fetch the spare block off the event loop"""
+    global _number_prefetch
+    try:
+        block = await asyncio.to_thread(fetch_ticket_number_block)
+        if _ticket_numbers['spare'] is None:
+            _ticket_numbers['spare'] = block
+    except Exception:
+        log.exception('Ticket number prefetch failed', extra={'event': 'ticket_number_prefetch_error'})
+    finally:
+        _number_prefetch = None
+
+async def next_ticket_number():
+    """Hand out the next ticket number (call from the event loop)"""
+    global _number_prefetch, ticket_number_fallbacks
+    numbers = _ticket_numbers
+    while numbers['next'] >= numbers['end']:
+        if numbers['spare'] is not None:
+            numbers['next'], numbers['end'] = numbers['spare']
+            numbers['spare'] = None
+            continue
+        # Prefetch fell behind: fetch off the loop, then re-check - another ticket may have refilled meanwhile
+        ticket_number_fallbacks += 1
+        log.warning('Ticket number prefetch fell behind', extra={
+            'event': 'ticket_number_fallback', 'fallbacks': ticket_number_fallbacks, 'block': TICKET_NUMBER_BLOCK
+        })
+        block = await asyncio.to_thread(fetch_ticket_number_block)
+        if numbers['next'] >= numbers['end']:
+            numbers['next'], numbers['end'] = block
+        elif numbers['spare'] is None:
+            numbers['spare'] = block
+    number = numbers['next']
+    numbers['next'] += 1
+    
+    if (numbers['spare'] is None and _number_prefetch is None
+            and numbers['end'] - numbers['next'] <= TICKET_NUMBER_PREFETCH_AT):
+        _number_prefetch = asyncio.get_running_loop().create_task(prefetch_ticket_numbers())
+    return number
+
+def save_ticket(channel_id, user_id, ticket_type, **kwargs):
+    """Save a ticket to database and return the stored row"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            INSERT INTO tickets (channel_id, user_id, ticket_type, ticket_number, guild_id, tier, trader, giving, receiving, tip, reason, details)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING *
+        """, (
+            channel_id, user_id, ticket_type, kwargs.get('ticket_number'), kwargs.get('guild_id'),
+            kwargs.get('tier'), kwargs.get('trader'), kwargs.get('giving'),
+            kwargs.get('receiving'), kwargs.get('tip'),
+            kwargs.get('reason'), kwargs.get('details')
+        ))
+        result = cur.fetchone()
+        cur.close()
+    return dict(result)
+
+def get_ticket(channel_id):
+    """Get ticket data from database"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        execute_prepared(cur, 'get_ticket', (channel_id,))
+        result = cur.fetchone()
+        cur.close()
+    return result
+
+def claim_ticket_db(channel_id, user_id):
+    """Mark ticket as claimed, returning the seconds it waited (None if no row)"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        execute_prepared(cur, 'claim_ticket', (channel_id, user_id))
+        result = cur.fetchone()
+        cur.close()
+    return float(result[0]) if result and result[0] is not None else None
+
+def unclaim_ticket_db(channel_id):
+    """Remove claim from ticket"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        execute_prepared(cur, 'unclaim_ticket', (channel_id,))
+        cur.close()
+
+def archive_tickets(cur, channel_ids, closed_by=None):
+    """Move tickets out of the live table into ticket history, returning the archived rows"""
+    ensure_history_partitions(cur)
+    cur.execute("""
+        WITH closed AS (
+            DELETE FROM tickets WHERE channel_id = ANY(%s) RETURNING *
+        )
+        INSERT INTO ticket_history (
+            channel_id, user_id, ticket_type, tier, trader, giving, receiving, tip, reason, details,
+            created_at, guild_id, claimed_by, claimed_at, ticket_number, closed_by, closed_at
+        )
+        SELECT channel_id, user_id, ticket_type, tier, trader, giving, receiving, tip, reason, details,
+               created_at, guild_id, claimed_by, claimed_at, ticket_number, %s, CURRENT_TIMESTAMP
+        FROM closed
+        RETURNING channel_id, guild_id, tier, ticket_number, claimed_by,
+                  EXTRACT(EPOCH FROM closed_at - created_at)::float AS open_seconds
+    """, (list(channel_ids), closed_by))
+    return cur.fetchall()
+
+def delete_ticket_db(channel_id, closed_by=None):
+    """Move ticket out of the live table into ticket history, returning the archived row"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        closed = archive_tickets(cur, [channel_id], closed_by)
+        cur.close()
+    return closed[0] if closed else None
+
+def save_ticket_activity_db(pairs):
+    """Write a batch of (channel_id, last_activity_at) in one statement"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        psycopg2.extras.execute_values(cur, """
+            UPDATE tickets SET last_activity_at = v.last_activity_at
+            FROM (VALUES %s) AS v (channel_id, last_activity_at)
+            WHERE tickets.channel_id = v.channel_id
+        """, pairs, template='(%s::bigint, %s::timestamp)')
+        cur.close()
+
+def get_live_tickets_db():
+    """Get every live ticket row this process owns"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if SHARD_COUNT and SHARD_IDS:
+            cur.execute(
+                "SELECT * FROM tickets WHERE guild_id IS NULL OR ((guild_id >> 22) %% %s) = ANY(%s)",
+                (SHARD_COUNT, SHARD_IDS)
+            )
+        else:
+            cur.execute("SELECT * FROM tickets")
+        results = cur.fetchall()
+        cur.close()
+    return results
+
+def backfill_ticket_guilds_db(pairs):
+    """Record guild_id on older tickets that were saved without one"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        psycopg2.extras.execute_values(cur, """
+            UPDATE tickets SET guild_id = v.guild_id
+            FROM (VALUES %s) AS v (channel_id, guild_id)
+            WHERE tickets.channel_id = v.channel_id
+        """, pairs)
+        cur.close()
+
+def archive_orphan_tickets_db(channel_ids):
+    """Move tickets whose channel is gone into history, in batches, returning the archived rows"""
+    archived = []
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        for i in range(0, len(channel_ids), RECONCILE_BATCH_SIZE):
+            archived.extend(archive_tickets(cur, channel_ids[i:i + RECONCILE_BATCH_SIZE]))
+            conn.commit()
+        cur.close()
+    return archived
+
+def increment_mm_stats(user_id):
+    """Add 1 to MM's completed tickets"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        execute_prepared(cur, 'increment_mm_stats', (user_id,))
+        cur.close()
+
+def get_mm_stats_db(user_id):
+    """Get MM statistics from database"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        execute_prepared(cur, 'get_mm_stats', (user_id,))
+        result = cur.fetchone()
+        cur.close()
+    return result if result else {'user_id': user_id, 'tickets_completed': 0}
+
+def get_mm_leaderboard_db(limit=10, after=None):
+    """Get top MMs from database, continuing after a (tickets_completed, user_id) cursor"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if after is None:
+            cur.execute("SELECT user_id, tickets_completed FROM mm_stats ORDER BY tickets_completed DESC, user_id DESC LIMIT %s", (limit,))
+        else:
+            # Keyset: walks the leaderboard index from the cursor, however deep the page
+            cur.execute("""
+                SELECT user_id, tickets_completed FROM mm_stats
+                WHERE (tickets_completed, user_id) < (%s, %s)
+                ORDER BY tickets_completed DESC, user_id DESC LIMIT %s
+            """, (after[0], after[1], limit))
+        results = cur.fetchall()
+        cur.close()
+    return results
+
+def count_mm_stats_db():
+    """Number of MMs with statistics"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM mm_stats")
+        result = cur.fetchone()[0]
+        cur.close()
+    return result
+
+def search_tickets_db(guild_id, query, before=None, limit=SEARCH_PAGE_SIZE):
+    """Full-text search over a guild's open and closed tickets, newest first.
+    
+    `before` is the (created_at, channel_id) of the last row on the previous page.
+    Returns up to limit + 1 rows so the caller can tell whether another page exists.
+    """
+    conditions = f"guild_id = %(guild_id)s AND {SEARCH_DOCUMENT} @@ websearch_to_tsquery('simple', %(query)s)"
+    if before:
+        conditions += " AND (created_at, channel_id) < (%(before_at)s, %(before_id)s)"
+    columns = "ticket_number, channel_id, user_id, ticket_type, tier, trader, giving, receiving, reason, created_at"
+    params = {'guild_id': guild_id, 'query': query, 'limit': limit + 1}
+    if before:
+        params['before_at'], params['before_id'] = before
+    
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(f"""
+            SELECT * FROM (
+                SELECT {columns}, NULL::timestamp AS closed_at FROM tickets WHERE {conditions}
+                UNION ALL
+                SELECT {columns}, closed_at FROM ticket_history WHERE {conditions}
+            ) found
+            ORDER BY created_at DESC, channel_id DESC
+            LIMIT %(limit)s
+        """, params)
+        results = cur.fetchall()
+        cur.close()
+    return results
+
+def write_ticket_events_db(events):
+    """Insert a batch of ticket events and fold them into the daily rollups, atomically"""
+    rollups = {}
+    for e in events:
+        if e['event'] == 'claimed' and e['seconds'] is not None:
+            mm_id, claims, closes = e['actor_id'], 1, 0
+        elif e['event'] == 'closed' and e['seconds'] is not None:
+            mm_id, claims, closes = e['target_id'] or 0, 0, 1
+        else:
+            continue
+        key = (e['guild_id'] or 0, e['occurred_at'].date(), e['tier'] or 'support', mm_id)
+        totals = rollups.setdefault(key, [0, 0.0, 0, 0.0])
+        totals[0] += claims
+        totals[1] += e['seconds'] if claims else 0.0
+        totals[2] += closes
+        totals[3] += e['seconds'] if closes else 0.0
+    
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO ticket_events (occurred_at, event, guild_id, channel_id, ticket_number, tier, actor_id, target_id, seconds)
+            VALUES %s
+        """, events, template="""(
+            %(occurred_at)s, %(event)s, %(guild_id)s, %(channel_id)s, %(ticket_number)s,
+            %(tier)s, %(actor_id)s, %(target_id)s, %(seconds)s
+        )""", page_size=EVENT_FLUSH_SIZE)
+        if rollups:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO ticket_rollups AS r (guild_id, day, tier, mm_id, claims, claim_seconds, closes, close_seconds)
+                VALUES %s
+                ON CONFLICT (guild_id, day, tier, mm_id) DO UPDATE SET
+                    claims = r.claims + excluded.claims,
+                    claim_seconds = r.claim_seconds + excluded.claim_seconds,
+                    closes = r.closes + excluded.closes,
+                    close_seconds = r.close_seconds + excluded.close_seconds
+            """, [key + tuple(totals) for key, totals in rollups.items()])
+        cur.close()
+
+def get_ticket_rollups_db(guild_id, since, mm_id=None):
+    """Time-to-claim and time-to-close totals per tier since a date"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT tier, SUM(claims) AS claims, SUM(claim_seconds) AS claim_seconds,
+                   SUM(closes) AS closes, SUM(close_seconds) AS close_seconds
+            FROM ticket_rollups
+            WHERE guild_id = %s AND day >= %s AND (%s::bigint IS NULL OR mm_id = %s)
+            GROUP BY tier
+            ORDER BY tier
+        """, (guild_id, since, mm_id, mm_id))
+        results = cur.fetchall()
+        cur.close()
+    return results
+
+def delete_guild_data_db(guild_id):
+    """Remove every ticket, history, event and rollup row of one guild (load tests and benchmarks)"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        for table in ('tickets', 'ticket_history', 'ticket_events', 'ticket_rollups'):
+            cur.execute(f"DELETE FROM {table} WHERE guild_id = %s", (guild_id,))
+        cur.close()
+
+def delete_mm_stats_db(user_ids):
+    """Remove the mm_stats rows of the given users (load tests and benchmarks)"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM mm_stats WHERE user_id = ANY(%s)", (list(user_ids),))
+        cur.close()
+
+# Ticket Registry
+# Every live ticket this process owns, keyed by channel ID. The create, claim, unclaim
+# and close paths keep it in step with the database, and the reconciler fills it at
+# startup - so ticket commands never query, and non-ticket channels cost nothing.
+ticket_registry = {}     # channel_id -> ticket row
+_registry_ready = False  # Until the first load, lookups fall back to the database
+# Channels forgotten since startup (IDs are never reused): a database read that was in
+# flight when a ticket closed may still return its row, and must not bring it back
+_closed_tickets = OrderedDict()
+CLOSED_TICKETS_REMEMBERED = 10000
+
+def register_ticket(row):
+    """Add or replace a ticket in the registry"""
+    ticket_registry[row['channel_id']] = dict(row)
+    return ticket_registry[row['channel_id']]
+
+def forget_ticket(channel_id):
+    """Drop a ticket from the registry"""
+    _closed_tickets[channel_id] = None
+    if len(_closed_tickets) > CLOSED_TICKETS_REMEMBERED:
+        _closed_tickets.popitem(last=False)
+    return ticket_registry.pop(channel_id, None)
+
+def lookup_ticket(channel_id):
+    """Get a live ticket row, or None if the channel isn't a ticket"""
+    if _registry_ready:
+        return ticket_registry.get(channel_id)
+    row = get_ticket(channel_id)
+    return register_ticket(row) if row else None
+
+def sync_ticket_registry(rows):
+    """Load rows from the database into the registry.
+    
+    The first load fills the registry and switches lookups to memory only.
+    Later loads only add rows the registry is missing - live entries are
+    already authoritative and may be newer than the rows read - and skip
+    tickets closed since, whose rows the read may have caught before the delete.
+    """
+    global _registry_ready
+    for row in rows:
+        if row['channel_id'] not in ticket_registry and row['channel_id'] not in _closed_tickets:
+            register_ticket(row)
+    _registry_ready = True
+
+# Query Plan Checks
+SEQ_SCAN_ROW_LIMIT = 1000  # Below this many rows a seq scan or sort is the cheapest plan anyway
+
+# (name, sql, sample params, must be index-only)
+HOT_QUERIES = [
+    ('get_ticket', "SELECT * FROM tickets WHERE channel_id = %s", (0,), False),
+    ('get_mm_stats', "SELECT * FROM mm_stats WHERE user_id = %s", (0,), False),
+    ('leaderboard', "SELECT user_id, tickets_completed FROM mm_stats ORDER BY tickets_completed DESC, user_id DESC LIMIT %s", (10,), True),
+    ('leaderboard_page', """
+        SELECT user_id, tickets_completed FROM mm_stats
+        WHERE (tickets_completed, user_id) < (%s, %s)
+        ORDER BY tickets_completed DESC, user_id DESC LIMIT %s
+    """, (100, 0, 10), True),
+    ('open_tickets_for_user', "SELECT channel_id FROM tickets WHERE user_id = %s", (0,), False),
+    ('claimed_by_mm', "SELECT channel_id FROM tickets WHERE claimed_by = %s", (0,), False),
+    ('unclaimed_for_tier', """
+        SELECT channel_id, created_at FROM tickets
+        WHERE claimed_by IS NULL AND ticket_type = 'mm' AND tier = %s
+        ORDER BY created_at
+    """, ('basic',), False),
+    ('search_tickets', f"SELECT channel_id FROM tickets WHERE {SEARCH_DOCUMENT} @@ websearch_to_tsquery('simple', %s)", ('paypal',), False),
+]
+
+def _plan_nodes(plan):
+    """Walk every node of an EXPLAIN (FORMAT JSON) plan"""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+def check_query_plans():
+    """EXPLAIN each hot query and flag plans that won't hold up as tables grow.
+    
+    A sequential scan or sort over a table past SEQ_SCAN_ROW_LIMIT rows is a
+    problem, as is a query marked index-only that no longer gets one.
+    """
+    conn = get_db()
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT relname, GREATEST(reltuples, 0) FROM pg_class WHERE relname IN ('tickets', 'mm_stats')")
+    table_rows = {name: int(rows) for name, rows in cur.fetchall()}
+    
+    report = []
+    for name, sql, params, index_only in HOT_QUERIES:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        nodes = list(_plan_nodes(cur.fetchone()[0][0]['Plan']))
+        tables = {node['Relation Name'] for node in nodes if 'Relation Name' in node}
+        big = any(table_rows.get(table, 0) >= SEQ_SCAN_ROW_LIMIT for table in tables)
+        
+        problems = []
+        if big:
+            for node in nodes:
+                if node['Node Type'] == 'Seq Scan':
+                    problems.append(f"Seq Scan on {node['Relation Name']}")
+                elif node['Node Type'] == 'Sort':
+                    problems.append('Sort')
+            if index_only and not any(node['Node Type'] == 'Index Only Scan' for node in nodes):
+                problems.append('not index-only')
+        
+        report.append({
+            'query': name,
+            'plan': ' > '.join(
+                node['Node Type'] + (f" ({node['Index Name']})" if 'Index Name' in node else '')
+                for node in nodes
+            ),
+            'problems': problems
+        })
+    
+    cur.close()
+    conn.close()
+    return report
+
+# Guild Configuration
+# Every guild's settings live in memory; hot paths call get_guild_config() and never query.
+# Changes are written by $config and broadcast with NOTIFY so every process reloads them.
+CONFIG_CHANNEL = 'guild_config'
+
+DEFAULT_GUILD_CONFIG = {
+    'proof_channel_id': PROOF_CHANNEL_ID,
+    'staff_role_id': STAFF_ROLE_ID,
+    'ticket_category': TICKET_CATEGORY,
+    'support_category': SUPPORT_CATEGORY,
+    'mm_role_ids': MM_ROLE_IDS,
+    'mm_tiers': MM_TIERS,
+    'inactivity_hours': INACTIVITY_CLOSE_HOURS
+}
+
+guild_configs = {}  # guild_id -> config dict (same shape as DEFAULT_GUILD_CONFIG)
+_config_listener = None
+
+def build_guild_config(row):
+    """Merge a guild_config row over the defaults"""
+    config = dict(DEFAULT_GUILD_CONFIG)
+    for key in ('proof_channel_id', 'staff_role_id', 'ticket_category', 'support_category', 'inactivity_hours'):
+        if row.get(key) is not None:
+            config[key] = row[key]
+    if row.get('mm_role_ids'):
+        config['mm_role_ids'] = {tier: int(role_id) for tier, role_id in row['mm_role_ids'].items()}
+    if row.get('mm_tiers'):
+        # JSONB doesn't keep key order, so put tiers back in level order
+        config['mm_tiers'] = dict(sorted(row['mm_tiers'].items(), key=lambda item: item[1]['level']))
+    return config
+
+def get_guild_config(guild_id):
+    """Get a guild's config from memory (never touches the database)"""
+    return guild_configs.get(guild_id, DEFAULT_GUILD_CONFIG)
+
+def get_guild_config_rows_db(guild_id=None):
+    """Get config rows - one guild, or all when guild_id is None"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if guild_id is None:
+            cur.execute("SELECT * FROM guild_config")
+        else:
+            cur.execute("SELECT * FROM guild_config WHERE guild_id = %s", (guild_id,))
+        rows = cur.fetchall()
+        cur.close()
+    return rows
+
+def load_guild_configs(guild_id=None):
+    """Load config rows into the cache - one guild, or all when guild_id is None"""
+    rows = get_guild_config_rows_db(guild_id)
+    
+    if guild_id is None:
+        guild_configs.clear()
+        _permission_matrices.clear()
+        _member_masks.clear()
+    else:
+        guild_configs.pop(guild_id, None)
+        invalidate_permissions(guild_id)
+    for row in rows:
+        if owns_guild(row['guild_id']):
+            guild_configs[row['guild_id']] = build_guild_config(row)
+    return len(rows)
+
+def set_guild_config_db(guild_id, key, value):
+    """Change one config value and notify every process"""
+    if key in ('mm_role_ids', 'mm_tiers'):
+        value = Json(value)
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            INSERT INTO guild_config (guild_id, {key}, updated_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (guild_id) DO UPDATE SET
+                {key} = EXCLUDED.{key},
+                updated_at = CURRENT_TIMESTAMP
+        """, (guild_id, value))
+        cur.execute("SELECT pg_notify(%s, %s)", (CONFIG_CHANNEL, str(guild_id)))
+        cur.close()
+
+def _on_config_notify():
+    """Reader callback for the LISTEN connection"""
+    global _config_listener
+    conn = _config_listener
+    try:
+        conn.poll()
+    except psycopg2.Error as e:
+        log.warning('Config listener lost: %s', e, extra={'event': 'config_listener_lost'})
+        bot.loop.remove_reader(conn.fileno())
+        _config_listener = None
+        bot.loop.create_task(start_config_listener())
+        return
+    
+    guild_ids = set()
+    while conn.notifies:
+        guild_id = int(conn.notifies.pop(0).payload)
+        if owns_guild(guild_id):
+            guild_ids.add(guild_id)
+    for guild_id in guild_ids:
+        bot.loop.create_task(asyncio.to_thread(load_guild_configs, guild_id))
+
+async def start_config_listener():
+    """LISTEN for config changes and reload the whole cache"""
+    global _config_listener
+    if _config_listener is not None:
+        return
+    if storage_backend == 'sqlite':
+        # One process, nobody else to hear from
+        count = await asyncio.to_thread(load_guild_configs)
+        log.info('Loaded guild config', extra={'event': 'config_loaded', 'guilds': count})
+        return
+    try:
+        conn = get_db()
+        conn.autocommit = True
+        conn.cursor().execute(f"LISTEN {CONFIG_CHANNEL}")
+        _config_listener = conn
+        bot.loop.add_reader(conn.fileno(), _on_config_notify)
+        
+        # Reload after LISTEN so no change made in between is missed
+        count = await asyncio.to_thread(load_guild_configs)
+        log.info('Loaded guild config', extra={'event': 'config_loaded', 'guilds': count})
+    except Exception:
+        log.exception('Config listener error', extra={'event': 'config_listener_error'})
+        await asyncio.sleep(5)
+        bot.loop.create_task(start_config_listener())
+
+# Cluster Health
+def shard_latencies():
+    """Gateway latency in ms for each shard this process runs"""
+    if isinstance(bot, commands.AutoShardedBot):
+        pairs = bot.latencies
+    else:
+        pairs = [(0, bot.latency)]
+    # Latency is inf/nan until the first heartbeat ack
+    return {str(shard_id): round(latency * 1000, 1) if latency == latency and latency != float('inf') else None
+            for shard_id, latency in pairs}
+
+def cluster_heartbeat(metrics=None):
+    """This process's heartbeat row (built on the event loop, written from a thread)"""
+    return {
+        'cluster_id': CLUSTER_ID,
+        'pid': os.getpid(),
+        'shard_ids': SHARD_IDS or [0],
+        'shard_count': SHARD_COUNT or 1,
+        'guilds': len(bot.guilds),
+        'latencies': shard_latencies(),
+        'metrics': metrics or {},
+        'started_at': bot.started_at
+    }
+
+def save_cluster_health_db(heartbeat):
+    """Write a heartbeat from cluster_heartbeat()"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO cluster_health (cluster_id, pid, shard_ids, shard_count, guilds, latencies, metrics, started_at, updated_at)
+            VALUES (%(cluster_id)s, %(pid)s, %(shard_ids)s, %(shard_count)s, %(guilds)s, %(latencies)s, %(metrics)s,
+                    to_timestamp(%(started_at)s), CURRENT_TIMESTAMP)
+            ON CONFLICT (cluster_id) DO UPDATE SET
+                pid = EXCLUDED.pid,
+                shard_ids = EXCLUDED.shard_ids,
+                shard_count = EXCLUDED.shard_count,
+                guilds = EXCLUDED.guilds,
+                latencies = EXCLUDED.latencies,
+                metrics = EXCLUDED.metrics,
+                started_at = EXCLUDED.started_at,
+                updated_at = CURRENT_TIMESTAMP
+        """, dict(heartbeat, latencies=Json(heartbeat['latencies']), metrics=Json(heartbeat['metrics'])))
+        cur.close()
+
+def get_cluster_health_db():
+    """Get every cluster's latest heartbeat, flagging stale ones"""
+    with pooled_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT cluster_id, pid, shard_ids, shard_count, guilds, latencies, metrics,
+                   EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - updated_at)) AS age_seconds
+            FROM cluster_health
+            WHERE cluster_id < %s
+            ORDER BY cluster_id
+        """, (CLUSTER_COUNT,))
+        results = cur.fetchall()
+        cur.close()
+    for row in results:
+        row['age_seconds'] = float(row['age_seconds'])
+        row['healthy'] = row['age_seconds'] < HEALTH_INTERVAL_SECONDS * 3
+    return results
+
+def get_app_command_hash_db(application_id):
+    """Hash of the command tree last synced for this application (None if never)"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT command_hash FROM app_command_sync WHERE application_id = %s", (application_id,))
+        row = cur.fetchone()
+        cur.close()
+    return row[0] if row else None
+
+def set_app_command_hash_db(application_id, command_hash):
+    """Record the hash of the command tree just synced"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO app_command_sync (application_id, command_hash, synced_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (application_id) DO UPDATE SET
+                command_hash = EXCLUDED.command_hash,
+                synced_at = CURRENT_TIMESTAMP
+        """, (application_id, command_hash))
+        cur.close()
+
+def delete_app_command_hash_db(application_id):
+    """Forget the synced command tree hash of an application (benchmarks)"""
+    with pooled_db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM app_command_sync WHERE application_id = %s", (application_id,))
+        cur.close()
+
+# Storage Backend
+# The helpers named below are the whole storage contract: nothing else in the bot talks to
+# the database. With STORAGE_BACKEND=sqlite each one is rebound to the method of the same
+# name on an embedded SQLite store (sqlite_storage.py) - callers look them up at call time,
+# so they never know the difference. SQLite is for a single process: no NOTIFY, one file.
+STORAGE_FUNCTIONS = (
+    'migrate_database_db', 'close_pool', 'maintain_history_db', 'delete_guild_data_db', 'delete_mm_stats_db',
+    'fetch_ticket_number_block', 'save_ticket', 'get_ticket', 'claim_ticket_db', 'unclaim_ticket_db',
+    'delete_ticket_db', 'save_ticket_activity_db', 'get_live_tickets_db', 'backfill_ticket_guilds_db',
+    'archive_orphan_tickets_db', 'increment_mm_stats', 'get_mm_stats_db', 'get_mm_leaderboard_db', 'count_mm_stats_db',
+    'search_tickets_db', 'write_ticket_events_db', 'get_ticket_rollups_db', 'get_guild_config_rows_db',
+    'set_guild_config_db', 'save_cluster_health_db', 'get_cluster_health_db', 'check_query_plans',
+    'get_app_command_hash_db', 'set_app_command_hash_db', 'delete_app_command_hash_db',
+)
+_postgres_functions = {name: globals()[name] for name in STORAGE_FUNCTIONS}
+storage_backend = 'postgres'
+sqlite_store = None  # The SQLiteStorage behind the helpers when storage_backend is sqlite
+
+def use_storage_backend(name, path=SQLITE_PATH):
+    """Point every storage helper at the postgres or sqlite backend"""
+    global storage_backend, sqlite_store
+    if name == 'postgres':
+        functions = _postgres_functions
+        sqlite_store = None
+    elif name == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        store = SQLiteStorage(
+            path, search_page_size=SEARCH_PAGE_SIZE, batch_size=RECONCILE_BATCH_SIZE,
+            ticket_number_block=TICKET_NUMBER_BLOCK, seq_scan_row_limit=SEQ_SCAN_ROW_LIMIT,
+            health_interval=HEALTH_INTERVAL_SECONDS, cluster_count=CLUSTER_COUNT
+        )
+        functions = {fn: getattr(store, fn) for fn in STORAGE_FUNCTIONS}
+        sqlite_store = store
+        if CLUSTER_COUNT > 1:
+            log.warning('SQLite storage is single-process; run clusters on Postgres',
+                        extra={'event': 'storage_warning', 'clusters': CLUSTER_COUNT})
+    else:
+        raise ValueError(f'Unknown storage backend: {name}')
+    globals().update(functions)
+    storage_backend = name
+
+use_storage_backend(STORAGE_BACKEND)
+
+# Permission Matrix
+# Built once per guild from its config: each role maps to a bitmask of the tiers it can
+# claim. A member's mask is the OR of their roles' masks, cached until their roles (or
+# the guild's roles/config) change, so every permission check is a dict lookup and an AND.
+ADMIN_FLAG = 1 << 62  # Set for administrators on top of every tier bit
+
+class PermissionMatrix:
+    def __init__(self, config):
+        tiers = config['mm_tiers']
+        self.tier_bits = {tier_key: 1 << i for i, tier_key in enumerate(tiers)}
+        self.all_tiers = sum(self.tier_bits.values())
+        
+        # A tier role sees tickets at its level and below - OG sees everything
+        self.role_masks = {}
+        for tier_key, role_id in config['mm_role_ids'].items():
+            if tier_key not in tiers:
+                continue
+            level = tiers[tier_key]['level']
+            mask = self.all_tiers if tier_key == 'og' else sum(
+                bit for other, bit in self.tier_bits.items() if tiers[other]['level'] <= level
+            )
+            self.role_masks[role_id] = self.role_masks.get(role_id, 0) | mask
+        
+        # Roles that get access to (and are pinged for) each tier's tickets
+        self.tier_roles = {
+            tier_key: [role_id for role_id, mask in self.role_masks.items() if mask & bit]
+            for tier_key, bit in self.tier_bits.items()
+        }
+
+_permission_matrices = {}  # guild_id -> PermissionMatrix
+_member_masks = {}         # guild_id -> {member_id: mask}
+
+def get_permission_matrix(guild_id):
+    """Get a guild's compiled permission matrix"""
+    matrix = _permission_matrices.get(guild_id)
+    if matrix is None:
+        matrix = _permission_matrices[guild_id] = PermissionMatrix(get_guild_config(guild_id))
+    return matrix
+
+def invalidate_permissions(guild_id, member_id=None):
+    """Forget cached masks for one member, or rebuild everything for a guild"""
+    if member_id is not None:
+        _member_masks.get(guild_id, {}).pop(member_id, None)
+    else:
+        _permission_matrices.pop(guild_id, None)
+        _member_masks.pop(guild_id, None)
+
+def member_mask(member):
+    """Get a member's tier bitmask (ADMIN_FLAG included for admins)"""
+    masks = _member_masks.setdefault(member.guild.id, {})
+    mask = masks.get(member.id)
+    if mask is None:
+        matrix = get_permission_matrix(member.guild.id)
+        mask = 0
+        for role in member.roles:
+            mask |= matrix.role_masks.get(role.id, 0)
+        if member.guild_permissions.administrator:
+            mask |= matrix.all_tiers | ADMIN_FLAG
+        masks[member.id] = mask
+    return mask
+
+def is_admin(member):
+    """Check if member is an administrator"""
+    return bool(member_mask(member) & ADMIN_FLAG)
+
+def can_see_tier(member, ticket_tier):
+    """Check if member can see and claim a ticket of given tier"""
+    bit = get_permission_matrix(member.guild.id).tier_bits.get(ticket_tier)
+    if bit is None:
+        return is_admin(member)  # Tier no longer configured - admins only
+    return bool(member_mask(member) & bit)
+
+def is_mm_or_admin(user, guild):
+    """Check if user is MM or admin"""
+    return member_mask(user) != 0
+
+# Member Resolution
+# Everything that turns a stored user ID into a Member goes through resolve_member(s).
+# With MEMBER_CACHE=full that is guild.get_member. With MEMBER_CACHE=lazy discord.py
+# caches nobody, so members are fetched on first use (a whole leaderboard in one gateway
+# request) and kept in an LRU. on_member_update never fires for uncached members, so
+# cached permission masks are kept honest two other ways: every Member that arrives
+# with a command or interaction is compared against the cached one, and entries expire
+# after MEMBER_LRU_TTL (taking the member's mask with them).
+_NOT_IN_GUILD = object()
+
+class MemberLRU:
+    """Bounded (guild_id, member_id) -> Member map with expiry; also remembers who is not in the guild"""
+    def __init__(self, size=MEMBER_LRU_SIZE, ttl=MEMBER_LRU_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (member or _NOT_IN_GUILD, expires)
+
+    def get(self, guild_id, member_id):
+        """Cached member, _NOT_IN_GUILD, or None when unknown/expired"""
+        key = (guild_id, member_id)
+        entry = self.entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                self.drop(guild_id, member_id)
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, guild_id, member_id, member):
+        key = (guild_id, member_id)
+        self.entries[key] = (member, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            (old_guild_id, old_member_id), _ = self.entries.popitem(last=False)
+            invalidate_permissions(old_guild_id, old_member_id)
+
+    def drop(self, guild_id, member_id):
+        self.entries.pop((guild_id, member_id), None)
+        invalidate_permissions(guild_id, member_id)
+
+member_lru = MemberLRU()
+member_lookup_ms = deque(maxlen=500)  # Recent resolve latencies that had to ask Discord
+member_resolve_ms = deque(maxlen=500)  # Recent resolve_members latencies, in either mode
+# Unique IDs per resolve_members call: 'hits' (a member answered from memory), 'misses' (a member
+# Discord had to be asked for) and 'not_in_guild' (no such member, cached or not - kept out of the hit rate)
+member_resolves = Counter()
+
+def remember_member(member):
+    """Cache a Member that just arrived with a command or interaction (lazy mode)"""
+    if MEMBER_CACHE != 'lazy' or not isinstance(member, discord.Member):
+        return
+    cached = member_lru.entries.get((member.guild.id, member.id))
+    if cached and isinstance(cached[0], discord.Member) and cached[0].roles != member.roles:
+        invalidate_permissions(member.guild.id, member.id)  # Roles changed while we weren't told
+    member_lru.put(member.guild.id, member.id, member)
+
+async def resolve_members(guild, member_ids):
+    """Members of a guild by ID (absent ones are left out), fetching uncached ones in batches"""
+    resolve_started = time.perf_counter()
+    if MEMBER_CACHE != 'lazy':
+        found = {member_id: member for member_id in member_ids if (member := guild.get_member(member_id))}
+        member_resolves['hits'] += len(found)
+        member_resolves['not_in_guild'] += len(set(member_ids)) - len(found)
+        member_resolve_ms.append((time.perf_counter() - resolve_started) * 1000)
+        return found
+    
+    found = {}
+    missing = []
+    for member_id in dict.fromkeys(member_ids):
+        cached = member_lru.get(guild.id, member_id)
+        if cached is None:
+            missing.append(member_id)
+        elif cached is _NOT_IN_GUILD:
+            member_resolves['not_in_guild'] += 1
+        else:
+            found[member_id] = cached
+    member_resolves['hits'] += len(found)
+    
+    for i in range(0, len(missing), MEMBER_QUERY_BATCH):
+        batch = missing[i:i + MEMBER_QUERY_BATCH]
+        started = time.perf_counter()
+        if len(batch) == 1:
+            try:
+                members = [await guild.fetch_member(batch[0])]
+            except discord.NotFound:
+                members = []
+        else:
+            members = await guild.query_members(user_ids=batch, limit=len(batch), cache=False)
+        member_lookup_ms.append((time.perf_counter() - started) * 1000)
+        
+        for member in members:
+            member_lru.put(guild.id, member.id, member)
+            found[member.id] = member
+        member_resolves['misses'] += len(members)
+        for member_id in batch:
+            if member_id not in found:
+                member_lru.put(guild.id, member_id, _NOT_IN_GUILD)
+                member_resolves['not_in_guild'] += 1
+    member_resolve_ms.append((time.perf_counter() - resolve_started) * 1000)
+    return found
+
+async def resolve_member(guild, member_id):
+    """One member of a guild by ID, or None if they are not in it"""
+    if not member_id:
+        return None
+    return (await resolve_members(guild, [member_id])).get(member_id)
+
+async def find_member_by_name(guild, name):
+    """Member whose username or nickname is exactly `name` (case-insensitive)"""
+    name = name.lower()
+    matches = lambda m: m.name.lower() == name or (m.nick and m.nick.lower() == name)
+    if MEMBER_CACHE != 'lazy':
+        return discord.utils.find(matches, guild.members)
+    candidates = await guild.query_members(query=name, limit=20, cache=False)
+    member = discord.utils.find(matches, candidates)
+    if member:
+        member_lru.put(guild.id, member.id, member)
+    return member
+
+def resident_memory_mb():
+    """Current resident set size (peak where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1e6
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+def member_cache_metrics():
+    """Member cache size, hit rate, lookup latency and process memory for the heartbeat.
+    
+    Hit rate and resolve latency cover both modes, so full and lazy can be compared; the
+    hit rate counts only IDs that are members (not_in_guild is reported on its own), and
+    fetch latency (asking Discord) only happens in lazy mode.
+    """
+    def pick(samples, pct):
+        samples = sorted(samples)
+        return round(samples[min(len(samples) - 1, int(len(samples) * pct))], 3) if samples else None
+    
+    if MEMBER_CACHE == 'lazy':
+        cached = len(member_lru.entries)
+    else:
+        cached = sum(len(guild.members) for guild in bot.guilds)
+    lookups_total = member_resolves['hits'] + member_resolves['misses']
+    return {
+        'mode': MEMBER_CACHE,
+        'cached_members': cached,
+        'hit_rate': round(member_resolves['hits'] / lookups_total, 3) if lookups_total else None,
+        'not_in_guild': member_resolves['not_in_guild'],
+        'resolve_p50_ms': pick(member_resolve_ms, 0.5),
+        'resolve_p95_ms': pick(member_resolve_ms, 0.95),
+        'fetch_p50_ms': pick(member_lookup_ms, 0.5),
+        'fetch_p95_ms': pick(member_lookup_ms, 0.95),
+        'rss_mb': round(resident_memory_mb(), 1)
+    }
+
+# Graceful Shutdown
+# On SIGTERM the bot stops taking new commands and interactions, wakes every pending
+# delay so games and channel deletions finish straight away, runs the drain hooks
+# (queued writes) and only then closes the gateway, the DB pool and the log writer.
+shutdown_event = asyncio.Event()
+in_flight = {}      # kind -> set of tasks doing work that must finish before exit
+drain_hooks = []    # (phase name, coroutine function) run in registration order
+_shutdown_task = None
+
+def shutting_down():
+    return shutdown_event.is_set()
+
+def request_shutdown(reason):
+    """Start the shutdown sequence once; every caller gets the same task"""
+    global _shutdown_task
+    if _shutdown_task is None:
+        _shutdown_task = asyncio.create_task(shutdown(reason))
+    return _shutdown_task
+
+def track_work(kind):
+    """Decorator: register the running task under `kind` until the coroutine returns"""
+    def decorator(func):
+        async def wrapper(*args, **kwargs):
+            task = asyncio.current_task()
+            tasks_of_kind = in_flight.setdefault(kind, set())
+            tasks_of_kind.add(task)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                tasks_of_kind.discard(task)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+def on_drain(phase):
+    """Decorator: run this coroutine function during shutdown, after in-flight work"""
+    def decorator(func):
+        drain_hooks.append((phase, func))
+        return func
+    return decorator
+
+async def drain_sleep(delay):
+    """asyncio.sleep that returns early once shutdown starts"""
+    if delay <= 0 or shutting_down():
+        return
+    try:
+        await asyncio.wait_for(shutdown_event.wait(), delay)
+    except asyncio.TimeoutError:
+        pass
+
+class BotView(View):
+    """View that refuses new interactions while shutting down"""
+    async def interaction_check(self, interaction):
+        remember_member(interaction.user)
+        if shutting_down():
+            await interaction.response.send_message('⏳ Bot is restarting, please try again in a moment.', ephemeral=True)
+            return False
+        return True
+
+class BotModal(Modal):
+    """Modal that refuses submissions while shutting down"""
+    async def interaction_check(self, interaction):
+        remember_member(interaction.user)
+        if shutting_down():
+            await interaction.response.send_message('⏳ Bot is restarting, please try again in a moment.', ephemeral=True)
+            return False
+        return True
+
+async def shutdown(reason):
+    """Drain in-flight work within SHUTDOWN_TIMEOUT, then close everything (use request_shutdown)"""
+    started = time.monotonic()
+    deadline = started + SHUTDOWN_TIMEOUT
+    log.info('Shutting down', extra={'event': 'shutdown_start', 'reason': reason, 'timeout': SHUTDOWN_TIMEOUT})
+    shutdown_event.set()
+    
+    async def phase(name, coro):
+        phase_started = time.monotonic()
+        remaining = max(0.0, deadline - phase_started)
+        try:
+            await asyncio.wait_for(coro, remaining)
+            timed_out = False
+        except asyncio.TimeoutError:
+            timed_out = True
+        except Exception:
+            log.exception('Shutdown phase %s failed', name, extra={'event': 'shutdown_phase_error', 'phase': name})
+            timed_out = False
+        log.info('Shutdown phase %s', name, extra={
+            'event': 'shutdown_phase', 'phase': name, 'timed_out': timed_out,
+            'duration_ms': round((time.monotonic() - phase_started) * 1000, 1)
+        })
+    
+    # STOP BACKGROUND LOOPS (a reconcile pass that already started is left to finish)
+    for loop_task in (history_maintenance, reconcile_loop, health_loop, event_flush_loop, sla_loop,
+                      activity_flush_loop, inactivity_loop):
+        loop_task.stop()
+    lag_monitor.stop()
+    if _profiler is not None:
+        _profiler.stop()  # $profile replies with what it has sampled so far
+    
+    # WAIT FOR IN-FLIGHT WORK (delays are already woken up by shutdown_event)
+    for kind in sorted(in_flight):
+        pending = [task for task in in_flight[kind] if task is not asyncio.current_task()]
+        if pending:
+            await phase(kind, asyncio.gather(*pending, return_exceptions=True))
+    
+    # FLUSH QUEUED WRITES
+    for name, hook in drain_hooks:
+        await phase(name, hook())
+    
+    await phase('gateway', bot.close())
+    await phase('database', asyncio.to_thread(close_pool))
+    log.info('Shutdown complete', extra={
+        'event': 'shutdown_complete', 'duration_ms': round((time.monotonic() - started) * 1000, 1)
+    })
+    stop_logging()
+
+# Ticket Event Log
+# Lifecycle events (created, claimed, unclaimed, user_added, user_removed, proof_posted,
+# sla_reping, sla_escalate, closed) are appended to an in-memory buffer on the event loop and written in bulk by
+# flush_ticket_events - on a timer, when the buffer fills, and once more at shutdown.
+event_buffer = []
+_event_flush_lock = asyncio.Lock()
+
+def record_event(event, ticket, actor_id=None, target_id=None, seconds=None):
+    """Queue a lifecycle event for a ticket row (or a dict with at least channel_id)"""
+    event_buffer.append({
+        'occurred_at': datetime.utcnow(),
+        'event': event,
+        'guild_id': ticket.get('guild_id'),
+        'channel_id': ticket['channel_id'],
+        'ticket_number': ticket.get('ticket_number'),
+        'tier': ticket.get('tier'),
+        'actor_id': actor_id,
+        'target_id': target_id,
+        'seconds': seconds
+    })
+    if len(event_buffer) >= EVENT_FLUSH_SIZE and not _event_flush_lock.locked():
+        asyncio.get_running_loop().create_task(flush_ticket_events())
+
+@on_drain('events')
+async def flush_ticket_events():
+    """Write everything buffered so far; on failure the batch goes back in the buffer"""
+    async with _event_flush_lock:
+        while event_buffer:
+            batch = event_buffer[:]
+            del event_buffer[:len(batch)]
+            try:
+                await asyncio.to_thread(write_ticket_events_db, batch)
+            except Exception:
+                event_buffer[:0] = batch
+                dropped = len(event_buffer) - EVENT_BUFFER_MAX
+                if dropped > 0:
+                    del event_buffer[:dropped]
+                log.exception('Ticket event flush failed', extra={
+                    'event': 'ticket_events_error', 'buffered': len(event_buffer), 'dropped': max(dropped, 0)
+                })
+                return
+
+def format_duration(seconds):
+    """Seconds as a short human duration (e.g. 4m 10s, 2h 5m)"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m {seconds % 60}s'
+    if seconds < 86400:
+        return f'{seconds // 3600}h {seconds % 3600 // 60}m'
+    return f'{seconds // 86400}d {seconds % 86400 // 3600}h'
+
+# Dispatcher
+# Unclaimed MM tickets wait in a per-guild priority queue (highest tier first, then
+# oldest). Middlemen opt in with $available; each ticket is offered to one of them at a
+# time (least recently offered first) and passes to the next after DISPATCH_OFFER_SECONDS.
+# Once every available MM has passed, the tier roles are pinged as before. Per-process
+# state: each guild is only ever handled by the process that owns its shard.
+dispatch_queue = {}      # guild_id -> heap of (-tier level, created_at, channel_id)
+queued_channels = set()  # Channel IDs with an entry in some dispatch_queue heap
+available_mms = {}       # guild_id -> {member_id: set of tiers}
+dispatch_offers = {}     # channel_id -> {'mm_id', 'expires', 'message'}
+offered_to = {}          # channel_id -> member IDs already asked
+fallen_back = set()      # Tickets handed back to the role ping
+last_offered = {}        # member_id -> monotonic time of their last offer
+claim_waits = {}         # tier -> recent time-to-claim seconds
+claim_counts = {}        # tier -> claims since start
+dispatch_wakeup = asyncio.Event()
+_dispatcher_task = None
+
+def available_for_tier(guild_id, tier):
+    """IDs of middlemen currently taking tickets of this tier"""
+    return {member_id for member_id, tiers in available_mms.get(guild_id, {}).items() if tier in tiers}
+
+def free_middlemen(guild_id, busy):
+    """IDs of available middlemen without an open offer"""
+    return available_mms.get(guild_id, {}).keys() - busy
+
+def enqueue_ticket(guild, ticket):
+    """Queue an unclaimed MM ticket; returns True if someone is available to take it"""
+    tier = ticket.get('tier')
+    tiers = get_guild_config(guild.id)['mm_tiers']
+    if ticket['ticket_type'] != 'mm' or tier not in tiers:
+        return False
+    if ticket['channel_id'] not in queued_channels:  # e.g. unclaimed before its old entry was popped
+        created = ticket.get('created_at') or datetime.utcnow()
+        heapq.heappush(dispatch_queue.setdefault(guild.id, []), (-tiers[tier]['level'], created, ticket['channel_id']))
+        queued_channels.add(ticket['channel_id'])
+    dispatch_wakeup.set()
+    return bool(available_for_tier(guild.id, tier))
+
+def dispatch_claimed(ticket, seconds):
+    """A ticket was claimed (through an offer or not) - stop offering it and record the wait"""
+    channel_id = ticket['channel_id']
+    cancel_sla(channel_id)
+    dispatch_offers.pop(channel_id, None)
+    offered_to.pop(channel_id, None)
+    fallen_back.discard(channel_id)
+    if seconds is not None:
+        tier = ticket.get('tier') or 'support'
+        claim_waits.setdefault(tier, deque(maxlen=DISPATCH_METRIC_WINDOW)).append(seconds)
+        claim_counts[tier] = claim_counts.get(tier, 0) + 1
+    dispatch_wakeup.set()
+
+def requeue_unclaimed():
+    """Queue unclaimed MM tickets the dispatcher is not tracking (e.g. after a restart)"""
+    fallen_back.intersection_update(ticket_registry)
+    for ticket in list(ticket_registry.values()):
+        channel_id = ticket['channel_id']
+        if ticket.get('claimed_by') or channel_id in queued_channels or channel_id in fallen_back:
+            continue
+        guild = bot.get_guild(ticket.get('guild_id') or 0)
+        if guild:
+            enqueue_ticket(guild, ticket)
+
+def dispatch_metrics():
+    """Queue depth and time-to-claim percentiles per tier"""
+    metrics = {}
+    queued = {}
+    for heap in dispatch_queue.values():
+        for entry in heap:
+            ticket = ticket_registry.get(entry[2])
+            if not ticket or ticket.get('claimed_by'):
+                continue  # Dropped lazily, the next time the dispatcher pops it
+            queued[ticket['tier']] = queued.get(ticket['tier'], 0) + 1
+    for tier in set(claim_waits) | set(queued):
+        waits = sorted(claim_waits.get(tier, ()))
+        metrics[tier or 'unknown'] = {
+            'queued': queued.get(tier, 0),
+            'claims': claim_counts.get(tier, 0),
+            'claim_p50_seconds': waits[len(waits) // 2] if waits else None,
+            'claim_p95_seconds': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else None
+        }
+    return metrics
+
+class DispatchOfferView(BotView):
+    """Accept/Pass buttons on a ticket offer, usable only by the MM it was offered to"""
+    def __init__(self, mm_id):
+        super().__init__(timeout=DISPATCH_OFFER_SECONDS)
+        self.mm_id = mm_id
+    
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.mm_id:
+            await interaction.response.send_message('❌ This offer is for another middleman.', ephemeral=True)
+            return False
+        return await super().interaction_check(interaction)
+    
+    @discord.ui.button(label='Accept', emoji='✅', style=discord.ButtonStyle.success)
+    async def accept_button(self, interaction: discord.Interaction, button: Button):
+        self.stop()
+        await MMTicketView().claim_button.callback(interaction)
+        try:
+            await interaction.message.edit(view=None)
+        except discord.HTTPException:
+            pass
+    
+    @discord.ui.button(label='Pass', emoji='⏭️', style=discord.ButtonStyle.secondary)
+    async def pass_button(self, interaction: discord.Interaction, button: Button):
+        self.stop()
+        offer = dispatch_offers.get(interaction.channel.id)
+        if offer and offer['mm_id'] == self.mm_id:
+            offer['expires'] = 0
+            offer['passed'] = True  # The message is edited below, not by expire_offer
+            dispatch_wakeup.set()
+        await interaction.response.edit_message(content=f'⏭️ {interaction.user.mention} passed on this ticket.', view=None)
+
+async def pick_middleman(guild, ticket, busy):
+    """Least recently offered available MM for the ticket's tier, or None"""
+    tried = offered_to.get(ticket['channel_id'], set())
+    members = await resolve_members(guild, list(available_for_tier(guild.id, ticket['tier']) - tried - busy))
+    candidates = [member for member in members.values() if can_see_tier(member, ticket['tier'])]
+    return min(candidates, key=lambda member: last_offered.get(member.id, 0), default=None)
+
+async def expire_offer(channel_id, offer):
+    """Take an offer back that was passed on, timed out or whose ticket closed"""
+    dispatch_offers.pop(channel_id, None)
+    if offer.get('passed') or channel_id not in ticket_registry:
+        return  # Only a real timeout leaves the message to update
+    try:
+        await offer['message'].edit(content=f"⌛ <@{offer['mm_id']}> did not answer in time.", view=None)
+    except discord.HTTPException:
+        pass  # Ticket closed meanwhile
+
+async def fall_back_to_roles(guild, ticket):
+    """Nobody available accepted - ping the tier roles like an unrouted ticket"""
+    channel = guild.get_channel(ticket['channel_id'])
+    fallen_back.add(ticket['channel_id'])
+    offered_to.pop(ticket['channel_id'], None)
+    if not channel:
+        return
+    roles = [guild.get_role(role_id) for role_id in get_permission_matrix(guild.id).tier_roles.get(ticket['tier'], [])]
+    mentions = ' '.join(role.mention for role in roles if role)
+    await channel.send(f'{mentions} No available middleman took this ticket - it is open to everyone.'.strip())
+
+async def dispatch_pending():
+    """Expire stale offers and make new ones, returning seconds until the next offer expires"""
+    now = time.monotonic()
+    for channel_id, offer in list(dispatch_offers.items()):
+        if offer['expires'] <= now or channel_id not in ticket_registry:
+            await expire_offer(channel_id, offer)
+    busy = {offer['mm_id'] for offer in dispatch_offers.values()}
+    
+    for guild_id, heap in list(dispatch_queue.items()):
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            queued_channels.difference_update(entry[2] for entry in dispatch_queue.pop(guild_id))
+            continue
+        # Pop in priority order while someone could still take a ticket; entries that
+        # stay (offered or waiting) are pushed back, stale ones are dropped
+        kept = []
+        while heap and free_middlemen(guild_id, busy):
+            entry = heapq.heappop(heap)
+            channel_id = entry[2]
+            ticket = ticket_registry.get(channel_id)
+            if not ticket or ticket.get('claimed_by'):
+                queued_channels.discard(channel_id)
+                offered_to.pop(channel_id, None)
+                continue
+            if channel_id in dispatch_offers:
+                kept.append(entry)
+                continue
+            
+            mm = await pick_middleman(guild, ticket, busy)
+            if mm is None:
+                tried = offered_to.get(channel_id, set())
+                if not (available_for_tier(guild_id, ticket['tier']) - tried):
+                    if tried:  # Everyone available has passed
+                        queued_channels.discard(channel_id)
+                        await fall_back_to_roles(guild, ticket)
+                        continue
+                kept.append(entry)
+                continue
+            
+            channel = guild.get_channel(channel_id)
+            if not channel:
+                queued_channels.discard(channel_id)
+                continue
+            kept.append(entry)
+            message = await channel.send(
+                f'📨 {mm.mention}, you have been matched to this ticket. Accept within {DISPATCH_OFFER_SECONDS} seconds.',
+                view=DispatchOfferView(mm.id)
+            )
+            dispatch_offers[channel_id] = {'mm_id': mm.id, 'expires': time.monotonic() + DISPATCH_OFFER_SECONDS, 'message': message}
+            offered_to.setdefault(channel_id, set()).add(mm.id)
+            last_offered[mm.id] = time.monotonic()
+            busy.add(mm.id)
+        for entry in kept:
+            heapq.heappush(heap, entry)
+    
+    if not dispatch_offers:
+        return None
+    return max(0.0, min(offer['expires'] for offer in dispatch_offers.values()) - time.monotonic())
+
+def start_dispatcher():
+    """Start the dispatcher once per process"""
+    global _dispatcher_task
+    if _dispatcher_task is None:
+        _dispatcher_task = asyncio.get_running_loop().create_task(run_dispatcher())
+
+async def run_dispatcher():
+    """Offer tickets whenever something changes or an offer runs out"""
+    while not shutting_down():
+        dispatch_wakeup.clear()
+        try:
+            timeout = await dispatch_pending()
+        except Exception:
+            log.exception('Dispatcher error', extra={'event': 'dispatch_error'})
+            timeout = 5
+        try:
+            await asyncio.wait_for(dispatch_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+# SLA Escalation
+# Unclaimed MM tickets are scheduled on a hashed timing wheel: a ring of slots, one per
+# tick, where a timer lands in slot (now + delay) and counts down the full turns it still
+# has to wait. Scheduling and cancelling are dict operations, and each tick only looks
+# at one slot, so thousands of open tickets cost next to nothing.
+class TimingWheel:
+    def __init__(self, slots, tick):
+        self.slots = [{} for _ in range(slots)]
+        self.tick = tick
+        self.cursor = 0
+        self.timers = {}  # key -> slot index
+    
+    def schedule(self, key, delay, payload):
+        """Fire `payload` for `key` after `delay` seconds, replacing any timer for it"""
+        self.cancel(key)
+        ticks = max(1, int(-(-delay // self.tick)))  # Round up; never the slot being processed
+        rounds, offset = divmod(ticks, len(self.slots))
+        if offset == 0:
+            rounds, offset = rounds - 1, len(self.slots)
+        index = (self.cursor + offset) % len(self.slots)
+        self.slots[index][key] = [rounds, payload]
+        self.timers[key] = index
+    
+    def cancel(self, key):
+        index = self.timers.pop(key, None)
+        if index is not None:
+            self.slots[index].pop(key, None)
+    
+    def advance(self):
+        """Move one tick forward and return the (key, payload) pairs now due"""
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        slot = self.slots[self.cursor]
+        due = []
+        for key, timer in list(slot.items()):
+            if timer[0] > 0:
+                timer[0] -= 1
+                continue
+            del slot[key]
+            del self.timers[key]
+            due.append((key, timer[1]))
+        return due
+    
+    def __len__(self):
+        return len(self.timers)
+
+sla_wheel = TimingWheel(SLA_WHEEL_SLOTS, SLA_TICK_SECONDS)
+
+def sla_minutes(guild_id, tier):
+    """(reping, escalate) ages in minutes for a tier"""
+    tier_config = get_guild_config(guild_id)['mm_tiers'].get(tier, {})
+    return (tier_config.get('reping_after', SLA_REPING_MINUTES),
+            tier_config.get('escalate_after', SLA_ESCALATE_MINUTES))
+
+def schedule_sla(ticket, since=None):
+    """Schedule the next escalation for an unclaimed MM ticket, counting from `since`"""
+    if ticket['ticket_type'] != 'mm' or ticket.get('claimed_by'):
+        return
+    since = since or ticket.get('created_at') or datetime.utcnow()
+    age = (datetime.utcnow() - since).total_seconds()
+    reping, escalate = sla_minutes(ticket.get('guild_id'), ticket.get('tier'))
+    for stage, minutes in (('reping', reping), ('escalate', escalate)):
+        if minutes * 60 > age:
+            sla_wheel.schedule(ticket['channel_id'], minutes * 60 - age, (stage, since))
+            return
+
+def cancel_sla(channel_id):
+    sla_wheel.cancel(channel_id)
+
+def seed_sla_timers():
+    """Schedule every unclaimed MM ticket that has no timer yet, from its created_at.
+    
+    Stages whose time already passed (e.g. while the bot was down) are skipped rather
+    than all firing at once.
+    """
+    for ticket in list(ticket_registry.values()):
+        if ticket['channel_id'] not in sla_wheel.timers:
+            schedule_sla(ticket)
 
-# Color
-MM_COLOR = 0xFEE75C
+def escalation_roles(guild, tier):
+    """Roles of the next tier up, or the staff role from the top tier"""
+    config = get_guild_config(guild.id)
+    tiers = config['mm_tiers']
+    level = tiers[tier]['level'] if tier in tiers else 0
+    higher = sorted((t for t in tiers if tiers[t]['level'] > level), key=lambda t: tiers[t]['level'])
+    for next_tier in higher:
+        role = guild.get_role(config['mm_role_ids'].get(next_tier, 0))
+        if role:
+            return [role], tiers[next_tier]['name']
+    staff_role = guild.get_role(config['staff_role_id'])
+    return ([staff_role] if staff_role else []), 'Staff'
 
-# MM Tier definitions with hierarchy
-MM_TIERS = {
-    'basic': {
-        'name': '$1-$15 Middleman',
-        'range': '$1-$15 Worth of Stuff',
-        'emoji': '💲',
-        'level': 1
-    },
-    'advanced': {
-        'name': '$15-$50 Middleman',
-        'range': '$15-$50 Worth of Stuff',
-        'emoji': '💸',
-        'level': 2
-    },
-    'premium': {
-        'name': '$50-$150 Middleman',
-        'range': '$50-$150 Worth of Stuff',
-        'emoji': '💰',
-        'level': 3
-    },
-    'og': {
-        'name': '$150+ Middleman',
-        'range': '$150+ Worth of Stuff',
-        'emoji': '💳',
-        'level': 4
-    }
-}
+async def fire_sla(channel_id, stage, since):
+    """Re-ping or escalate a ticket that is still unclaimed"""
+    ticket = ticket_registry.get(channel_id)
+    if not ticket or ticket.get('claimed_by'):
+        return
+    guild = bot.get_guild(ticket.get('guild_id') or 0)
+    channel = guild.get_channel(channel_id) if guild else None
+    if not channel:
+        return
+    waited = format_duration((datetime.utcnow() - since).total_seconds())
+    
+    if stage == 'reping':
+        roles = [guild.get_role(role_id) for role_id in get_permission_matrix(guild.id).tier_roles.get(ticket['tier'], [])]
+        mentions = ' '.join(role.mention for role in roles if role)
+        await channel.send(f'⏰ {mentions} This ticket has been waiting {waited} - can someone claim it?'.strip())
+        schedule_sla(ticket, since)
+    else:
+        roles, target = escalation_roles(guild, ticket['tier'])
+        for role in roles:
+            await channel.set_permissions(role, view_channel=True, send_messages=True, read_message_history=True)
+        mentions = ' '.join(role.mention for role in roles)
+        await channel.send(f'🚨 {mentions} Escalated to {target}: this ticket has been unclaimed for {waited}.'.strip())
+    record_event(f'sla_{stage}', ticket)
+    log.info('SLA %s', stage, extra=log_fields(guild, channel, event='sla_escalation', stage=stage, waited=waited))
 
-# MM Role IDs - UPDATE THESE WITH YOUR ROLE IDS
-MM_ROLE_IDS = {
-    "basic": 1427769765484695666,        # 0-150M role ID
-    "advanced": 1424908470075003032,     # 150-500M role ID
-    "premium": 1426475143924027393,      # 500M+ role ID
-    "og": 1425251754584309905         # OG MM role ID
-}
+# Inactivity Auto-Close
+# on_message only touches these dicts; the activity times reach the database in one
+# UPDATE per ACTIVITY_FLUSH_SECONDS, and the sweeper reads memory only.
+last_activity = {}        # channel_id -> last human message (utc)
+_activity_dirty = set()   # Channels whose time has not been written yet
+inactivity_warned = set()
 
-SUPPORT_CATEGORY = 'Support Tickets'
-STAFF_ROLE_ID = 1407252499760680960
+def touch_ticket(channel_id, when=None):
+    last_activity[channel_id] = when or datetime.utcnow()
+    _activity_dirty.add(channel_id)
+    inactivity_warned.discard(channel_id)
 
+def ticket_idle_seconds(ticket, now):
+    """Seconds since the last human message (or since the ticket opened)"""
+    seen = last_activity.get(ticket['channel_id']) or ticket.get('last_activity_at') or ticket.get('created_at') or now
+    return (now - seen).total_seconds()
 
-def init_database():
-    """Creates database tables when bot starts"""
+@on_drain('activity')
+async def flush_ticket_activity():
+    """Write pending last-activity times in one batch"""
+    if not _activity_dirty:
+        return
+    channel_ids = list(_activity_dirty)
+    _activity_dirty.clear()
+    pairs = [(channel_id, last_activity[channel_id]) for channel_id in channel_ids if channel_id in last_activity]
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        # Create tickets table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS tickets (
-                channel_id BIGINT PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                ticket_type VARCHAR(50) NOT NULL,
-                tier VARCHAR(50),
-                trader TEXT,
-                giving TEXT,
-                receiving TEXT,
-                tip TEXT,
-                reason TEXT,
-                details TEXT,
-                claimed_by BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Create mm_stats table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS mm_stats (
-                user_id BIGINT PRIMARY KEY,
-                tickets_completed INTEGER DEFAULT 0,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        await asyncio.to_thread(save_ticket_activity_db, pairs)
+    except Exception:
+        _activity_dirty.update(channel_ids)
+        log.exception('Ticket activity flush failed', extra={'event': 'activity_flush_error', 'pending': len(channel_ids)})
+        return
+    for channel_id, when in pairs:
+        if channel_id in ticket_registry:
+            ticket_registry[channel_id]['last_activity_at'] = when
+
+async def close_inactive_ticket(channel, guild, idle):
+    """Close one abandoned ticket; True when it closed (a failure is logged and retried next sweep)"""
+    try:
+        await close_ticket(channel, guild.me, reason=f'No activity for {format_duration(idle)}')
+    except Exception:
+        log.exception('Inactive ticket close failed', extra={'event': 'inactivity_close_error', 'channel_id': channel.id})
+        return False
+    inactivity_warned.discard(channel.id)
+    return True
+
+async def sweep_inactive_tickets():
+    """Warn, then close, tickets nobody has written in for too long
+    
+    Closes run side by side (each waits CLOSE_DELETE_DELAY before deleting its channel), and
+    one ticket failing - e.g. Forbidden on a channel the bot lost access to - skips only that
+    ticket. A ticket stays warned until its close succeeds, so the next sweep retries the close.
+    """
+    now = datetime.utcnow()
+    closes = []
+    for ticket in list(ticket_registry.values()):
+        guild = bot.get_guild(ticket.get('guild_id') or 0)
+        if not guild:
+            continue
+        hours = get_guild_config(guild.id)['inactivity_hours']
+        if not hours:
+            continue
+        channel = guild.get_channel(ticket['channel_id'])
+        if not channel:
+            continue  # The reconciler deals with missing channels
         
-        conn.commit()
-        cur.close()
-        conn.close()
-        print("✅ Database tables ready")
-    except Exception as e:
-        print(f"❌ Database error: {e}")
+        idle = ticket_idle_seconds(ticket, now)
+        limit = hours * 3600
+        if idle >= limit and ticket['channel_id'] in inactivity_warned:
+            closes.append(close_inactive_ticket(channel, guild, idle))
+        elif idle >= limit * INACTIVITY_WARN_AT and ticket['channel_id'] not in inactivity_warned:
+            try:
+                await channel.send(
+                    f"⚠️ This ticket has had no activity for {format_duration(idle)} and will be closed in about "
+                    f"{format_duration(max(limit - idle, INACTIVITY_SWEEP_MINUTES * 60))} unless someone replies."
+                )
+            except discord.HTTPException:
+                log.exception('Inactivity warning failed', extra={'event': 'inactivity_warn_error', 'channel_id': channel.id})
+                continue
+            inactivity_warned.add(ticket['channel_id'])
+    results = await asyncio.gather(*closes)
+    return sum(results)
 
-def get_db():
-    """Get database connection"""
-    return psycopg2.connect(DATABASE_URL)
+# Profiling
+# Both tools watch the event loop thread from a background thread, so they cost the loop
+# nothing but the GIL hand-offs. $profile samples its stack every PROFILE_INTERVAL_MS and
+# counts identical stacks - the collapsed "a;b;c count" lines flamegraph.pl and speedscope
+# read. The lag monitor runs always: a loop task beats every LOOP_LAG_TICK_MS, and when a
+# beat is late past LOOP_LAG_THRESHOLD_MS the watchdog grabs the stack that is hogging it.
+def collapse_stack(frame):
+    """One frame's stack as a collapsed-stack key, outermost call first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
 
-def save_ticket(channel_id, user_id, ticket_type, **kwargs):
-    """Save a ticket to database"""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO tickets (channel_id, user_id, ticket_type, tier, trader, giving, receiving, tip, reason, details)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, (
-        channel_id, user_id, ticket_type,
-        kwargs.get('tier'), kwargs.get('trader'), kwargs.get('giving'),
-        kwargs.get('receiving'), kwargs.get('tip'),
-        kwargs.get('reason'), kwargs.get('details')
-    ))
-    conn.commit()
-    cur.close()
-    conn.close()
+def is_idle_frame(frame):
+    """True when the loop is parked in select() waiting for I/O"""
+    return frame.f_code.co_name in ('select', 'poll', 'control') and frame.f_code.co_filename.endswith('selectors.py')
 
-def get_ticket(channel_id):
-    """Get ticket data from database"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM tickets WHERE channel_id = %s", (channel_id,))
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    return result
+class StackSampler:
+    """Samples one thread's stack on a timer (run() blocks - call it from a worker thread)"""
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stop = ThreadEvent()
 
-def claim_ticket_db(channel_id, user_id):
-    """Mark ticket as claimed"""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE tickets SET claimed_by = %s WHERE channel_id = %s", (user_id, channel_id))
-    conn.commit()
-    cur.close()
-    conn.close()
+    def run(self, seconds):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline and not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            if is_idle_frame(frame):
+                self.idle += 1
+            self.stacks[collapse_stack(frame)] += 1
 
-def unclaim_ticket_db(channel_id):
-    """Remove claim from ticket"""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE tickets SET claimed_by = NULL WHERE channel_id = %s", (channel_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    def stop(self):
+        self._stop.set()
 
-def delete_ticket_db(channel_id):
-    """Delete ticket from database"""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM tickets WHERE channel_id = %s", (channel_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
 
-def increment_mm_stats(user_id):
-    """Add 1 to MM's completed tickets"""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO mm_stats (user_id, tickets_completed, last_updated)
-        VALUES (%s, 1, CURRENT_TIMESTAMP)
-        ON CONFLICT (user_id) DO UPDATE SET 
-            tickets_completed = mm_stats.tickets_completed + 1,
-            last_updated = CURRENT_TIMESTAMP
-    """, (user_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    def hottest(self, limit=5):
+        """Busiest functions by samples on top of the stack (idle excluded)"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(';', 1)[-1]
+            if not leaf.startswith(('select (selectors.py', 'poll (selectors.py', 'control (selectors.py')):
+                leaves[leaf] += count
+        return leaves.most_common(limit)
 
-def get_mm_stats_db(user_id):
-    """Get MM statistics from database"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM mm_stats WHERE user_id = %s", (user_id,))
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    return result if result else {'user_id': user_id, 'tickets_completed': 0}
+class LoopLagMonitor:
+    """Records every stall of the event loop longer than the threshold, with the stack to blame"""
+    def __init__(self, tick=LOOP_LAG_TICK_MS / 1000, threshold=LOOP_LAG_THRESHOLD_MS / 1000, keep=LOOP_LAG_KEEP):
+        self.tick = tick
+        self.threshold = threshold
+        self.slow = deque(maxlen=keep)  # Newest last
+        self.stalls = 0
+        self.worst_ms = 0.0
+        self.thread_id = None
+        self._beat = 0.0
+        self._stall = None  # Stack grabbed by the watchdog during the current stall
+        self._task = None
+        self._stop = ThreadEvent()
 
-def get_mm_leaderboard_db(limit=10):
-    """Get top MMs from database"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT user_id, tickets_completed FROM mm_stats ORDER BY tickets_completed DESC LIMIT %s", (limit,))
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-    return results
+    def start(self):
+        """Start watching the running loop (call from the loop)"""
+        if self._task is not None:
+            return
+        self.thread_id = get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        Thread(target=self._watch, name='loop-lag-watchdog', daemon=True).start()
 
-def can_see_tier(user_roles, ticket_tier):
-    """Check if user with their roles can see a ticket of given tier"""
-    user_role_ids = [role.id for role in user_roles]
-    ticket_level = MM_TIERS[ticket_tier]['level']
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
 
-def is_mm_or_admin(user, guild):
-    """Check if user is MM or admin"""
-    # Check if admin
-    if user.guild_permissions.administrator:
-        return True
-    
-    # Check if user has any MM role
-    user_role_ids = [role.id for role in user.roles]
-    for role_id in MM_ROLE_IDS.values():
-        if role_id in user_role_ids:
-            return True
-    
-    return False
-    
-    # OG can see everything
-    if MM_ROLE_IDS['og'] in user_role_ids:
-        return True
+    async def _heartbeat(self):
+        while True:
+            beat = self._beat = time.perf_counter()
+            await asyncio.sleep(self.tick)
+            lag = time.perf_counter() - beat - self.tick
+            if lag < self.threshold:
+                continue
+            stall, self._stall = self._stall, None
+            record = {
+                'at': datetime.utcnow(),
+                'lag_ms': round(lag * 1000, 1),
+                'stack': stall['stack'] if stall and stall['beat'] == beat else None
+            }
+            self.slow.append(record)
+            self.stalls += 1
+            self.worst_ms = max(self.worst_ms, record['lag_ms'])
+            log.warning('Event loop blocked for %.0fms', record['lag_ms'], extra={
+                'event': 'loop_lag', 'lag_ms': record['lag_ms'], 'stack': record['stack']
+            })
+
+    def _watch(self):
+        while not self._stop.wait(self.tick):
+            beat = self._beat
+            if self._stall is None and time.perf_counter() - beat > self.tick + self.threshold:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    self._stall = {'beat': beat, 'stack': collapse_stack(frame)}
+
+    def metrics(self):
+        return {'stalls': self.stalls, 'worst_ms': self.worst_ms, 'threshold_ms': round(self.threshold * 1000)}
+
+lag_monitor = LoopLagMonitor()
+_profiler = None  # The StackSampler of the $profile run in progress
+
+def save_profile(sampler, started):
+    """Write a profile's collapsed stacks under PROFILE_DIR, returning the path
     
-    # Check if user has a role that matches or exceeds the ticket tier
-    for tier_key, role_id in MM_ROLE_IDS.items():
-        if role_id in user_role_ids:
-            user_level = MM_TIERS[tier_key]['level']
-            # User can only see tickets at their level or below (except OG sees all)
-            if tier_key == 'og':
-                return True
-            elif user_level >= ticket_level:
-                return True
+    Only this cluster's newest PROFILE_KEEP files are kept; older ones are deleted.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prefix = f'profile-c{CLUSTER_ID}-'
+    path = os.path.join(PROFILE_DIR, f'{prefix}{started:%Y%m%d-%H%M%S}.folded')
+    with open(path, 'w') as f:
+        f.write(sampler.collapsed())
     
-    return False
+    saved = sorted(name for name in os.listdir(PROFILE_DIR) if name.startswith(prefix) and name.endswith('.folded'))
+    for name in saved[:-max(1, PROFILE_KEEP)]:  # The file just written is always kept - it is being sent
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+    return path
 
 # MM Trade Details Modal
-class MMTradeModal(Modal, title='Middleman Trade Details'):
+class MMTradeModal(BotModal, title='Middleman Trade Details'):
     def __init__(self, tier):
         super().__init__()
         self.tier = tier
@@ -315,7 +2434,7 @@ class MMTradeModal(Modal, title='Middleman Trade Details'):
             await interaction.followup.send(f'❌ Error creating ticket: {str(e)}', ephemeral=True)
 
 # Support Ticket Modal
-class SupportTicketModal(Modal, title='Open Support Ticket'):
+class SupportTicketModal(BotModal, title='Open Support Ticket'):
     def __init__(self):
         super().__init__()
 
@@ -353,7 +2472,7 @@ class SupportTicketModal(Modal, title='Open Support Ticket'):
             await interaction.followup.send(f'❌ Error creating ticket: {str(e)}', ephemeral=True)
 
 # Support Ticket View (for inside the ticket)
-class SupportTicketView(View):
+class SupportTicketView(BotView):
     def __init__(self):
         super().__init__(timeout=None)
     
@@ -363,20 +2482,19 @@ class SupportTicketView(View):
         await close_ticket(interaction.channel, interaction.user)
 
 # MM Setup View (Persistent)
-class MMSetupView(View):
+TIER_PROMPT_EMBED = discord.Embed(title='Select your middleman tier:', color=MM_COLOR)  # Static: shared by every send
+
+class MMSetupView(BotView):
     def __init__(self):
         super().__init__(timeout=None)
     
     @discord.ui.button(label='Open MM Ticket', emoji='⚖️', style=discord.ButtonStyle.primary, custom_id='open_mm_ticket_main')
     async def open_mm_button(self, interaction: discord.Interaction, button: Button):
-        tier_embed = discord.Embed(
-            title='Select your middleman tier:',
-            color=MM_COLOR
-        )
-        await interaction.response.send_message(embed=tier_embed, view=TierSelectView(), ephemeral=True)
+        tiers = get_guild_config(interaction.guild.id)['mm_tiers']
+        await interaction.response.send_message(embed=TIER_PROMPT_EMBED, view=TierSelectView(tiers), ephemeral=True)
 
 # Support Setup View (Persistent)
-class SupportSetupView(View):
+class SupportSetupView(BotView):
     def __init__(self):
         super().__init__(timeout=None)
     
@@ -387,28 +2505,14 @@ class SupportSetupView(View):
 
 # Tier Selection Dropdown
 class TierSelect(Select):
-    def __init__(self):
+    def __init__(self, tiers=MM_TIERS):
         options = [
             discord.SelectOption(
-                label='$1-$15 Middleman',
-                value='basic',
-                emoji='💲'
-            ),
-            discord.SelectOption(
-                label='$15-$50 Middleman',
-                value='advanced',
-                emoji='💸'
-            ),
-            discord.SelectOption(
-                label='$50-$150 Middleman',
-                value='premium',
-                emoji='💰'
-            ),
-            discord.SelectOption(
-                label='$150+ Middleman',
-                value='og',
-                emoji='💳'
+                label=tier['name'],
+                value=tier_key,
+                emoji=tier['emoji']
             )
+            for tier_key, tier in tiers.items()
         ]
         
         super().__init__(
@@ -422,13 +2526,13 @@ class TierSelect(Select):
         modal = MMTradeModal(selected_tier)
         await interaction.response.send_modal(modal)
 
-class TierSelectView(View):
-    def __init__(self):
+class TierSelectView(BotView):
+    def __init__(self, tiers=MM_TIERS):
         super().__init__(timeout=None)
-        self.add_item(TierSelect())
+        self.add_item(TierSelect(tiers))
 
 # Coinflip Button View
-class CoinflipView(View):
+class CoinflipView(BotView):
     def __init__(self, user1, user2, total_rounds, is_first_to):
         super().__init__(timeout=60)
         self.user1 = user1
@@ -439,8 +2543,7 @@ class CoinflipView(View):
         self.user2_choice = None
         self.chosen_users = []
     
-    @discord.ui.button(label='Heads', emoji='🪙', style=discord.ButtonStyle.primary, custom_id='heads_cf')
-    async def heads_button(self, interaction: discord.Interaction, button: Button):
+    async def choose(self, interaction, button, side):
         if interaction.user.id not in [self.user1.id, self.user2.id]:
             return await interaction.response.send_message('❌ You are not part of this coinflip!', ephemeral=True)
         
@@ -448,20 +2551,14 @@ class CoinflipView(View):
             return await interaction.response.send_message('❌ You already made your choice!', ephemeral=True)
         
         if interaction.user.id == self.user1.id:
-            self.user1_choice = 'heads'
+            self.user1_choice = side
         else:
-            self.user2_choice = 'heads'
+            self.user2_choice = side
         
         self.chosen_users.append(interaction.user.id)
         button.disabled = True
         
-        mode_text = f"First to {self.total_rounds}" if self.is_first_to else f"Best of {self.total_rounds}"
-        embed = discord.Embed(
-            title='🪙 Choose Your Side',
-            description=f'**{self.user1.mention}** vs **{self.user2.mention}**\n\n**Mode:** {mode_text}\n\n**Select your side below:**',
-            color=MM_COLOR
-        )
-        
+        embed = coinflip_challenge_embed(self.user1, self.user2, self.total_rounds, self.is_first_to)
         if self.user1_choice:
             embed.add_field(name=f'{self.user1.display_name} has chosen', value=f'**{self.user1_choice.upper()}**', inline=False)
         if self.user2_choice:
@@ -470,43 +2567,18 @@ class CoinflipView(View):
         await interaction.response.edit_message(embed=embed, view=self)
         
         if len(self.chosen_users) == 2:
-            await asyncio.sleep(1)
+            await drain_sleep(COINFLIP_CHOICE_DELAY)
             await self.start_coinflip(interaction)
     
+    @discord.ui.button(label='Heads', emoji='🪙', style=discord.ButtonStyle.primary, custom_id='heads_cf')
+    async def heads_button(self, interaction: discord.Interaction, button: Button):
+        await self.choose(interaction, button, 'heads')
+    
     @discord.ui.button(label='Tails', emoji='🪙', style=discord.ButtonStyle.secondary, custom_id='tails_cf')
     async def tails_button(self, interaction: discord.Interaction, button: Button):
-        if interaction.user.id not in [self.user1.id, self.user2.id]:
-            return await interaction.response.send_message('❌ You are not part of this coinflip!', ephemeral=True)
-        
-        if interaction.user.id in self.chosen_users:
-            return await interaction.response.send_message('❌ You already made your choice!', ephemeral=True)
-        
-        if interaction.user.id == self.user1.id:
-            self.user1_choice = 'tails'
-        else:
-            self.user2_choice = 'tails'
-        
-        self.chosen_users.append(interaction.user.id)
-        button.disabled = True
-        
-        mode_text = f"First to {self.total_rounds}" if self.is_first_to else f"Best of {self.total_rounds}"
-        embed = discord.Embed(
-            title='🪙 Choose Your Side',
-            description=f'**{self.user1.mention}** vs **{self.user2.mention}**\n\n**Mode:** {mode_text}\n\n**Select your side below:**',
-            color=MM_COLOR
-        )
-        
-        if self.user1_choice:
-            embed.add_field(name=f'{self.user1.display_name} has chosen', value=f'**{self.user1_choice.upper()}**', inline=False)
-        if self.user2_choice:
-            embed.add_field(name=f'{self.user2.display_name} has chosen', value=f'**{self.user2_choice.upper()}**', inline=False)
-        
-        await interaction.response.edit_message(embed=embed, view=self)
-        
-        if len(self.chosen_users) == 2:
-            await asyncio.sleep(1)
-            await self.start_coinflip(interaction)
+        await self.choose(interaction, button, 'tails')
     
+    @track_work('games')
     async def start_coinflip(self, interaction):
         for item in self.children:
             item.disabled = True
@@ -521,7 +2593,7 @@ class CoinflipView(View):
         start_embed.timestamp = datetime.utcnow()
         
         await interaction.message.edit(embed=start_embed, view=self)
-        await asyncio.sleep(2)
+        await drain_sleep(COINFLIP_START_DELAY)
         
         user1_wins = 0
         user2_wins = 0
@@ -564,6 +2636,10 @@ class CoinflipView(View):
                     else:
                         streak_count = 1
                         last_winner = 'user2'
+                log.info('Coinflip round', extra=log_fields(
+                    interaction.guild, interaction.channel, event='coinflip_round',
+                    round=rounds_played, result=flip_result, score=[user1_wins, user2_wins]
+                ))
                 
                 progress_embed = discord.Embed(
                     title='🪙 Coinflip in Progress...',
@@ -576,7 +2652,7 @@ class CoinflipView(View):
                 progress_embed.timestamp = datetime.utcnow()
                 
                 await interaction.message.edit(embed=progress_embed, view=self)
-                await asyncio.sleep(1.5)
+                await drain_sleep(COINFLIP_ROUND_DELAY)
         else:
             # Best of X: Play exactly X rounds, winner has most wins
             rounds_to_win = (self.total_rounds // 2) + 1
@@ -611,6 +2687,10 @@ class CoinflipView(View):
                     else:
                         streak_count = 1
                         last_winner = 'user2'
+                log.info('Coinflip round', extra=log_fields(
+                    interaction.guild, interaction.channel, event='coinflip_round',
+                    round=rounds_played, result=flip_result, score=[user1_wins, user2_wins]
+                ))
                 
                 # Early finish if someone already won majority
                 if user1_wins >= rounds_to_win or user2_wins >= rounds_to_win:
@@ -627,7 +2707,7 @@ class CoinflipView(View):
                 progress_embed.timestamp = datetime.utcnow()
                 
                 await interaction.message.edit(embed=progress_embed, view=self)
-                await asyncio.sleep(1.5)
+                await drain_sleep(COINFLIP_ROUND_DELAY)
         
         # Determine winner
         if user1_wins > user2_wins:
@@ -661,110 +2741,367 @@ class CoinflipView(View):
             final_embed.add_field(name='Last 10 Results', value=recent_results, inline=False)
         
         await interaction.message.edit(embed=final_embed, view=self)
+        log.info('Coinflip complete', extra=log_fields(
+            interaction.guild, interaction.channel, event='coinflip_complete',
+            mode=mode_text, rounds=rounds_played, score=[user1_wins, user2_wins]
+        ))
 
 # MM Ticket View
-class MMTicketView(View):
+class MMTicketView(BotView):
     def __init__(self):
         super().__init__(timeout=None)
     
     @discord.ui.button(label='✅ Claim Ticket', style=discord.ButtonStyle.success, custom_id='claim_mm_ticket')
     async def claim_button(self, interaction: discord.Interaction, button: Button):
-        # Get ticket from DATABASE (not active_tickets dictionary)
-        ticket_data = get_ticket(interaction.channel.id)
+        # Get ticket from the registry (no database round trip)
+        ticket_data = lookup_ticket(interaction.channel.id)
         if not ticket_data:
             return await interaction.response.send_message('❌ Ticket data not found!', ephemeral=True)
         
         ticket_tier = ticket_data.get('tier') or ticket_data['tier']
         
-        if not can_see_tier(interaction.user.roles, ticket_tier) and not interaction.user.guild_permissions.administrator:
+        if not can_see_tier(interaction.user, ticket_tier):
             return await interaction.response.send_message('❌ You do not have permission to claim this ticket tier!', ephemeral=True)
         
         # Check if already claimed (from DATABASE)
         if ticket_data.get('claimed_by'):
-            claimer = interaction.guild.get_member(ticket_data['claimed_by'])
+            claimer = await resolve_member(interaction.guild, ticket_data['claimed_by'])
             return await interaction.response.send_message(f'❌ This ticket is already claimed by {claimer.mention if claimer else "someone"}!', ephemeral=True)
         
-        # CLAIM IN DATABASE (not claimed_tickets dictionary)
-        claim_ticket_db(interaction.channel.id, interaction.user.id)
+        # CLAIM IN THE REGISTRY first (a second click during the write sees it taken), then in DATABASE
+        ticket_data['claimed_by'] = interaction.user.id
+        ticket_data['claimed_at'] = datetime.utcnow()
+        try:
+            waited = await asyncio.to_thread(claim_ticket_db, interaction.channel.id, interaction.user.id)
+        except Exception:
+            ticket_data['claimed_by'] = ticket_data['claimed_at'] = None
+            raise
+        record_event('claimed', ticket_data, actor_id=interaction.user.id, seconds=waited)
+        dispatch_claimed(ticket_data, waited)
         
         ticket_creator_id = ticket_data['user_id']
-        ticket_creator = interaction.guild.get_member(ticket_creator_id) if ticket_creator_id else None
+        ticket_creator = await resolve_member(interaction.guild, ticket_creator_id)
+        
+        await interaction.channel.set_permissions(
+            interaction.user,
+            view_channel=True,
+            send_messages=True,
+            read_message_history=True
+        )
+        
+        if ticket_creator:
+            await interaction.channel.set_permissions(
+                ticket_creator,
+                view_channel=True,
+                send_messages=True,
+                read_message_history=True
+            )
+        
+        embed = discord.Embed(
+            description=f'✅ Ticket claimed by {interaction.user.mention}\n\n🔒 **Only the claimer and ticket creator are allowed to talk.**',
+            color=0x57F287
+        )
+        
+        await interaction.response.send_message(embed=embed)
+        await interaction.channel.edit(name=f"{interaction.channel.name}-claimed")
+    
+    @discord.ui.button(label='🔒 Close Ticket', style=discord.ButtonStyle.danger, custom_id='close_mm_ticket')
+    async def close_button(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.defer()
+        await close_ticket(interaction.channel, interaction.user)
+
+# Events
+@bot.event
+async def on_ready():
+    log.info('Bot is online as %s', bot.user, extra={
+        'event': 'ready', 'guilds': len(bot.guilds), 'cluster': CLUSTER_ID,
+        'shard_ids': SHARD_IDS or None, 'shard_count': SHARD_COUNT or None
+    })
+    
+    bot.add_view(TierSelectView())
+    bot.add_view(MMTicketView())
+    bot.add_view(SupportTicketView())
+    bot.add_view(MMSetupView())
+    bot.add_view(SupportSetupView())
+    
+    init_database()  
+    await start_config_listener()
+    if _ticket_numbers['spare'] is None and _number_prefetch is None:
+        await prefetch_ticket_numbers()
+    
+    if not history_maintenance.is_running():
+        history_maintenance.start()
+    if not reconcile_loop.is_running():
+        reconcile_loop.start()
+    if not health_loop.is_running():
+        health_loop.start()
+    if not event_flush_loop.is_running():
+        event_flush_loop.start()
+    if not sla_loop.is_running():
+        sla_loop.start()
+    if not activity_flush_loop.is_running():
+        activity_flush_loop.start()
+    if not inactivity_loop.is_running():
+        inactivity_loop.start()
+    lag_monitor.start()
+    start_dispatcher()
+    try:
+        await sync_app_commands()
+    except Exception:
+        log.exception('Slash command sync failed', extra={'event': 'app_commands_sync_error'})
+
+@bot.listen('on_message')
+async def track_ticket_activity(message):
+    # Registry lookup only - no database work per message
+    if not message.author.bot and message.channel.id in ticket_registry:
+        touch_ticket(message.channel.id, message.created_at.replace(tzinfo=None))
+
+@bot.event
+async def on_member_update(before, after):
+    if before.roles != after.roles:
+        invalidate_permissions(after.guild.id, after.id)
+
+@bot.event
+async def on_raw_member_remove(payload):
+    # Fires whether or not the member was cached
+    member_lru.drop(payload.guild_id, payload.user.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.permissions != after.permissions:
+        invalidate_permissions(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    invalidate_permissions(role.guild.id)
+
+@bot.event
+async def on_guild_update(before, after):
+    if before.owner_id != after.owner_id:
+        invalidate_permissions(after.id)
+
+@bot.check
+async def not_shutting_down(ctx):
+    return not shutting_down()
+
+@bot.before_invoke
+async def set_command_context(ctx):
+    ctx.started_at = time.perf_counter()
+    remember_member(ctx.author)
+    log_context.set(log_fields(ctx.guild, ctx.channel, ctx.author, command=ctx.command.qualified_name))
+
+@bot.after_invoke
+async def log_command(ctx):
+    latency_ms = round((time.perf_counter() - ctx.started_at) * 1000, 1)
+    log.info('Command %s', ctx.command.qualified_name, extra={'event': 'command', 'latency_ms': latency_ms, 'failed': ctx.command_failed})
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, commands.CheckFailure) and shutting_down():
+        return await ctx.reply('⏳ Bot is restarting, please try again in a moment.')
+    if isinstance(error, commands.CommandNotFound):
+        log.debug('Unknown command', extra=log_fields(ctx.guild, ctx.channel, ctx.author, event='command_not_found'))
+        return
+    if isinstance(error, commands.RangeError):
+        return await ctx.reply(f'❌ That is too long (at most {error.maximum} characters).' if isinstance(error.value, str) else f'❌ {error}')
+    error = getattr(error, 'original', error)
+    log.error('Command error', exc_info=error, extra=log_fields(
+        ctx.guild, ctx.channel, ctx.author, event='command_error', command=ctx.command.qualified_name if ctx.command else None
+    ))
+
+# Background Tasks
+@tasks.loop(hours=24)
+async def history_maintenance():
+    """Keep future history partitions ready and detach expired ones"""
+    try:
+        detached = await asyncio.to_thread(maintain_history_db)
+        if detached:
+            log.info('Detached history partitions', extra={'event': 'history_detached', 'partitions': detached})
+    except Exception:
+        log.exception('History maintenance error', extra={'event': 'history_maintenance_error'})
+
+@tasks.loop(seconds=HEALTH_INTERVAL_SECONDS)
+async def health_loop():
+    """Publish this process's heartbeat and shard latencies"""
+    try:
+        await asyncio.to_thread(save_cluster_health_db, cluster_heartbeat({
+            'dispatch': dispatch_metrics(), 'loop_lag': lag_monitor.metrics(), 'members': member_cache_metrics(),
+            'ticket_number_fallbacks': ticket_number_fallbacks
+        }))
+    except Exception:
+        log.exception('Health heartbeat error', extra={'event': 'health_error'})
+
+@tasks.loop(seconds=SLA_TICK_SECONDS)
+async def sla_loop():
+    """Advance the SLA timing wheel one tick and escalate whatever is due"""
+    for channel_id, (stage, since) in sla_wheel.advance():
+        try:
+            await fire_sla(channel_id, stage, since)
+        except Exception:
+            log.exception('SLA escalation error', extra={'event': 'sla_error', 'channel': channel_id})
+
+@tasks.loop(seconds=ACTIVITY_FLUSH_SECONDS)
+async def activity_flush_loop():
+    """Write buffered last-activity times"""
+    await flush_ticket_activity()
+
+@tasks.loop(minutes=INACTIVITY_SWEEP_MINUTES)
+async def inactivity_loop():
+    """Auto-close abandoned tickets"""
+    try:
+        closed = await sweep_inactive_tickets()
+        if closed:
+            log.info('Closed inactive tickets', extra={'event': 'inactivity_closed', 'tickets': closed})
+    except Exception:
+        log.exception('Inactivity sweep error', extra={'event': 'inactivity_error'})
+
+@tasks.loop(seconds=EVENT_FLUSH_SECONDS)
+async def event_flush_loop():
+    """Write buffered ticket events"""
+    await flush_ticket_events()
+
+@tasks.loop(minutes=RECONCILE_INTERVAL_MINUTES)
+async def reconcile_loop():
+    """Periodically repair drift between ticket rows and channels"""
+    try:
+        report = await reconcile_tickets()
+        if report['orphan_rows'] or report['orphan_channels']:
+            log.info('Reconcile: %s', format_reconcile_report(report), extra={'event': 'reconcile', **report})
+    except Exception:
+        log.exception('Reconcile error', extra={'event': 'reconcile_error'})
+
+# Reconciler
+_reconcile_lock = asyncio.Lock()
+
+def find_ticket_orphans(rows):
+    """Compare ticket rows against ticket channels in every guild.
+    
+    Returns (orphan_row_ids, orphan_channels, backfill) where backfill holds
+    (channel_id, guild_id) for older rows missing their guild. Runs in a
+    single pass over the rows and the ticket categories, using set lookups only.
+    """
+    ticket_ids = {row['channel_id'] for row in rows}
+    guilds = {guild.id: guild for guild in bot.guilds}
+    all_guilds_ready = not any(guild.unavailable for guild in guilds.values())
+    now = discord.utils.utcnow()
+    
+    # Channels in the ticket categories that have no row
+    orphan_channels = []
+    for guild in guilds.values():
+        for category in guild.categories:
+            config = get_guild_config(guild.id)
+            if category.name not in (config['ticket_category'], config['support_category']):
+                continue
+            for channel in category.text_channels:
+                if not channel.name.startswith('ticket-') or channel.id in ticket_ids or channel.id in ticket_registry:
+                    continue
+                if (now - channel.created_at).total_seconds() >= RECONCILE_GRACE_SECONDS:
+                    orphan_channels.append(channel)
+    
+    # Rows whose channel no longer exists
+    orphan_rows = []
+    backfill = []
+    for row in rows:
+        channel_id, guild_id = row['channel_id'], row['guild_id']
+        channel = bot.get_channel(channel_id)
+        if guild_id is None:
+            if channel:
+                backfill.append((channel_id, channel.guild.id))
+                continue
+            # Older rows don't know their guild - only trust a miss when this process
+            # sees every guild (unsharded) and all of them are loaded
+            if SHARD_COUNT or not all_guilds_ready:
+                continue
+        else:
+            guild = guilds.get(guild_id)
+            if not guild or guild.unavailable:
+                continue
+        if channel is None:
+            orphan_rows.append(channel_id)
+    
+    return orphan_rows, orphan_channels, backfill
+
+async def reconcile_tickets():
+    """Find and fix orphaned ticket rows and channels, returning a report"""
+    async with _reconcile_lock:
+        started = datetime.utcnow()
+        rows = await asyncio.to_thread(get_live_tickets_db)
+        sync_ticket_registry(rows)
+        requeue_unclaimed()
+        seed_sla_timers()
+        orphan_rows, orphan_channels, backfill = find_ticket_orphans(rows)
         
-        await interaction.channel.set_permissions(
-            interaction.user,
-            view_channel=True,
-            send_messages=True,
-            read_message_history=True
-        )
+        if backfill:
+            await asyncio.to_thread(backfill_ticket_guilds_db, backfill)
+            for channel_id, guild_id in backfill:
+                if channel_id in ticket_registry:
+                    ticket_registry[channel_id]['guild_id'] = guild_id
         
-        if ticket_creator:
-            await interaction.channel.set_permissions(
-                ticket_creator,
-                view_channel=True,
-                send_messages=True,
-                read_message_history=True
-            )
+        archived = []
+        if orphan_rows:
+            archived = await asyncio.to_thread(archive_orphan_tickets_db, orphan_rows)
+            for row in archived:
+                record_event('closed', row, target_id=row['claimed_by'], seconds=row['open_seconds'])
+            for channel_id in orphan_rows:
+                forget_ticket(channel_id)
+                cancel_sla(channel_id)
         
-        embed = discord.Embed(
-            description=f'✅ Ticket claimed by {interaction.user.mention}\n\n🔒 **Only the claimer and ticket creator are allowed to talk.**',
-            color=0x57F287
-        )
+        # Delete orphan channels one at a time to stay well under the rate limit
+        deleted = 0
+        failed = 0
+        for channel in orphan_channels:
+            try:
+                await channel.delete(reason='Ticket reconcile: no ticket record')
+                deleted += 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                failed += 1
+            await asyncio.sleep(shared_rate_delay(RECONCILE_DELETE_DELAY))
         
-        await interaction.response.send_message(embed=embed)
-        await interaction.channel.edit(name=f"{interaction.channel.name}-claimed")
-    
-    @discord.ui.button(label='🔒 Close Ticket', style=discord.ButtonStyle.danger, custom_id='close_mm_ticket')
-    async def close_button(self, interaction: discord.Interaction, button: Button):
-        await interaction.response.defer()
-        await close_ticket(interaction.channel, interaction.user)
+        return {
+            'tickets_checked': len(rows),
+            'orphan_rows': len(orphan_rows),
+            'rows_archived': len(archived),
+            'orphan_channels': len(orphan_channels),
+            'channels_deleted': deleted,
+            'channels_failed': failed,
+            'seconds': (datetime.utcnow() - started).total_seconds()
+        }
 
-# Events
-@bot.event
-async def on_ready():
-    print(f'✅ Bot is online as {bot.user}')
-    print(f'📊 Serving {len(bot.guilds)} servers')
-    
-    bot.add_view(TierSelectView())
-    bot.add_view(MMTicketView())
-    bot.add_view(SupportTicketView())
-    bot.add_view(MMSetupView())
-    bot.add_view(SupportSetupView())
-    
-    init_database()  
+def format_reconcile_report(report):
+    """Format a reconcile report as one line"""
+    return (
+        f"checked {report['tickets_checked']} tickets, "
+        f"archived {report['rows_archived']}/{report['orphan_rows']} orphan rows, "
+        f"deleted {report['channels_deleted']}/{report['orphan_channels']} orphan channels "
+        f"({report['channels_failed']} failed) in {report['seconds']:.1f}s"
+    )
 
 # Setup Command
-@bot.command(name='mmsetup')
-@commands.has_permissions(administrator=True)
-async def setup(ctx):
-    """Create MM ticket panel"""
+def mm_panel_embed(tiers):
+    """The $mmsetup panel listing a guild's tiers"""
+    tier_lines = '\n'.join(f"{tier['emoji']} **{tier['name']}**" for tier in tiers.values())
     embed = discord.Embed(
         title='⚖️ Middleman Services',
-        description='Click the button below to open a middleman ticket.\n\n**Available Tiers:**\n💲**$1-$15 Middleman**\n💸 **$15-$50 Middleman**\n💰 **$50-$150 Middleman**\n💳 **$150+ Middleman** ',
+        description=f'Click the button below to open a middleman ticket.\n\n**Available Tiers:**\n{tier_lines}',
         color=MM_COLOR
     )
     embed.set_footer(text='Select your tier to get started')
-    
-    view = View(timeout=None)
-    button = Button(label='Open MM Ticket', emoji='⚖️', style=discord.ButtonStyle.primary, custom_id='open_mm_ticket')
-    
-    async def button_callback(interaction: discord.Interaction):
-        tier_embed = discord.Embed(
-            title='Select your middleman tier:',
-            color=MM_COLOR
-        )
-        await interaction.response.send_message(embed=tier_embed, view=TierSelectView(), ephemeral=True)
-    
-    button.callback = button_callback
-    view.add_item(button)
-    
-    await ctx.send(embed=embed, view=MMSetupView())
-    await ctx.message.delete()
+    return embed
 
-# Support Setup Command
-@bot.command(name='supportsetup')
+@bot.hybrid_command(name='mmsetup')
 @commands.has_permissions(administrator=True)
-async def support_setup(ctx):
-    """Create Support ticket panel"""
+@app_commands.default_permissions(administrator=True)
+async def setup(ctx):
+    """Create MM ticket panel"""
+    await ctx.send(embed=mm_panel_embed(get_guild_config(ctx.guild.id)['mm_tiers']), view=MMSetupView())
+    if ctx.interaction is None:
+        await ctx.message.delete()
+
+# Support Setup Command
+def support_panel_embed():
+    """The $supportsetup panel"""
     embed = discord.Embed(
         title='🎫 Support Center',
         description='Need help? Open a support ticket below!\n\n**What can you use support for?**\n• General Support\n• Claiming a Prize\n• Partnership Inquiries\n• Report an Issue\n• Other Questions',
@@ -772,51 +3109,55 @@ async def support_setup(ctx):
     )
     embed.set_footer(text='Click the button below to open a ticket')
     embed.timestamp = datetime.utcnow()
-    
-    view = View(timeout=None)
-    button = Button(label='Open Support Ticket', emoji='🎫', style=discord.ButtonStyle.primary, custom_id='open_support_ticket')
-    
-    async def button_callback(interaction: discord.Interaction):
-        modal = SupportTicketModal()
-        await interaction.response.send_modal(modal)
-    
-    button.callback = button_callback
-    view.add_item(button)
-    
-    await ctx.send(embed=embed, view=SupportSetupView())
-    await ctx.message.delete()
+    return embed
+
+@bot.hybrid_command(name='supportsetup')
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def support_setup(ctx):
+    """Create Support ticket panel"""
+    await ctx.send(embed=support_panel_embed(), view=SupportSetupView())
+    if ctx.interaction is None:
+        await ctx.message.delete()
 
-@bot.command(name='claim')
+@bot.hybrid_command(name='claim')
 async def claim(ctx):
     """Claim a ticket"""
     
     if not is_mm_or_admin(ctx.author, ctx.guild):
         return await ctx.reply('❌ You do not have permission to use this command!')
     
-    if not ctx.channel.name.startswith('ticket-'):
-        return await ctx.reply('❌ This command can only be used in ticket channels!')
-
-    # ✅ Get ticket from DATABASE
-    ticket_data = get_ticket(ctx.channel.id)
+    # ✅ Get ticket from the registry
+    ticket_data = lookup_ticket(ctx.channel.id)
     if not ticket_data:
-        return await ctx.reply('❌ Ticket data not found!')
+        return await ctx.reply('❌ This command can only be used in ticket channels!')
     
-    # ✅ Check if already claimed (from DATABASE)
+    # ✅ Check if already claimed
     if ticket_data.get('claimed_by'):
-        claimer = ctx.guild.get_member(ticket_data['claimed_by'])
+        claimer = await resolve_member(ctx.guild, ticket_data['claimed_by'])
         return await ctx.reply(f'❌ This ticket is already claimed by {claimer.mention if claimer else "someone"}!')
     
     ticket_tier = ticket_data.get('tier')
     
     # Check permissions for MM tickets
-    if ticket_tier and not can_see_tier(ctx.author.roles, ticket_tier) and not ctx.author.guild_permissions.administrator:
+    if ticket_tier and not can_see_tier(ctx.author, ticket_tier):
         return await ctx.reply('❌ You do not have permission to claim this ticket tier!')
 
-    # ✅ Claim in DATABASE
-    claim_ticket_db(ctx.channel.id, ctx.author.id)
+    await ctx.defer()  # Slash commands must answer within 3s; the permission edits can take longer
+    
+    # ✅ Claim in the registry first (a concurrent claim sees it taken), then in DATABASE
+    ticket_data['claimed_by'] = ctx.author.id
+    ticket_data['claimed_at'] = datetime.utcnow()
+    try:
+        waited = await asyncio.to_thread(claim_ticket_db, ctx.channel.id, ctx.author.id)
+    except Exception:
+        ticket_data['claimed_by'] = ticket_data['claimed_at'] = None
+        raise
+    record_event('claimed', ticket_data, actor_id=ctx.author.id, seconds=waited)
+    dispatch_claimed(ticket_data, waited)
     
     ticket_creator_id = ticket_data['user_id']
-    ticket_creator = ctx.guild.get_member(ticket_creator_id) if ticket_creator_id else None
+    ticket_creator = await resolve_member(ctx.guild, ticket_creator_id)
     
     await ctx.channel.set_permissions(
         ctx.author,
@@ -843,48 +3184,46 @@ async def claim(ctx):
     await ctx.channel.edit(name=f"{ctx.channel.name}-claimed")
 
 # unclaim
-@bot.command(name='unclaim')
+@bot.hybrid_command(name='unclaim')
 async def unclaim_command(ctx):
     """Unclaim a ticket"""
-    if not ctx.channel.name.startswith('ticket-'):
-        return await ctx.reply('❌ This command can only be used in ticket channels!')
-    
-    # GET FROM DATABASE (not claimed_tickets dictionary)
-    ticket_data = get_ticket(ctx.channel.id)
+    # GET FROM REGISTRY (no database round trip)
+    ticket_data = lookup_ticket(ctx.channel.id)
     if not ticket_data:
-        return await ctx.reply('❌ Ticket data not found!')
+        return await ctx.reply('❌ This command can only be used in ticket channels!')
     
     if not ticket_data.get('claimed_by'):
         return await ctx.reply('❌ This ticket is not claimed!')
     
     claimer_id = ticket_data['claimed_by']
     
-    if ctx.author.id != claimer_id and not ctx.author.guild_permissions.administrator:
+    if ctx.author.id != claimer_id and not is_admin(ctx.author):
         return await ctx.reply('❌ Only the ticket claimer or administrators can unclaim this ticket!')
     
     ticket_tier = ticket_data.get('tier')
     ticket_creator_id = ticket_data['user_id']
-    ticket_creator = ctx.guild.get_member(ticket_creator_id) if ticket_creator_id else None
+    ticket_creator = await resolve_member(ctx.guild, ticket_creator_id)
     
-    # UNCLAIM IN DATABASE (not claimed_tickets dictionary)
-    unclaim_ticket_db(ctx.channel.id)
+    # UNCLAIM IN DATABASE, then mirror it in the registry
+    await asyncio.to_thread(unclaim_ticket_db, ctx.channel.id)
+    ticket_data['claimed_by'] = None
+    ticket_data['claimed_at'] = None
+    record_event('unclaimed', ticket_data, actor_id=ctx.author.id, target_id=claimer_id)
+    enqueue_ticket(ctx.guild, ticket_data)
+    schedule_sla(ticket_data, since=datetime.utcnow())
     
     # Restore permissions
     if ticket_tier:
-        ticket_level = MM_TIERS[ticket_tier]['level']
-        
-        for tier_key, role_id in MM_ROLE_IDS.items():
+        for role_id in get_permission_matrix(ctx.guild.id).tier_roles.get(ticket_tier, []):
             role = ctx.guild.get_role(role_id)
             if role:
-                tier_lvl = MM_TIERS[tier_key]['level']
-                if tier_key == 'og' or tier_lvl >= ticket_level:
-                    await ctx.channel.set_permissions(
-                        role,
-                        view_channel=True,
-                        send_messages=True,
-                        read_message_history=True,
-                        manage_messages=True
-                    )
+                await ctx.channel.set_permissions(
+                    role,
+                    view_channel=True,
+                    send_messages=True,
+                    read_message_history=True,
+                    manage_messages=True
+                )
     
     new_name = ctx.channel.name.replace('-claimed', '')
     await ctx.channel.edit(name=new_name)
@@ -897,14 +3236,14 @@ async def unclaim_command(ctx):
     await ctx.reply(embed=embed)
 
 # Close Command
-@bot.command(name='close')
+@bot.hybrid_command(name='close')
 async def close_command(ctx):
     """Close a ticket"""
     
     if not is_mm_or_admin(ctx.author, ctx.guild):
         return await ctx.reply('❌ You do not have permission to use this command!')
     
-    if not ctx.channel.name.startswith('ticket-'):
+    if not lookup_ticket(ctx.channel.id):
         return await ctx.reply('❌ This command can only be used in ticket channels!')
 
     embed = discord.Embed(
@@ -935,7 +3274,7 @@ async def close_command(ctx):
     await ctx.reply(embed=embed, view=view)
 
 # Add/Remove User Commands
-@bot.command(name='add')
+@bot.hybrid_command(name='add')
 async def add_user(ctx, member: discord.Member = None):
     """Add user to ticket"""
 
@@ -943,13 +3282,15 @@ async def add_user(ctx, member: discord.Member = None):
     if not is_mm_or_admin(ctx.author, ctx.guild):
         return await ctx.reply('❌ You do not have permission to use this command!')
     
-    if not ctx.channel.name.startswith('ticket-'):
+    ticket = lookup_ticket(ctx.channel.id)
+    if not ticket:
         return await ctx.reply('❌ This command can only be used in ticket channels!')
 
     if not member:
         return await ctx.reply('❌ Please mention a valid user!')
 
     await ctx.channel.set_permissions(member, view_channel=True, send_messages=True, read_message_history=True)
+    record_event('user_added', ticket, actor_id=ctx.author.id, target_id=member.id)
 
     embed = discord.Embed(
         description=f'✅ {member.mention} has been added to the ticket',
@@ -958,7 +3299,7 @@ async def add_user(ctx, member: discord.Member = None):
 
     await ctx.reply(embed=embed)
 
-@bot.command(name='remove')
+@bot.hybrid_command(name='remove')
 async def remove_user(ctx, member: discord.Member = None):
     """Remove user from ticket"""
 
@@ -966,16 +3307,15 @@ async def remove_user(ctx, member: discord.Member = None):
     if not is_mm_or_admin(ctx.author, ctx.guild):
         return await ctx.reply('❌ You do not have permission to use this command!')
     
-    if not ctx.channel.name.startswith('ticket-'):
-        return await ctx.reply('❌ This command can only be used in ticket channels!')
-    
-    if not ctx.channel.name.startswith('ticket-'):
+    ticket = lookup_ticket(ctx.channel.id)
+    if not ticket:
         return await ctx.reply('❌ This command can only be used in ticket channels!')
 
     if not member:
         return await ctx.reply('❌ Please mention a valid user!')
 
     await ctx.channel.set_permissions(member, overwrite=None)
+    record_event('user_removed', ticket, actor_id=ctx.author.id, target_id=member.id)
 
     embed = discord.Embed(
         description=f'✅ {member.mention} has been removed from the ticket',
@@ -985,28 +3325,26 @@ async def remove_user(ctx, member: discord.Member = None):
     await ctx.reply(embed=embed)
 
 # Proof Command
-@bot.command(name='proof')
+@bot.hybrid_command(name='proof')
 async def proof_command(ctx):
     """Send MM proof to proof channel"""
     
     if not is_mm_or_admin(ctx.author, ctx.guild):
         return await ctx.reply('❌ You do not have permission to use this command!')
     
-    if not ctx.channel.name.startswith('ticket-'):
-        return await ctx.reply('❌ This command can only be used in a ticket.')
-
-    # GET FROM DATABASE (not active_tickets dictionary)
-    ticket = get_ticket(ctx.channel.id)
+    # GET FROM REGISTRY (no database round trip)
+    ticket = lookup_ticket(ctx.channel.id)
     if not ticket:
-        return await ctx.reply('❌ No ticket data found.')
+        return await ctx.reply('❌ This command can only be used in a ticket.')
 
-    requester = ctx.guild.get_member(ticket['user_id'])
+    requester = await resolve_member(ctx.guild, ticket['user_id'])
     trader = ticket.get('trader', 'Unknown')
     giving = ticket.get('giving', 'Unknown')
     receiving = ticket.get('receiving', 'Unknown')
     tier = ticket.get('tier', 'Unknown')
 
-    proof_channel = ctx.guild.get_channel(PROOF_CHANNEL_ID)
+    config = get_guild_config(ctx.guild.id)
+    proof_channel = ctx.guild.get_channel(config['proof_channel_id'])
 
     if not proof_channel:
         return await ctx.reply('❌ Proof channel not found.')
@@ -1017,28 +3355,379 @@ async def proof_command(ctx):
     )
 
     embed.add_field(name='Middleman', value=ctx.author.mention, inline=False)
-    if tier and tier in MM_TIERS:
-        embed.add_field(name='Tier', value=MM_TIERS[tier]['name'], inline=False)
+    if tier and tier in config['mm_tiers']:
+        embed.add_field(name='Tier', value=config['mm_tiers'][tier]['name'], inline=False)
     embed.add_field(name='Requester', value=requester.mention if requester else 'Unknown', inline=False)
     embed.add_field(name='Trader', value=trader, inline=False)
     embed.add_field(name='Gave', value=giving, inline=False)
     embed.add_field(name='Received', value=receiving, inline=False)
 
-    ticket_number = ctx.channel.name.replace('ticket-', '') 
+    ticket_number = ticket.get('ticket_number') or ctx.channel.name.replace('ticket-', '')  # Tickets opened before numbering
     embed.set_footer(text=f"Ticket #{ticket_number}")
     embed.timestamp = datetime.utcnow()
 
+    await ctx.defer()
     await proof_channel.send(embed=embed)
     
     # INCREMENT STATS IN DATABASE (not mm_stats dictionary)
-    increment_mm_stats(ctx.author.id)
+    await asyncio.to_thread(increment_mm_stats, ctx.author.id)
+    record_event('proof_posted', ticket, actor_id=ctx.author.id)
     
     await ctx.reply('✅ Proof sent successfully!')
 
+# Search Command
+def clip(text, limit):
+    """text cut to at most `limit` characters, ending in an ellipsis when cut"""
+    return text if len(text) <= limit else text[:max(0, limit - 1)] + '…'
+
+class SearchResultsView(BotView):
+    """Pages through $search results with keyset pagination"""
+    def __init__(self, author, query, rows):
+        super().__init__(timeout=300)
+        self.author = author
+        self.query = query
+        self.pages = [None]  # Keyset cursor each visited page starts after
+        self.page = 0
+        self.show(rows)
+    
+    def show(self, rows):
+        self.has_more = len(rows) > SEARCH_PAGE_SIZE
+        self.rows = rows[:SEARCH_PAGE_SIZE]
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = not self.has_more
+    
+    def embed(self):
+        embed = discord.Embed(title=clip(f'🔎 Search: {self.query}', EMBED_TITLE_MAX), color=MM_COLOR)
+        embed.set_footer(text=f'Page {self.page + 1}')
+        # Trades hold up to 1,100 characters of user text, so share what the embed allows between the rows
+        budget = (EMBED_TOTAL_MAX - len(embed)) // max(1, len(self.rows))
+        for row in self.rows:
+            number = f"#{row['ticket_number']}" if row['ticket_number'] else f"<#{row['channel_id']}>"
+            status = f"closed {row['closed_at']:%Y-%m-%d}" if row['closed_at'] else f"open in <#{row['channel_id']}>"
+            if row['ticket_type'] == 'mm':
+                value = f"**Trader:** {row['trader']}\n**Giving:** {row['giving']}\n**Receiving:** {row['receiving']}"
+            else:
+                value = f"**Reason:** {row['reason']}"
+            name = f"{number} • {row['tier'] or row['ticket_type']} • {status}"
+            opened = f"\n**Opened by:** <@{row['user_id']}> on {row['created_at']:%Y-%m-%d}"
+            limit = min(EMBED_FIELD_MAX, budget - len(name)) - len(opened)
+            embed.add_field(name=name, value=clip(value, limit) + opened, inline=False)
+        return embed
+    
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author.id:
+            await interaction.response.send_message('❌ Only the person who searched can page through results.', ephemeral=True)
+            return False
+        return await super().interaction_check(interaction)
+    
+    async def turn(self, interaction, page):
+        after = self.pages[page]
+        rows = await asyncio.to_thread(search_tickets_db, interaction.guild.id, self.query, after)
+        self.page = page
+        self.show(rows)
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+    
+    @discord.ui.button(label='Previous', emoji='◀️', style=discord.ButtonStyle.secondary)
+    async def previous_button(self, interaction: discord.Interaction, button: Button):
+        await self.turn(interaction, self.page - 1)
+    
+    @discord.ui.button(label='Next', emoji='▶️', style=discord.ButtonStyle.secondary)
+    async def next_button(self, interaction: discord.Interaction, button: Button):
+        last = self.rows[-1]
+        del self.pages[self.page + 1:]
+        self.pages.append((last['created_at'], last['channel_id']))
+        await self.turn(interaction, self.page + 1)
+
+@bot.hybrid_command(name='search')
+async def search_command(ctx, *, query: commands.Range[str, 1, SEARCH_QUERY_MAX] = None):
+    """Find open and closed trades by item, trader or reason"""
+    if not is_mm_or_admin(ctx.author, ctx.guild):
+        return await ctx.reply('❌ You do not have permission to use this command!')
+    if not query:
+        return await ctx.reply('❌ Usage: `$search <words>` - e.g. `$search 500 rbx paypal`')
+    
+    await ctx.defer()
+    rows = await asyncio.to_thread(search_tickets_db, ctx.guild.id, query)
+    if not rows:
+        return await ctx.reply(f'🔎 No tickets match **{query}**.')
+    
+    view = SearchResultsView(ctx.author, query, rows)
+    await ctx.reply(embed=view.embed(), view=view)
+
+# Dispatch Commands
+@bot.hybrid_command(name='available')
+async def available_command(ctx, *, tiers: str = None):
+    """Opt in to ticket offers (all tiers you can claim, or the ones listed)"""
+    if not is_mm_or_admin(ctx.author, ctx.guild):
+        return await ctx.reply('❌ You do not have permission to use this command!')
+    
+    config_tiers = get_guild_config(ctx.guild.id)['mm_tiers']
+    allowed = {tier for tier in config_tiers if can_see_tier(ctx.author, tier)}
+    wanted = {tier.lower() for tier in (tiers or '').split()} or allowed
+    if wanted - allowed:
+        return await ctx.reply(f"❌ You cannot take these tiers: {', '.join(sorted(wanted - allowed))}")
+    
+    available_mms.setdefault(ctx.guild.id, {})[ctx.author.id] = wanted
+    dispatch_wakeup.set()
+    names = ', '.join(config_tiers[tier]['name'] for tier in sorted(wanted, key=lambda t: config_tiers[t]['level']))
+    await ctx.reply(f'✅ You will be offered new tickets for: {names}')
+
+@bot.hybrid_command(name='away')
+async def away_command(ctx):
+    """Stop receiving ticket offers"""
+    if available_mms.get(ctx.guild.id, {}).pop(ctx.author.id, None) is None:
+        return await ctx.reply('❌ You are not marked as available.')
+    await ctx.reply('✅ You will no longer be offered tickets.')
+
+@bot.hybrid_command(name='queue')
+async def queue_command(ctx):
+    """Show unclaimed tickets waiting for a middleman and time-to-claim"""
+    if not is_mm_or_admin(ctx.author, ctx.guild):
+        return await ctx.reply('❌ You do not have permission to use this command!')
+    
+    config_tiers = get_guild_config(ctx.guild.id)['mm_tiers']
+    now = datetime.utcnow()
+    lines = []
+    for _, created, channel_id in sorted(dispatch_queue.get(ctx.guild.id, [])):
+        ticket = ticket_registry.get(channel_id)
+        if not ticket or ticket.get('claimed_by'):
+            continue
+        offer = dispatch_offers.get(channel_id)
+        status = f"offered to <@{offer['mm_id']}>" if offer else 'waiting'
+        lines.append(f"<#{channel_id}> • {config_tiers.get(ticket['tier'], {}).get('name', ticket['tier'])} • "
+                     f"{format_duration((now - created).total_seconds())} old • {status}")
+    
+    embed = discord.Embed(
+        title='📨 Dispatch Queue',
+        description='\n'.join(lines[:20]) if lines else 'No tickets waiting.',
+        color=MM_COLOR
+    )
+    metrics = dispatch_metrics()
+    for tier in sorted(config_tiers, key=lambda t: -config_tiers[t]['level']):
+        available = len(available_for_tier(ctx.guild.id, tier))
+        tier_metrics = metrics.get(tier, {})
+        p50 = tier_metrics.get('claim_p50_seconds')
+        p95 = tier_metrics.get('claim_p95_seconds')
+        embed.add_field(
+            name=config_tiers[tier]['name'],
+            value=f'**Available:** {available}\n'
+                  f"**Time to claim:** {format_duration(p50) if p50 is not None else '-'} p50 / "
+                  f"{format_duration(p95) if p95 is not None else '-'} p95",
+            inline=True
+        )
+    await ctx.reply(embed=embed)
+
+# Reconcile Command
+@bot.hybrid_command(name='reconcile')
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def reconcile_command(ctx):
+    """Repair orphaned ticket rows and channels now"""
+    msg = await ctx.reply('🔧 Reconciling tickets...')
+    report = await reconcile_tickets()
+    await msg.edit(content=f'✅ Reconcile complete: {format_reconcile_report(report)}')
+
+# DB Check Command
+@bot.hybrid_command(name='dbcheck')
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def dbcheck_command(ctx):
+    """Check that hot queries still use their indexes"""
+    await ctx.defer()
+    report = await asyncio.to_thread(check_query_plans)
+    failing = [entry for entry in report if entry['problems']]
+    
+    embed = discord.Embed(
+        title='🗄️ Query Plan Check',
+        description=f'✅ All {len(report)} hot queries use their indexes' if not failing else f'❌ {len(failing)} of {len(report)} queries need attention',
+        color=0x57F287 if not failing else 0xED4245
+    )
+    for entry in report:
+        status = '✅' if not entry['problems'] else '❌ ' + ', '.join(entry['problems'])
+        embed.add_field(name=f"{entry['query']} {status}", value=f"`{entry['plan']}`", inline=False)
+    await ctx.reply(embed=embed)
+
+# Health Command
+@bot.hybrid_command(name='health')
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def health_command(ctx):
+    """Show every cluster's heartbeat and shard latencies"""
+    await ctx.defer()
+    clusters = await asyncio.to_thread(get_cluster_health_db)
+    if not clusters:
+        return await ctx.reply('❌ No heartbeats recorded yet!')
+    
+    embed = discord.Embed(title='🩺 Cluster Health', color=MM_COLOR)
+    for cluster in clusters:
+        latencies = ', '.join(
+            f"#{shard_id}: {f'{ms:.0f}ms' if ms is not None else '—'}"
+            for shard_id, ms in sorted(cluster['latencies'].items(), key=lambda item: int(item[0]))
+        )
+        value = f"**Guilds:** {cluster['guilds']}\n**Last seen:** {cluster['age_seconds']:.0f}s ago\n**Shards:** {latencies}"
+        members = (cluster.get('metrics') or {}).get('members')
+        if members:
+            fetch = f", fetch p95 {members['fetch_p95_ms']}ms" if members['fetch_p95_ms'] is not None else ''
+            resolve = f", resolve p95 {members['resolve_p95_ms']}ms" if members.get('resolve_p95_ms') is not None else ''
+            hits = f", {members['hit_rate']:.0%} hits" if members['hit_rate'] is not None else ''
+            value += f"\n**Members:** {members['cached_members']:,} cached ({members['mode']}{hits}{resolve}{fetch}), {members['rss_mb']:.0f} MB RSS"
+        embed.add_field(
+            name=f"{'🟢' if cluster['healthy'] else '🔴'} Cluster {cluster['cluster_id']}",
+            value=value,
+            inline=False
+        )
+    await ctx.reply(embed=embed)
+
+# Profile Commands
+@bot.hybrid_command(name='profile')
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def profile_command(ctx, seconds: int = PROFILE_DEFAULT_SECONDS):
+    """Sample the event loop for a while and reply with collapsed stacks for a flamegraph"""
+    global _profiler
+    if _profiler is not None:
+        return await ctx.reply('❌ A profile is already running!')
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    
+    sampler = _profiler = StackSampler(get_ident())
+    started = datetime.utcnow()
+    msg = await ctx.reply(f'🔬 Profiling the event loop for {seconds}s...')
+    try:
+        await asyncio.to_thread(sampler.run, seconds)
+        path = await asyncio.to_thread(save_profile, sampler, started)
+    finally:
+        _profiler = None
+    
+    busy = (sampler.samples - sampler.idle) / sampler.samples * 100 if sampler.samples else 0.0
+    embed = discord.Embed(
+        title='🔬 Event Loop Profile',
+        description=f'**Samples:** {sampler.samples:,} over {seconds}s\n**Loop busy:** {busy:.1f}%\n**Saved to:** `{path}`',
+        color=MM_COLOR
+    )
+    hottest = sampler.hottest()
+    if hottest:
+        embed.add_field(
+            name='🔥 Hottest Functions',
+            value='\n'.join(f'`{leaf[:80]}` — {count / sampler.samples * 100:.1f}%' for leaf, count in hottest),
+            inline=False
+        )
+    stalls = [stall for stall in lag_monitor.slow if stall['at'] >= started]
+    if stalls:
+        embed.add_field(
+            name='🐢 Slow Callbacks',
+            value='\n'.join(f"{stall['lag_ms']:.0f}ms" + (f" in `{stall['stack'].rsplit(';', 1)[-1][:80]}`" if stall['stack'] else '')
+                            for stall in stalls[-5:]),
+            inline=False
+        )
+    embed.set_footer(text='Render with flamegraph.pl or drop the file on speedscope.app')
+    await msg.edit(content=None, embed=embed)
+    await ctx.send(file=discord.File(io.BytesIO(sampler.collapsed().encode()), filename=os.path.basename(path)))
+
+@bot.hybrid_command(name='looplag')
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def looplag_command(ctx):
+    """Show the most recent event loop stalls and what was running"""
+    if not lag_monitor.slow:
+        return await ctx.reply(f'✅ No event loop stalls over {LOOP_LAG_THRESHOLD_MS:.0f}ms recorded!')
+    embed = discord.Embed(
+        title='🐢 Event Loop Stalls',
+        description=f'**Recorded:** {lag_monitor.stalls}\n**Worst:** {lag_monitor.worst_ms:.0f}ms\n**Threshold:** {LOOP_LAG_THRESHOLD_MS:.0f}ms',
+        color=MM_COLOR
+    )
+    for stall in list(lag_monitor.slow)[-10:][::-1]:
+        frames = stall['stack'].split(';')[-3:] if stall['stack'] else ['(stack not captured)']
+        embed.add_field(
+            name=f"{stall['lag_ms']:.0f}ms at {stall['at']:%H:%M:%S} UTC",
+            value='\n'.join(f'`{frame[:90]}`' for frame in frames),
+            inline=False
+        )
+    await ctx.reply(embed=embed)
+
+# Config Command
+CONFIG_SETTINGS = {
+    'proof_channel': 'proof_channel_id',
+    'staff_role': 'staff_role_id',
+    'ticket_category': 'ticket_category',
+    'support_category': 'support_category',
+    'inactivity_hours': 'inactivity_hours'
+}
+TIER_FIELDS = ('name', 'range', 'emoji', 'level', 'reping_after', 'escalate_after')
+TIER_INT_FIELDS = ('level', 'reping_after', 'escalate_after')
+
+def parse_snowflake(value):
+    """Turn a mention or raw ID into an int"""
+    return int(value.strip('<@&#!>'))
+
+@bot.hybrid_command(name='config')
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def config_command(ctx, setting: str = None, *, value: str = None):
+    """
+    View or change this server's configuration
+    Usage: $config
+           $config proof_channel #channel
+           $config staff_role @role
+           $config ticket_category <name>
+           $config support_category <name>
+           $config inactivity_hours <hours>   (0 = never auto-close)
+           $config mmrole <tier> @role
+           $config tier <tier> <name|range|emoji|level> <value>
+           $config tier <tier> <reping_after|escalate_after> <minutes>
+    """
+    config = get_guild_config(ctx.guild.id)
+    args = value.split() if value else []
+    
+    if setting is None:
+        embed = discord.Embed(title='⚙️ Server Configuration', color=MM_COLOR)
+        embed.add_field(name='Proof Channel', value=f"<#{config['proof_channel_id']}>", inline=True)
+        embed.add_field(name='Staff Role', value=f"<@&{config['staff_role_id']}>", inline=True)
+        embed.add_field(name='Categories', value=f"{config['ticket_category']} / {config['support_category']}", inline=False)
+        embed.add_field(name='Auto-close', value=f"After {config['inactivity_hours']:g}h idle" if config['inactivity_hours'] else 'Off', inline=False)
+        for tier_key, tier in config['mm_tiers'].items():
+            role_id = config['mm_role_ids'].get(tier_key)
+            embed.add_field(
+                name=f"{tier['emoji']} {tier_key} (level {tier['level']})",
+                value=f"{tier['name']}\nRole: {f'<@&{role_id}>' if role_id else 'None'}",
+                inline=True
+            )
+        return await ctx.reply(embed=embed)
+    
+    setting = setting.lower()
+    try:
+        if setting in CONFIG_SETTINGS and args:
+            key = CONFIG_SETTINGS[setting]
+            if key.endswith('_id'):
+                value = parse_snowflake(args[0])
+            elif key == 'inactivity_hours':
+                value = max(0.0, float(args[0]))
+            else:
+                value = ' '.join(args)
+        elif setting == 'mmrole' and len(args) == 2:
+            tier_key = args[0].lower()
+            if tier_key not in config['mm_tiers']:
+                return await ctx.reply(f'❌ Unknown tier: {tier_key}')
+            key = 'mm_role_ids'
+            value = dict(config['mm_role_ids'])
+            value[tier_key] = parse_snowflake(args[1])
+        elif setting == 'tier' and len(args) >= 3 and args[1].lower() in TIER_FIELDS:
+            tier_key, field = args[0].lower(), args[1].lower()
+            key = 'mm_tiers'
+            value = copy.deepcopy(config['mm_tiers'])
+            tier = value.setdefault(tier_key, {'name': tier_key, 'range': '', 'emoji': '⚖️', 'level': len(value) + 1})
+            tier[field] = int(args[2]) if field in TIER_INT_FIELDS else ' '.join(args[2:])
+        else:
+            return await ctx.reply('❌ Invalid setting! Use `$config` to see the current configuration.')
+    except ValueError:
+        return await ctx.reply('❌ Invalid value!')
+    
+    await asyncio.to_thread(set_guild_config_db, ctx.guild.id, key, value)
+    await asyncio.to_thread(load_guild_configs, ctx.guild.id)  # Other processes reload via NOTIFY
+    await ctx.reply(f'✅ Updated `{setting}` for this server.')
+
 # Help Command
-@bot.command(name='help')
-async def help_command(ctx):
-    """Show all available commands"""
+def help_embed():
+    """The $help embed"""
     embed = discord.Embed(
         title='📋 Bot Commands',
         description='Here are all available commands:',
@@ -1054,14 +3743,25 @@ async def help_command(ctx):
               '`$close` - Close a ticket\n'
               '`$add @user` - Add user to ticket\n'
               '`$remove @user` - Remove user from ticket\n'
-              '`$proof` - Send proof to proof channel',
+              '`$proof` - Send proof to proof channel\n'
+              '`$search <words>` - Search past and open trades\n'
+              '`$available [tiers]` / `$away` - Opt in/out of ticket offers\n'
+              '`$queue` - Show tickets waiting for a middleman\n'
+              '`$reconcile` - Repair orphaned tickets (Admin only)\n'
+              '`$config` - View or change server settings (Admin only)\n'
+              '`$health` - Show cluster health (Admin only)\n'
+              '`$dbcheck` - Check query plans (Admin only)\n'
+              '`$profile [seconds]` - Profile the event loop (Admin only)\n'
+              '`$looplag` - Show recent event loop stalls (Admin only)\n'
+              '`$synccommands` - Push slash commands to Discord (Admin only)',
         inline=False
     )
     
     embed.add_field(
         name='📊 Statistics Commands',
         value='`$mmstats [@user]` - View MM statistics\n'
-              '`$mmleaderboard` - View top middlemen',
+              '`$mmleaderboard` - View top middlemen\n'
+              '`$ticketstats [@user] [days]` - Time to claim/close per tier',
         inline=False
     )
     
@@ -1076,12 +3776,18 @@ async def help_command(ctx):
         inline=False
     )
     
-    embed.set_footer(text='Use $help to see this message again')
-    
-    await ctx.reply(embed=embed)
+    embed.set_footer(text='Every command also works as a slash command - try /help')
+    return embed
+
+HELP_EMBED = help_embed()  # Static: built once, every $help sends this same embed (never mutate it)
+
+@bot.hybrid_command(name='help')
+async def help_command(ctx):
+    """Show all available commands"""
+    await ctx.reply(embed=HELP_EMBED)
 
 # mm stats cmd
-@bot.command(name='mmstats')
+@bot.hybrid_command(name='mmstats')
 async def mmstats_command(ctx, member: discord.Member = None):
     """View MM statistics for a user"""
     target = member if member else ctx.author
@@ -1118,42 +3824,143 @@ async def mmstats_command(ctx, member: discord.Member = None):
     
     await ctx.reply(embed=embed)
 
-# mm lb cmd
-@bot.command(name='mmleaderboard')
-async def mmleaderboard_command(ctx):
-    """View top middlemen leaderboard"""
-    
-    # GET FROM DATABASE (not mm_stats dictionary)
-    sorted_stats = get_mm_leaderboard_db(10)
+# ticket stats cmd
+@bot.hybrid_command(name='ticketstats')
+async def ticketstats_command(ctx, member: discord.Member = None, days: int = 30):
+    """Average time-to-claim and time-to-close per tier (optionally for one MM)"""
+    if not is_mm_or_admin(ctx.author, ctx.guild):
+        return await ctx.reply('❌ You do not have permission to use this command!')
     
-    if not sorted_stats:
-        return await ctx.reply('❌ No middleman statistics available yet!')
+    # READ FROM THE ROLLUPS (never the raw event log)
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    await ctx.defer()
+    rows = await asyncio.to_thread(get_ticket_rollups_db, ctx.guild.id, since, member.id if member else None)
     
     embed = discord.Embed(
-        title='🏆 Middleman Leaderboard',
-        description='Top middlemen by completed tickets',
+        title='⏱️ Ticket Response Times',
+        description=f"Last {days} days{f' for {member.mention}' if member else ''}",
         color=MM_COLOR
     )
+    tiers = get_guild_config(ctx.guild.id)['mm_tiers']
+    for row in rows:
+        claim = format_duration(row['claim_seconds'] / row['claims']) if row['claims'] else '-'
+        close = format_duration(row['close_seconds'] / row['closes']) if row['closes'] else '-'
+        embed.add_field(
+            name=tiers[row['tier']]['name'] if row['tier'] in tiers else row['tier'].title(),
+            value=f"**Time to claim:** {claim} ({row['claims']} claims)\n**Time to close:** {close} ({row['closes']} closed)",
+            inline=False
+        )
+    if not rows:
+        embed.description += '\n\nNo claimed or closed tickets in this period.'
+    
+    await ctx.reply(embed=embed)
+
+# mm lb cmd
+async def leaderboard_page(guild, after=None):
+    """Next page of (member, tickets_completed) after a keyset cursor, skipping MMs who left.
     
-    leaderboard_text = []
-    for i, entry in enumerate(sorted_stats, 1):
-        member = ctx.guild.get_member(entry['user_id'])
-        if member:
-            medal = '🥇' if i == 1 else '🥈' if i == 2 else '🥉' if i == 3 else f'{i}.'
-            leaderboard_text.append(f'{medal} {member.mention} - **{entry["tickets_completed"]}** tickets')
+    Rows are read LEADERBOARD_FETCH at a time and each chunk is resolved in one batch, until
+    one entry more than a page is found (that extra entry only says whether a next page exists)
+    or LEADERBOARD_MAX_SCAN rows were read - then the page is short and the next one carries on
+    from the last row read. Returns (entries, has_more, cursor the following page starts after).
+    """
+    entries = []
+    scanned = 0
+    exhausted = False
+    while len(entries) <= LEADERBOARD_PAGE_SIZE and scanned < LEADERBOARD_MAX_SCAN:
+        rows = await asyncio.to_thread(get_mm_leaderboard_db, min(LEADERBOARD_FETCH, LEADERBOARD_MAX_SCAN - scanned), after)
+        scanned += len(rows)
+        members = await resolve_members(guild, [row['user_id'] for row in rows])
+        for row in rows:
+            if row['user_id'] in members:
+                entries.append((members[row['user_id']], row['tickets_completed'], (row['tickets_completed'], row['user_id'])))
+        if rows:
+            after = (rows[-1]['tickets_completed'], rows[-1]['user_id'])
+        if len(rows) < LEADERBOARD_FETCH:
+            exhausted = len(rows) == 0 or scanned < LEADERBOARD_MAX_SCAN
+            break
     
-    if leaderboard_text:
-        embed.description = '\n'.join(leaderboard_text)
-    else:
-        embed.description = 'No data available'
+    page = entries[:LEADERBOARD_PAGE_SIZE]
+    if len(entries) > LEADERBOARD_PAGE_SIZE:
+        return [(member, completed) for member, completed, _ in page], True, page[-1][2]
+    return [(member, completed) for member, completed, _ in page], not exhausted, after
+
+class LeaderboardView(BotView):
+    """Pages through the MM leaderboard with keyset pagination"""
+    def __init__(self, author, total, entries, has_more, cursor):
+        super().__init__(timeout=300)
+        self.author = author
+        self.total = total
+        self.pages = [(entries, has_more, cursor)]  # Every page rendered so far, so going back never re-resolves
+        self.page = 0
+        self.loading = False  # A new page is being fetched (ignore further Next clicks until it lands)
+        self.show()
     
-    all_stats = get_mm_leaderboard_db(1000)
-    embed.set_footer(text=f'Total Middlemen: {len(all_stats)}')
+    def show(self):
+        self.entries, self.has_more, _ = self.pages[self.page]
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = not self.has_more
     
-    await ctx.reply(embed=embed)
+    def embed(self):
+        lines = []
+        first = 1 + sum(len(entries) for entries, _, _ in self.pages[:self.page])  # Pages cut short by the scan cap hold fewer
+        for rank, (member, completed) in enumerate(self.entries, first):
+            medal = '🥇' if rank == 1 else '🥈' if rank == 2 else '🥉' if rank == 3 else f'{rank}.'
+            lines.append(f'{medal} {member.mention} - **{completed}** tickets')
+        embed = discord.Embed(
+            title='🏆 Middleman Leaderboard',
+            description='\n'.join(lines) or ('No current members in this stretch - press Next to keep looking' if self.has_more else 'No data available'),
+            color=MM_COLOR
+        )
+        embed.set_footer(text=f'Page {self.page + 1} • Total Middlemen: {self.total}')
+        return embed
+    
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author.id:
+            await interaction.response.send_message('❌ Only the person who opened the leaderboard can page through it.', ephemeral=True)
+            return False
+        return await super().interaction_check(interaction)
+    
+    @discord.ui.button(label='Previous', emoji='◀️', style=discord.ButtonStyle.secondary)
+    async def previous_button(self, interaction: discord.Interaction, button: Button):
+        self.page -= 1
+        self.show()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+    
+    @discord.ui.button(label='Next', emoji='▶️', style=discord.ButtonStyle.secondary)
+    async def next_button(self, interaction: discord.Interaction, button: Button):
+        if self.page + 1 == len(self.pages):
+            await interaction.response.defer()  # Filling a page can take several fetches
+            if self.loading:
+                return
+            self.loading = True
+            try:
+                self.pages.append(await leaderboard_page(interaction.guild, self.pages[self.page][2]))
+            finally:
+                self.loading = False
+            self.page += 1
+            self.show()
+            return await interaction.edit_original_response(embed=self.embed(), view=self)
+        self.page += 1
+        self.show()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+@bot.hybrid_command(name='mmleaderboard')
+async def mmleaderboard_command(ctx):
+    """View top middlemen leaderboard"""
+    
+    # GET FROM DATABASE (not mm_stats dictionary)
+    await ctx.defer()
+    entries, has_more, cursor = await leaderboard_page(ctx.guild)
+    if not entries:
+        return await ctx.reply('❌ No middleman statistics available yet!')
+    
+    total = await asyncio.to_thread(count_mm_stats_db)
+    view = LeaderboardView(ctx.author, total, entries, has_more, cursor)
+    await ctx.reply(embed=view.embed(), view=view)
 
 # Simple Coinflip Command
-@bot.command(name='coinflip')
+@bot.hybrid_command(name='coinflip')
 async def simple_coinflip(ctx):
     """Flip a single coin"""
     
@@ -1165,7 +3972,7 @@ async def simple_coinflip(ctx):
     )
     
     msg = await ctx.reply(embed=embed)
-    await asyncio.sleep(1.5)
+    await drain_sleep(1.5)
     
     # Get result
     result = 'Heads' if secrets.randbelow(2) == 0 else 'Tails'
@@ -1203,21 +4010,21 @@ async def coinflip(ctx, user1_input: str = None, vs: str = None, user2_input: st
     if user1_input.startswith('<@'):
         try:
             user_id = int(user1_input.strip('<@!>'))
-            user1 = ctx.guild.get_member(user_id)
+            user1 = await resolve_member(ctx.guild, user_id)
         except:
             pass
     else:
-        user1 = discord.utils.find(lambda m: m.name.lower() == user1_input.lower() or (m.nick and m.nick.lower() == user1_input.lower()), ctx.guild.members)
+        user1 = await find_member_by_name(ctx.guild, user1_input)
     
     # Try to find user2
     if user2_input.startswith('<@'):
         try:
             user_id = int(user2_input.strip('<@!>'))
-            user2 = ctx.guild.get_member(user_id)
+            user2 = await resolve_member(ctx.guild, user_id)
         except:
             pass
     else:
-        user2 = discord.utils.find(lambda m: m.name.lower() == user2_input.lower() or (m.nick and m.nick.lower() == user2_input.lower()), ctx.guild.members)
+        user2 = await find_member_by_name(ctx.guild, user2_input)
     
     if not user1:
         return await ctx.reply(f'❌ Could not find user: {user1_input}')
@@ -1243,26 +4050,108 @@ async def coinflip(ctx, user1_input: str = None, vs: str = None, user2_input: st
     if total_rounds < 1 or total_rounds > 200:
         return await ctx.reply('❌ Number of rounds must be between 1 and 200!')
     
-    # Create initial embed
+    await ctx.send(embed=coinflip_challenge_embed(user1, user2, total_rounds, is_first_to),
+                   view=CoinflipView(user1, user2, total_rounds, is_first_to))
+
+def coinflip_challenge_embed(user1, user2, total_rounds, is_first_to):
+    """The "Choose Your Side" embed a coinflip game opens with (and shows while sides are picked)"""
     mode_text = f"First to {total_rounds}" if is_first_to else f"Best of {total_rounds}"
-    
-    embed = discord.Embed(
+    return discord.Embed(
         title='🪙 Choose Your Side',
         description=f'**{user1.mention}** vs **{user2.mention}**\n\n**Mode:** {mode_text}\n\n**Select your side below:**',
         color=MM_COLOR
     )
-    
-    
-    view = CoinflipView(user1, user2, total_rounds, is_first_to)
-    await ctx.send(embed=embed, view=view)
+
+# Slash Commands
+# Every command above is a hybrid command: the same function answers $name (while
+# PREFIX_COMMANDS is on) and /name. $cf keeps its hand-written parser for prefix use;
+# /cf gets typed options instead. Pushing the tree to Discord is rate limited, so it
+# only happens when the tree's hash differs from the one recorded at the last sync.
+@bot.tree.command(name='cf', description='Coinflip between two users')
+@app_commands.describe(user1='First player', user2='Second player', rounds='Number of rounds (1-200)',
+                       mode='First to <rounds> wins, or best of <rounds>')
+@app_commands.choices(mode=[app_commands.Choice(name='Best of', value='bo'), app_commands.Choice(name='First to', value='ft')])
+async def cf_slash(interaction: discord.Interaction, user1: discord.Member, user2: discord.Member,
+                   rounds: app_commands.Range[int, 1, 200] = 1, mode: str = 'bo'):
+    if shutting_down():
+        return await interaction.response.send_message('⏳ Bot is restarting, please try again in a moment.', ephemeral=True)
+    is_first_to = mode == 'ft'
+    await interaction.response.send_message(embed=coinflip_challenge_embed(user1, user2, rounds, is_first_to),
+                                            view=CoinflipView(user1, user2, rounds, is_first_to))
+
+@bot.hybrid_command(name='synccommands')
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def synccommands_command(ctx):
+    """Push the slash commands to Discord now, even if unchanged"""
+    await ctx.defer()
+    if not await sync_app_commands(force=True):
+        return await ctx.reply(f'❌ Only cluster 0 syncs commands (this is cluster {CLUSTER_ID}).')
+    await ctx.reply('✅ Slash commands synced. Discord may take a minute to show changes.')
+
+for app_command in bot.tree.get_commands():
+    app_command.guild_only = True  # Every command works on a guild's tickets and config
+
+def app_command_hash():
+    """Stable hash of the command tree as it would be sent to Discord"""
+    payload = []
+    for command in bot.tree.get_commands():
+        try:
+            payload.append(command.to_dict(bot.tree))
+        except TypeError:  # discord.py < 2.4
+            payload.append(command.to_dict())
+    payload.sort(key=lambda command: command['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+async def sync_app_commands(force=False):
+    """Push the command tree to Discord if it changed since the last sync; returns whether it synced"""
+    if CLUSTER_ID != 0:
+        return False  # Global commands belong to the application - one process is enough
+    command_hash = app_command_hash()
+    if not force and await asyncio.to_thread(get_app_command_hash_db, bot.application_id) == command_hash:
+        log.info('Slash commands unchanged', extra={'event': 'app_commands_current', 'hash': command_hash[:12]})
+        return False
+    synced = await bot.tree.sync()
+    await asyncio.to_thread(set_app_command_hash_db, bot.application_id, command_hash)
+    log.info('Synced slash commands', extra={'event': 'app_commands_synced', 'commands': len(synced), 'hash': command_hash[:12]})
+    return True
 
 # Helper Functions
+def mm_welcome_embed(tier, user, trader, giving, receiving, tip, ticket_number):
+    """The embed a new MM ticket opens with (`tier` is the tier's config entry)"""
+    embed = discord.Embed(
+        title=f"{tier['emoji']} {tier['name']}",
+        description=f"Welcome {user.mention}!\n\nOur team will be with you shortly.",
+        color=MM_COLOR
+    )
+    embed.add_field(name="💥 Trading With", value=trader, inline=False)
+    embed.add_field(name="📤 You're Giving", value=giving, inline=True)
+    embed.add_field(name="📥 You're Receiving", value=receiving, inline=True)
+    embed.add_field(name="💰 Tip", value=tip if tip else "None", inline=True)
+    embed.set_footer(text=f'Ticket #{ticket_number}')
+    return embed
+
+def support_welcome_embed(user, reason, details, ticket_number):
+    """The embed a new support ticket opens with"""
+    embed = discord.Embed(
+        title='🎫 Support Ticket',
+        description=f"Welcome {user.mention}!\n\nOur staff team will be with you shortly.",
+        color=MM_COLOR
+    )
+    embed.add_field(name="📋 Reason", value=reason, inline=False)
+    embed.add_field(name="📝 Details", value=details, inline=False)
+    embed.set_footer(text=f'Ticket #{ticket_number} • created by {user.name}', icon_url=user.display_avatar.url)
+    embed.timestamp = datetime.utcnow()
+    return embed
+
 async def create_ticket_with_details(guild, user, tier, trader, giving, receiving, tip):
     """Create MM ticket with tier-based permissions"""
     try:
-        category = discord.utils.get(guild.categories, name=TICKET_CATEGORY)
+        config = get_guild_config(guild.id)
+        tiers = config['mm_tiers']
+        category = discord.utils.get(guild.categories, name=config['ticket_category'])
         if not category:
-            category = await guild.create_category(TICKET_CATEGORY, position=len(guild.categories))
+            category = await guild.create_category(config['ticket_category'], position=len(guild.categories))
         
         overwrites = {
             guild.default_role: discord.PermissionOverwrite(view_channel=False),
@@ -1279,79 +4168,73 @@ async def create_ticket_with_details(guild, user, tier, trader, giving, receivin
             )
         }
         
-        ticket_level = MM_TIERS[tier]['level']
-        
         # Collect roles to ping
         roles_to_ping = []
         
-        for tier_key, role_id in MM_ROLE_IDS.items():
+        for role_id in get_permission_matrix(guild.id).tier_roles[tier]:
             role = guild.get_role(role_id)
             if role:
-                tier_lvl = MM_TIERS[tier_key]['level']
-                if tier_key == 'og' or tier_lvl >= ticket_level:
-                    overwrites[role] = discord.PermissionOverwrite(
-                        view_channel=True,
-                        send_messages=True,
-                        read_message_history=True,
-                        manage_messages=True
-                    )
-                    roles_to_ping.append(role)
+                overwrites[role] = discord.PermissionOverwrite(
+                    view_channel=True,
+                    send_messages=True,
+                    read_message_history=True,
+                    manage_messages=True
+                )
+                roles_to_ping.append(role)
         
+        ticket_number = await next_ticket_number()
         ticket_channel = await guild.create_text_channel(
-            name=f'ticket-{user.name}-mm',
+            name=f'ticket-{ticket_number}-mm',
             category=category,
             overwrites=overwrites
         )
         
-        # SAVE TO DATABASE (instead of active_tickets dictionary)
-        save_ticket(
+        # SAVE TO DATABASE and register it
+        ticket = register_ticket(save_ticket(
             ticket_channel.id,
             user.id,
             'mm',
+            ticket_number=ticket_number,
+            guild_id=guild.id,
             tier=tier,
             trader=trader,
             giving=giving,
             receiving=receiving,
             tip=tip
-        )
+        ))
+        record_event('created', ticket, actor_id=user.id)
+        routed = enqueue_ticket(guild, ticket)
+        schedule_sla(ticket)
         
-        # PING ROLES + USER (NO GHOST PING - just normal ping)
-        if roles_to_ping:
+        # PING ROLES + USER (NO GHOST PING - just normal ping) - unless the dispatcher
+        # has someone available, in which case it offers the ticket to them directly
+        if roles_to_ping and not routed:
             ping_mentions = ' '.join([role.mention for role in roles_to_ping]) + f' {user.mention}'
             await ticket_channel.send(ping_mentions)
         else:
             await ticket_channel.send(user.mention)
         
         # Send ticket embed
-        embed = discord.Embed(
-            title=f"{MM_TIERS[tier]['emoji']} {MM_TIERS[tier]['name']}",
-            description=f"Welcome {user.mention}!\n\nOur team will be with you shortly.",
-            color=MM_COLOR
-        )
-        
-        embed.add_field(name="💥 Trading With", value=trader, inline=False)
-        embed.add_field(name="📤 You're Giving", value=giving, inline=True)
-        embed.add_field(name="📥 You're Receiving", value=receiving, inline=True)
-        embed.add_field(name="💰 Tip", value=tip if tip else "None", inline=True)
-        
+        embed = mm_welcome_embed(tiers[tier], user, trader, giving, receiving, tip, ticket_number)
         await ticket_channel.send(embed=embed, view=MMTicketView())
         
         # RETURN THE CHANNEL (so we can send link to user)
         return ticket_channel
         
-    except Exception as e:
-        print(f'[ERROR] MM Ticket creation failed: {e}')
+    except Exception:
+        log.exception('MM ticket creation failed', extra=log_fields(guild, user=user, event='ticket_create_failed', ticket_type='mm', tier=tier))
         raise
         
 async def create_support_ticket(guild, user, reason, details):
     """Create a support ticket with staff ping"""
     try:
-        category = discord.utils.get(guild.categories, name=SUPPORT_CATEGORY)
+        config = get_guild_config(guild.id)
+        category = discord.utils.get(guild.categories, name=config['support_category'])
         if not category:
-            category = await guild.create_category(SUPPORT_CATEGORY)
+            category = await guild.create_category(config['support_category'])
         
         # Get staff role
-        staff_role = guild.get_role(STAFF_ROLE_ID)
+        staff_role = guild.get_role(config['staff_role_id'])
         
         # Base overwrites
         overwrites = {
@@ -1379,20 +4262,24 @@ async def create_support_ticket(guild, user, reason, details):
             )
         
         # Create ticket channel
+        ticket_number = await next_ticket_number()
         ticket_channel = await guild.create_text_channel(
-            name=f'ticket-{user.name}-support',
+            name=f'ticket-{ticket_number}-support',
             category=category,
             overwrites=overwrites
         )
         
-        # ✅ SAVE TO DATABASE (instead of active_tickets dictionary)
-        save_ticket(
+        # ✅ SAVE TO DATABASE and register it
+        ticket = register_ticket(save_ticket(
             ticket_channel.id,
             user.id,
             'support',
+            ticket_number=ticket_number,
+            guild_id=guild.id,
             reason=reason,
             details=details
-        )
+        ))
+        record_event('created', ticket, actor_id=user.id)
         
         # Ping user and staff
         if staff_role:
@@ -1401,59 +4288,60 @@ async def create_support_ticket(guild, user, reason, details):
             await ticket_channel.send(user.mention)
         
         # Send ticket embed
-        embed = discord.Embed(
-            title='🎫 Support Ticket',
-            description=f"Welcome {user.mention}!\n\nOur staff team will be with you shortly.",
-            color=MM_COLOR
-        )
-        
-        embed.add_field(
-            name="📋 Reason",
-            value=reason,
-            inline=False
-        )
-        
-        embed.add_field(
-            name="📝 Details",
-            value=details,
-            inline=False
-        )
-        
-        embed.set_footer(
-            text=f'Ticket created by {user.name}',
-            icon_url=user.display_avatar.url
-        )
-        embed.timestamp = datetime.utcnow()
-        
+        embed = support_welcome_embed(user, reason, details, ticket_number)
         await ticket_channel.send(embed=embed, view=SupportTicketView())
         
-    except Exception as e:
-        print(f'[ERROR] Support Ticket creation failed: {e}')
+    except Exception:
+        log.exception('Support ticket creation failed', extra=log_fields(guild, user=user, event='ticket_create_failed', ticket_type='support'))
         raise
 
-async def close_ticket(channel, user):
+@track_work('deletions')
+async def close_ticket(channel, user, reason=None):
     """Close ticket"""
     embed = discord.Embed(
         title='🔒 Ticket Closed',
-        description=f'Ticket closed by {user.mention}',
+        description=f'Ticket closed by {user.mention}' + (f'\n**Reason:** {reason}' if reason else ''),
         color=0xED4245
     )
     embed.timestamp = datetime.utcnow()
 
     await channel.send(embed=embed)
 
-    # DELETE FROM DATABASE (not dictionaries)
-    delete_ticket_db(channel.id)
+    # MOVE TO TICKET HISTORY (keeps the live tickets table small)
+    closed = await asyncio.to_thread(delete_ticket_db, channel.id, user.id)
+    forget_ticket(channel.id)
+    cancel_sla(channel.id)
+    last_activity.pop(channel.id, None)
+    _activity_dirty.discard(channel.id)
+    if closed:
+        record_event('closed', closed, actor_id=user.id, target_id=closed['claimed_by'], seconds=closed['open_seconds'])
 
-    await asyncio.sleep(5)
-    await channel.delete()
+    await drain_sleep(CLOSE_DELETE_DELAY)
+    try:
+        await channel.delete()
+    except discord.NotFound:
+        pass  # Already removed (e.g. by the reconciler)
         
 # Run Bot
+async def main(token):
+    """Run until the gateway closes; SIGTERM/SIGINT trigger a graceful shutdown"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, sig.name)
+        except NotImplementedError:
+            pass  # Windows - Ctrl+C still stops the bot, just without draining
+    async with bot:
+        await bot.start(token)
+    await request_shutdown('gateway closed')  # Waits for the drain when a signal started it
+
 if __name__ == '__main__':
-    keep_alive()
+    setup_logging()
+    if not os.getenv('CLUSTER_WORKER'):
+        keep_alive()  # In cluster mode the launcher serves the web endpoints
     TOKEN = os.getenv('TOKEN')
     if not TOKEN:
-        print('❌ ERROR: No TOKEN found in environment variables!')
+        log.error('No TOKEN found in environment variables!', extra={'event': 'startup_error'})
     else:
-        print('🚀 Starting MM Bot...')
-        bot.run(TOKEN)
+        log.info('Starting MM Bot...', extra={'event': 'starting'})
+        asyncio.run(main(TOKEN))
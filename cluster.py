@@ -0,0 +1,147 @@
+"""
+Cluster launcher - runs the bot as several worker processes, each owning a range of shards.
+
+Usage: python cluster.py [--clusters N] [--shards N]
+
+Defaults to one cluster per CPU core and Discord's recommended shard count.
+Each worker is a normal `python bot.py` process started with SHARD_COUNT,
+SHARD_IDS, CLUSTER_ID and CLUSTER_COUNT set. The launcher serves the web
+endpoints (including /health for every cluster) and restarts workers that exit.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from threading import Thread
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+IDENTIFY_DELAY = 5.5     # Discord allows one IDENTIFY per 5 seconds
+RESTART_BACKOFF = 5      # Seconds before restarting a crashed worker (doubles up to the max)
+RESTART_BACKOFF_MAX = 300
+
+
+def fetch_recommended_shards(token):
+    """Ask Discord how many shards this bot should run"""
+    request = urllib.request.Request(
+        'https://discord.com/api/v10/gateway/bot',
+        headers={'Authorization': f'Bot {token}', 'User-Agent': 'DiscordBot (cluster.py, 1.0)'}
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)['shards']
+
+
+def shard_ranges(shard_count, cluster_count):
+    """Split shards 0..shard_count-1 into contiguous ranges, one per cluster"""
+    cluster_count = max(1, min(cluster_count, shard_count))
+    per_cluster, extra = divmod(shard_count, cluster_count)
+    ranges = []
+    start = 0
+    for cluster_id in range(cluster_count):
+        size = per_cluster + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+class Worker:
+    def __init__(self, cluster_id, cluster_count, shard_ids, shard_count):
+        self.cluster_id = cluster_id
+        self.cluster_count = cluster_count
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.backoff = RESTART_BACKOFF
+        self.restart_at = None
+        self.started_at = None
+
+    def start(self):
+        env = dict(os.environ)
+        env.update({
+            'CLUSTER_WORKER': '1',
+            'CLUSTER_ID': str(self.cluster_id),
+            'CLUSTER_COUNT': str(self.cluster_count),
+            'SHARD_COUNT': str(self.shard_count),
+            'SHARD_IDS': ','.join(str(shard_id) for shard_id in self.shard_ids)
+        })
+        self.process = subprocess.Popen([sys.executable, BOT_FILE], env=env)
+        self.restart_at = None
+        self.started_at = time.time()
+        print(f'🚀 Cluster {self.cluster_id} started (pid {self.process.pid}, shards {self.shard_ids})')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the bot as a multi-process shard cluster')
+    parser.add_argument('--clusters', type=int, default=os.cpu_count() or 1, help='Worker processes to run')
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SHARD_COUNT', '0')), help='Total shards (default: Discord recommended)')
+    args = parser.parse_args()
+
+    token = os.getenv('TOKEN')
+    if not token:
+        print('❌ ERROR: No TOKEN found in environment variables!')
+        return 1
+
+    shard_count = args.shards or fetch_recommended_shards(token)
+    ranges = shard_ranges(shard_count, args.clusters)
+    workers = [Worker(cluster_id, len(ranges), shard_ids, shard_count) for cluster_id, shard_ids in enumerate(ranges)]
+    print(f'🧩 Running {shard_count} shards across {len(workers)} clusters')
+
+    # Web endpoints (/ and /health) are served once here instead of by every worker
+    os.environ['CLUSTER_COUNT'] = str(len(workers))
+    from bot import run, setup_logging
+    setup_logging()
+    Thread(target=run, daemon=True).start()
+
+    stopping = False
+
+    def handle_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    # Stagger startups so every worker's shards can IDENTIFY without queueing
+    for worker in workers:
+        if stopping:
+            break
+        worker.start()
+        time.sleep(IDENTIFY_DELAY * len(worker.shard_ids))
+
+    while not stopping:
+        now = time.time()
+        for worker in workers:
+            code = worker.process.poll()
+            if code is None:
+                continue
+            if worker.restart_at is None:
+                if now - worker.started_at > RESTART_BACKOFF_MAX:
+                    worker.backoff = RESTART_BACKOFF  # It ran fine for a while, so start backing off afresh
+                print(f'⚠️ Cluster {worker.cluster_id} exited with code {code}, restarting in {worker.backoff}s')
+                worker.restart_at = now + worker.backoff
+                worker.backoff = min(worker.backoff * 2, RESTART_BACKOFF_MAX)
+            elif now >= worker.restart_at:
+                worker.start()
+        time.sleep(1)
+
+    print('🛑 Stopping clusters...')
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        if worker.process:
+            worker.process.wait()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Stream tickets, MM stats and ticket history out of Postgres for analytics.
+
+Usage: python export.py [--table tickets|mm_stats|history ...] [--format csv|parquet]
+                        [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--tier TIER ...]
+                        [--out DIR] [--batch N]
+
+Reads DATABASE_URL (point it at a replica if you have one). CSV goes through
+COPY ... TO STDOUT straight into the file; Parquet reads through a server-side
+cursor --batch rows at a time and writes one row group per batch (needs pyarrow).
+Either way memory stays flat however big the table is. Every table is read in
+one read-only REPEATABLE READ transaction, so the files are a consistent snapshot.
+
+--since/--until filter on created_at (tickets), closed_at (history, so only the
+matching monthly partitions are scanned) and last_updated (mm_stats). --tier
+applies to tickets and history.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import psycopg2
+from psycopg2 import sql
+
+# name -> (table, date column, has tier)
+TABLES = {
+    'tickets': ('tickets', 'created_at', True),
+    'mm_stats': ('mm_stats', 'last_updated', False),
+    'history': ('ticket_history', 'closed_at', True),
+}
+DEFAULT_BATCH = 10000
+
+# Postgres type OID -> pyarrow type name (anything else is written as a string)
+ARROW_TYPES = {
+    16: 'bool_',
+    20: 'int64',
+    21: 'int16',
+    23: 'int32',
+    700: 'float32',
+    701: 'float64',
+    1114: 'timestamp',
+    1184: 'timestamptz',
+    1700: 'decimal',
+}
+
+
+def build_query(name, args):
+    """SELECT for one table with the date range and tier filters applied"""
+    table, date_column, has_tier = TABLES[name]
+    conditions = []
+    params = []
+    if args.since:
+        conditions.append(sql.SQL('{} >= %s').format(sql.Identifier(date_column)))
+        params.append(args.since)
+    if args.until:
+        conditions.append(sql.SQL('{} < %s').format(sql.Identifier(date_column)))
+        params.append(args.until)
+    if args.tier and has_tier:
+        conditions.append(sql.SQL('tier = ANY(%s)'))
+        params.append(args.tier)
+
+    query = sql.SQL('SELECT * FROM {}').format(sql.Identifier(table))
+    if conditions:
+        query = sql.SQL('{} WHERE {}').format(query, sql.SQL(' AND ').join(conditions))
+    return query, params
+
+
+class CountingWriter:
+    """File wrapper that counts the bytes COPY writes through it"""
+    def __init__(self, f):
+        self.f = f
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.f.write(data)
+
+
+def export_csv(conn, name, args, path):
+    """COPY the table straight into a CSV file"""
+    query, params = build_query(name, args)
+    cur = conn.cursor()
+    copy = sql.SQL('COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)').format(query)
+    with open(path, 'wb') as f:
+        writer = CountingWriter(f)
+        cur.copy_expert(cur.mogrify(copy, params).decode(), writer)
+    rows = cur.rowcount if cur.rowcount >= 0 else None  # Older psycopg2 does not report COPY counts
+    cur.close()
+    return rows, writer.bytes
+
+
+def export_parquet(conn, name, args, path):
+    """Read through a server-side cursor and write one Parquet row group per batch"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit('❌ --format parquet needs pyarrow (pip install pyarrow)')
+
+    query, params = build_query(name, args)
+    cur = conn.cursor(name=f'export_{name}')  # Named = server-side; rows stay in Postgres until fetched
+    cur.itersize = args.batch
+    cur.execute(query, params)
+
+    batch = cur.fetchmany(args.batch)
+    fields = []
+    for column in cur.description:
+        arrow_type = ARROW_TYPES.get(column.type_code)
+        if arrow_type == 'timestamp':
+            fields.append(pa.field(column.name, pa.timestamp('us')))
+        elif arrow_type == 'timestamptz':
+            fields.append(pa.field(column.name, pa.timestamp('us', tz='UTC')))
+        elif arrow_type == 'decimal':
+            # NUMERIC(p, s) keeps its exact type; unconstrained NUMERIC has no fixed scale, so it is written as text
+            if column.precision is not None and column.scale is not None:
+                fields.append(pa.field(column.name, pa.decimal128(column.precision, column.scale)))
+            else:
+                fields.append(pa.field(column.name, pa.string()))
+        else:
+            fields.append(pa.field(column.name, getattr(pa, arrow_type)() if arrow_type else pa.string()))
+    schema = pa.schema(fields)
+    as_string = [i for i, field in enumerate(schema) if field.type == pa.string()]
+
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        while batch:
+            values = [list(column) for column in zip(*batch)]
+            for i in as_string:  # JSON is written as JSON text, other non-native scalars (Decimal...) as str()
+                values[i] = [
+                    v if v is None or isinstance(v, str)
+                    else json.dumps(v, default=str) if isinstance(v, (dict, list))
+                    else str(v)
+                    for v in values[i]
+                ]
+            writer.write_table(pa.Table.from_arrays(values, schema=schema))
+            rows += len(batch)
+            batch = cur.fetchmany(args.batch)
+    cur.close()
+    return rows, os.path.getsize(path)
+
+
+EXPORTERS = {
+    'csv': export_csv,
+    'parquet': export_parquet,
+}
+
+
+def format_rate(rows, size, elapsed):
+    elapsed = max(elapsed, 1e-6)
+    mb = size / 1e6
+    if rows is None:
+        return f'{mb:,.1f} MB in {elapsed:.1f}s ({mb / elapsed:,.1f} MB/s)'
+    return f'{rows:,} rows, {mb:,.1f} MB in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s, {mb / elapsed:,.1f} MB/s)'
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export bot tables to CSV or Parquet')
+    parser.add_argument('--table', action='append', choices=sorted(TABLES), help='Tables to export (default: all)')
+    parser.add_argument('--format', choices=sorted(EXPORTERS), default='csv', help='Output format')
+    parser.add_argument('--since', type=parse_date, help='Only rows on or after this date')
+    parser.add_argument('--until', type=parse_date, help='Only rows before this date')
+    parser.add_argument('--tier', action='append', help='Only tickets of these tiers')
+    parser.add_argument('--out', default='.', help='Directory to write the files to')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH, help='Rows fetched per round trip (parquet)')
+    args = parser.parse_args()
+
+    dsn = os.getenv('DATABASE_URL')
+    if not dsn:
+        print('❌ ERROR: No DATABASE_URL found in environment variables!')
+        return 1
+    os.makedirs(args.out, exist_ok=True)
+
+    conn = psycopg2.connect(dsn)
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    total_rows = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    try:
+        for name in args.table or sorted(TABLES):
+            path = os.path.join(args.out, f'{name}-{stamp}.{args.format}')
+            table_started = time.perf_counter()
+            rows, size = EXPORTERS[args.format](conn, name, args, path)
+            elapsed = time.perf_counter() - table_started
+            total_rows += rows or 0
+            total_bytes += size
+            print(f'📦 {name:<10} {format_rate(rows, size, elapsed)}  -> {path}')
+    finally:
+        conn.rollback()
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f'✅ Exported {format_rate(total_rows, total_bytes, elapsed)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
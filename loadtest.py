@@ -0,0 +1,493 @@
+"""
+Offline load test - drives the real ticket and coinflip code against a fake Discord API.
+
+Usage: python loadtest.py [--tickets N] [--coinflips N] [--concurrency N] [--latency MS]
+                          [--json FILE] [--baseline FILE] [--tolerance PCT]
+
+Needs a local Postgres in DATABASE_URL (never point this at production), or
+STORAGE_BACKEND=sqlite to run against a local SQLite file with no server. Nothing
+talks to Discord: guilds, channels, members and interactions are stand-ins whose
+API calls go through FakeDiscordAPI, which adds latency and enforces Discord-style
+rate-limit buckets (waiting out a 429 the way discord.py does).
+
+Each scenario reports throughput, latency percentiles, API calls and 429s.
+With --baseline the run fails if any scenario's throughput or p99 regressed.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+from collections import Counter
+
+import discord
+import bot as mmbot
+from bench import percentile
+
+FAKE_GUILD_ID = 900000000000000001  # Rows created by the load test carry this guild_id
+_ids = itertools.count(int(time.time() * 1000) << 22)
+
+
+def next_id():
+    """Unique snowflake-shaped ID"""
+    return next(_ids)
+
+
+# Fake Discord API
+# (method, route) -> (requests, per seconds), matching Discord's documented/observed buckets
+RATE_LIMITS = {
+    ('POST', '/channels/{channel_id}/messages'): (5, 5),
+    ('PATCH', '/channels/{channel_id}/messages/{message_id}'): (5, 5),
+    ('PATCH', '/channels/{channel_id}'): (2, 600),  # Channel renames
+    ('PUT', '/channels/{channel_id}/permissions/{overwrite_id}'): (10, 10),
+    ('DELETE', '/channels/{channel_id}/permissions/{overwrite_id}'): (10, 10),
+    ('DELETE', '/channels/{channel_id}'): (5, 5),
+    ('POST', '/guilds/{guild_id}/channels'): (10, 10),
+    ('POST', '/interactions/{interaction_id}/{token}/callback'): (50, 1),
+    ('POST', '/webhooks/{application_id}/{token}'): (5, 2),
+}
+GLOBAL_LIMIT = (50, 1)
+
+
+class Bucket:
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def acquire(self, now):
+        """Take a slot; returns seconds to wait (retry_after) if the bucket is empty"""
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining > 0:
+            self.remaining -= 1
+            return 0.0
+        return self.reset_at - now
+
+
+class FakeDiscordAPI:
+    """Counts calls, adds latency and enforces rate-limit buckets"""
+
+    def __init__(self, latency_ms=80, jitter=0.5):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.buckets = {}
+        self.global_bucket = Bucket(*GLOBAL_LIMIT)
+        self.calls = Counter()
+        self.ratelimited = Counter()
+
+    async def request(self, method, route, major=None):
+        key = (method, route)
+        self.calls[key] += 1
+        limit = RATE_LIMITS.get(key)
+        while True:
+            now = time.monotonic()
+            retry_after = self.global_bucket.acquire(now)
+            if not retry_after and limit:
+                bucket = self.buckets.get((key, major))
+                if bucket is None:
+                    bucket = self.buckets[(key, major)] = Bucket(*limit)
+                retry_after = bucket.acquire(now)
+            if not retry_after:
+                break
+            # A 429 costs a round trip before the client sleeps and retries
+            self.ratelimited[key] += 1
+            await asyncio.sleep(self.latency + retry_after)
+        await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def snapshot(self):
+        return Counter(self.calls), Counter(self.ratelimited)
+
+
+# Fake Discord objects - only what the bot's code paths touch
+class FakeAsset:
+    url = 'https://cdn.discordapp.com/embed/avatars/0.png'
+
+
+class FakePermissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+        self.mention = f'<@&{role_id}>'
+
+
+class FakeMember:
+    def __init__(self, guild, name, roles=(), administrator=False):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.nick = None
+        self.display_name = name
+        self.bot = False
+        self.mention = f'<@{self.id}>'
+        self.roles = [guild.default_role, *roles]
+        self.guild_permissions = FakePermissions(administrator)
+        self.display_avatar = FakeAsset()
+
+
+class FakeMessage:
+    def __init__(self, api, channel):
+        self.api = api
+        self.id = next_id()
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        await self.api.request('PATCH', '/channels/{channel_id}/messages/{message_id}', self.channel.id)
+        return self
+
+    async def delete(self):
+        await self.api.request('DELETE', '/channels/{channel_id}/messages/{message_id}', self.channel.id)
+
+
+class FakeCategory:
+    def __init__(self, name):
+        self.id = next_id()
+        self.name = name
+        self.text_channels = []
+
+
+class FakeChannel:
+    def __init__(self, api, guild, name, category=None):
+        self.api = api
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.mention = f'<#{self.id}>'
+        self.created_at = discord.utils.utcnow()
+
+    async def send(self, content=None, **kwargs):
+        await self.api.request('POST', '/channels/{channel_id}/messages', self.id)
+        return FakeMessage(self.api, self)
+
+    async def edit(self, **kwargs):
+        await self.api.request('PATCH', '/channels/{channel_id}', self.id)
+        self.name = kwargs.get('name', self.name)
+
+    async def set_permissions(self, target, **kwargs):
+        method = 'DELETE' if kwargs.get('overwrite', True) is None else 'PUT'
+        await self.api.request(method, '/channels/{channel_id}/permissions/{overwrite_id}', self.id)
+
+    async def delete(self, reason=None):
+        await self.api.request('DELETE', '/channels/{channel_id}', self.id)
+        self.guild.channels.pop(self.id, None)
+        if self.category and self in self.category.text_channels:
+            self.category.text_channels.remove(self)
+
+
+class FakeGuild:
+    def __init__(self, api):
+        self.api = api
+        self.id = FAKE_GUILD_ID
+        self.unavailable = False
+        self.default_role = FakeRole(self.id, '@everyone')
+        self.roles = {}
+        self.members = {}
+        self.channels = {}
+        self.categories = []
+
+        config = mmbot.get_guild_config(self.id)
+        for tier_key, role_id in config['mm_role_ids'].items():
+            self.roles[role_id] = FakeRole(role_id, f'{tier_key} mm')
+        self.roles[config['staff_role_id']] = FakeRole(config['staff_role_id'], 'staff')
+        proof = FakeChannel(api, self, 'proofs')
+        proof.id = config['proof_channel_id']
+        self.channels[proof.id] = proof
+        self.me = self.add_member('mm-bot', administrator=True)
+
+    def add_member(self, name, roles=(), administrator=False):
+        member = FakeMember(self, name, roles, administrator)
+        self.members[member.id] = member
+        return member
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def create_category(self, name, **kwargs):
+        await self.api.request('POST', '/guilds/{guild_id}/channels', self.id)
+        category = FakeCategory(name)
+        self.categories.append(category)
+        return category
+
+    async def create_text_channel(self, name, category=None, overwrites=None, **kwargs):
+        await self.api.request('POST', '/guilds/{guild_id}/channels', self.id)
+        channel = FakeChannel(self.api, self, name, category)
+        self.channels[channel.id] = channel
+        if category:
+            category.text_channels.append(channel)
+        return channel
+
+
+class FakeResponse:
+    def __init__(self, api, interaction):
+        self.api = api
+        self.interaction = interaction
+        self._done = False
+
+    async def _callback(self):
+        await self.api.request('POST', '/interactions/{interaction_id}/{token}/callback', self.interaction.id)
+        self._done = True
+
+    async def send_message(self, *args, **kwargs):
+        await self._callback()
+
+    async def edit_message(self, **kwargs):
+        await self._callback()
+
+    async def defer(self, **kwargs):
+        await self._callback()
+
+    async def send_modal(self, modal):
+        await self._callback()
+
+    def is_done(self):
+        return self._done
+
+
+class FakeFollowup:
+    def __init__(self, api, interaction):
+        self.api = api
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs):
+        await self.api.request('POST', '/webhooks/{application_id}/{token}', self.interaction.id)
+
+
+class FakeInteraction:
+    def __init__(self, api, guild, channel, user, message=None):
+        self.id = next_id()
+        self.guild = guild
+        self.channel = channel
+        self.user = user
+        self.message = message
+        self.response = FakeResponse(api, self)
+        self.followup = FakeFollowup(api, self)
+
+
+class FakeContext:
+    def __init__(self, api, guild, channel, author):
+        self.api = api
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.message = FakeMessage(api, channel)
+        self.interaction = None
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def defer(self, **kwargs):
+        # Like commands.Context.defer: a no-op for prefix invocations
+        if self.interaction is not None:
+            await self.interaction.response.defer(**kwargs)
+
+
+# Scenarios
+async def run_scenario(name, api, jobs, concurrency):
+    """Run every job with bounded concurrency and summarise the run"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    calls_before, limited_before = api.snapshot()
+
+    async def timed(job):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await job()
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f'  ⚠️ {name}: {type(e).__name__}: {e}')
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(job) for job in jobs))
+    elapsed = time.perf_counter() - started
+
+    calls_after, limited_after = api.snapshot()
+    latencies.sort()
+    return {
+        'scenario': name,
+        'ops': len(jobs),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'ops_per_sec': round(len(jobs) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        'api_calls': sum((calls_after - calls_before).values()),
+        'ratelimited': sum((limited_after - limited_before).values()),
+    }
+
+
+async def run_load_test(args):
+    api = FakeDiscordAPI(args.latency, args.jitter)
+    guild = FakeGuild(api)
+    config = mmbot.get_guild_config(guild.id)
+    og_role = guild.get_role(config['mm_role_ids']['og'])
+    middleman = guild.add_member('loadtest-mm', roles=[og_role])
+    traders = [guild.add_member(f'trader{i}') for i in range(args.tickets)]
+    results = []
+
+    # Create MM tickets through the same path as MMTradeModal
+    tiers = list(config['mm_tiers'])
+    channels = []
+
+    def create_job(trader):
+        async def job():
+            channel = await mmbot.create_ticket_with_details(
+                guild, trader, random.choice(tiers), 'loadtest-partner', '500 rbx', '$50 PayPal', 'None'
+            )
+            channels.append(channel)
+        return job
+
+    results.append(await run_scenario('create_ticket', api, [create_job(t) for t in traders], args.concurrency))
+
+    # Claim with the persistent ticket view's button
+    view = mmbot.MMTicketView()
+
+    def claim_job(channel):
+        async def job():
+            await view.claim_button.callback(FakeInteraction(api, guild, channel, middleman))
+        return job
+
+    results.append(await run_scenario('claim_button', api, [claim_job(c) for c in channels], args.concurrency))
+
+    # Post proof with the $proof command
+    def proof_job(channel):
+        async def job():
+            await mmbot.proof_command(FakeContext(api, guild, channel, middleman))
+        return job
+
+    results.append(await run_scenario('proof_command', api, [proof_job(c) for c in channels], args.concurrency))
+
+    # Close every ticket
+    def close_job(channel):
+        async def job():
+            await mmbot.close_ticket(channel, middleman)
+        return job
+
+    results.append(await run_scenario('close_ticket', api, [close_job(c) for c in channels], args.concurrency))
+
+    # Coinflip games, both players picking a side through the buttons
+    def coinflip_job(i):
+        async def job():
+            player1, player2 = traders[i % len(traders)], traders[(i + 1) % len(traders)]
+            message = FakeMessage(api, guild.get_channel(config['proof_channel_id']))
+            game = mmbot.CoinflipView(player1, player2, args.rounds, True)
+            await game.heads_button.callback(FakeInteraction(api, guild, message.channel, player1, message))
+            await game.tails_button.callback(FakeInteraction(api, guild, message.channel, player2, message))
+            game.stop()
+        return job
+
+    results.append(await run_scenario('coinflip', api, [coinflip_job(i) for i in range(args.coinflips)], args.concurrency))
+
+    await mmbot.flush_ticket_events()  # Write what is still buffered, as shutdown would
+    return results, api
+
+
+def cleanup_db():
+    """Remove rows the load test created"""
+    mmbot.delete_guild_data_db(FAKE_GUILD_ID)
+
+
+def print_report(results, api):
+    header = f"{'scenario':<15} {'ops':>6} {'err':>4} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'api':>7} {'429s':>6}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['scenario']:<15} {r['ops']:>6} {r['errors']:>4} {r['ops_per_sec']:>9.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['api_calls']:>7} {r['ratelimited']:>6}")
+    print('\nAPI calls by route:')
+    for (method, route), count in api.calls.most_common():
+        limited = api.ratelimited.get((method, route), 0)
+        print(f"  {method:<6} {route:<55} {count:>7}" + (f"  ({limited} rate limited)" if limited else ''))
+
+
+def check_baseline(results, baseline_file, tolerance):
+    """Compare against a saved run; returns a list of regressions"""
+    with open(baseline_file) as f:
+        baseline = {r['scenario']: r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        base = baseline.get(r['scenario'])
+        if not base:
+            continue
+        if r['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}: {r['ops_per_sec']} ops/s vs baseline {base['ops_per_sec']}")
+        if r['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: p99 {r['p99_ms']}ms vs baseline {base['p99_ms']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the bot against a fake Discord API')
+    parser.add_argument('--tickets', type=int, default=200, help='Tickets to create, claim, proof and close')
+    parser.add_argument('--coinflips', type=int, default=50, help='Coinflip games to play')
+    parser.add_argument('--rounds', type=int, default=3, help='First-to rounds per coinflip game')
+    parser.add_argument('--concurrency', type=int, default=20, help='Operations in flight at once')
+    parser.add_argument('--latency', type=float, default=80, help='Mean fake API latency in ms')
+    parser.add_argument('--jitter', type=float, default=0.5, help='Latency jitter as a fraction of the mean')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--baseline', help='Fail if results regress against this results file')
+    parser.add_argument('--tolerance', type=float, default=15, help='Allowed regression in percent')
+    parser.add_argument('--keep', action='store_true', help='Keep the rows created by the run')
+    args = parser.parse_args()
+    mmbot.setup_logging()
+
+    # Real delays are for humans watching - the load test wants raw throughput
+    mmbot.CLOSE_DELETE_DELAY = 0
+    mmbot.COINFLIP_CHOICE_DELAY = 0
+    mmbot.COINFLIP_START_DELAY = 0
+    mmbot.COINFLIP_ROUND_DELAY = 0
+
+    mmbot.init_database()
+    try:
+        results, api = asyncio.run(run_load_test(args))
+    finally:
+        if not args.keep:
+            cleanup_db()
+
+    print_report(results, api)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline, args.tolerance / 100)
+        if regressions:
+            print('\n❌ Regressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print('\n✅ No regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    finally:
+        mmbot.stop_logging()  # Flush queued log records before the writer thread dies with the process
@@ -0,0 +1,669 @@
+"""
+Embedded SQLite storage for single-node and test deployments.
+
+Select it with STORAGE_BACKEND=sqlite (and SQLITE_PATH, default mmbot.db) - bot.py
+then swaps every *_db helper for the method of the same name here, so callers never
+know which backend they are talking to. Startup is a file open; no server needed.
+
+The database runs in WAL mode, so readers never block the writer. Each thread reads on a
+connection of its own, outside any lock; writes share one connection behind a lock, since
+SQLite serialises writers anyway (the bot already sends blocking work through
+asyncio.to_thread). An in-memory database is private to its connection, so there reads
+share the writer's. It is meant for one process - there is no NOTIFY, so a cluster
+deployment must stay on Postgres.
+
+Differences from Postgres that callers can see: none. Under the hood, search uses an
+FTS5 table fed by a trigger, ticket numbers come from a one-row counter instead of a
+sequence, history is one table instead of monthly partitions, and JSON is stored as text.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+
+SEARCH_DOCUMENT = (
+    "coalesce(new.trader, '') || ' ' || coalesce(new.giving, '') || ' ' || "
+    "coalesce(new.receiving, '') || ' ' || coalesce(new.reason, '') || ' ' || coalesce(new.details, '')"
+)
+TICKET_COLUMNS = (
+    "channel_id, user_id, ticket_type, tier, trader, giving, receiving, tip, reason, details, "
+    "created_at, guild_id, claimed_by, claimed_at, ticket_number"
+)
+JSON_COLUMNS = ('mm_role_ids', 'mm_tiers', 'shard_ids', 'latencies', 'metrics')
+# Columns read back as datetime / date (every TIMESTAMP and DATE column in the schema below)
+TIMESTAMP_COLUMNS = frozenset((
+    'created_at', 'claimed_at', 'closed_at', 'last_activity_at', 'last_updated', 'updated_at',
+    'started_at', 'occurred_at', 'applied_at', 'synced_at'
+))
+DATE_COLUMNS = frozenset(('day',))
+
+# Mirrors bot.MIGRATIONS: migration 1 is Postgres migrations 1-10, later ones follow
+# one for one. Add a migration here whenever one is added there.
+MIGRATIONS = [
+    (1, 'initial schema', [
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            channel_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            ticket_type TEXT NOT NULL,
+            tier TEXT,
+            trader TEXT,
+            giving TEXT,
+            receiving TEXT,
+            tip TEXT,
+            reason TEXT,
+            details TEXT,
+            claimed_by INTEGER,
+            created_at TIMESTAMP,
+            claimed_at TIMESTAMP,
+            guild_id INTEGER,
+            ticket_number INTEGER,
+            last_activity_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ticket_history (
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            ticket_type TEXT NOT NULL,
+            tier TEXT,
+            trader TEXT,
+            giving TEXT,
+            receiving TEXT,
+            tip TEXT,
+            reason TEXT,
+            details TEXT,
+            created_at TIMESTAMP,
+            guild_id INTEGER,
+            claimed_by INTEGER,
+            claimed_at TIMESTAMP,
+            closed_by INTEGER,
+            closed_at TIMESTAMP NOT NULL,
+            ticket_number INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS mm_stats (
+            user_id INTEGER PRIMARY KEY,
+            tickets_completed INTEGER DEFAULT 0,
+            last_updated TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS guild_config (
+            guild_id INTEGER PRIMARY KEY,
+            proof_channel_id INTEGER,
+            staff_role_id INTEGER,
+            ticket_category TEXT,
+            support_category TEXT,
+            mm_role_ids TEXT,
+            mm_tiers TEXT,
+            inactivity_hours REAL,
+            updated_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cluster_health (
+            cluster_id INTEGER PRIMARY KEY,
+            pid INTEGER,
+            shard_ids TEXT,
+            shard_count INTEGER,
+            guilds INTEGER,
+            latencies TEXT,
+            metrics TEXT,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ticket_events (
+            id INTEGER PRIMARY KEY,
+            occurred_at TIMESTAMP NOT NULL,
+            event TEXT NOT NULL,
+            guild_id INTEGER,
+            channel_id INTEGER NOT NULL,
+            ticket_number INTEGER,
+            tier TEXT,
+            actor_id INTEGER,
+            target_id INTEGER,
+            seconds REAL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ticket_rollups (
+            guild_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            tier TEXT NOT NULL,
+            mm_id INTEGER NOT NULL,
+            claims INTEGER NOT NULL DEFAULT 0,
+            claim_seconds REAL NOT NULL DEFAULT 0,
+            closes INTEGER NOT NULL DEFAULT 0,
+            close_seconds REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, day, tier, mm_id)
+        )
+        """,
+        # Stands in for ticket_number_seq
+        "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO counters (name, value) VALUES ('ticket_number', 1)",
+        # Same indexes as Postgres migration 5/6
+        "CREATE INDEX IF NOT EXISTS mm_stats_leaderboard_idx ON mm_stats (tickets_completed DESC, user_id DESC)",
+        "CREATE INDEX IF NOT EXISTS tickets_user_idx ON tickets (user_id)",
+        "CREATE INDEX IF NOT EXISTS tickets_claimed_by_idx ON tickets (claimed_by) WHERE claimed_by IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS tickets_guild_idx ON tickets (guild_id)",
+        "CREATE INDEX IF NOT EXISTS tickets_created_at_idx ON tickets (created_at)",
+        """
+        CREATE INDEX IF NOT EXISTS tickets_unclaimed_tier_idx ON tickets (tier, created_at)
+        WHERE claimed_by IS NULL AND ticket_type = 'mm'
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS tickets_number_idx ON tickets (ticket_number)",
+        "CREATE INDEX IF NOT EXISTS ticket_history_user_idx ON ticket_history (user_id)",
+        "CREATE INDEX IF NOT EXISTS ticket_history_claimed_by_idx ON ticket_history (claimed_by)",
+        "CREATE INDEX IF NOT EXISTS ticket_history_channel_idx ON ticket_history (channel_id)",
+        "CREATE INDEX IF NOT EXISTS ticket_history_number_idx ON ticket_history (ticket_number)",
+        "CREATE INDEX IF NOT EXISTS ticket_events_channel_idx ON ticket_events (channel_id)",
+        # Trade search: rowid is the channel ID, and rows follow the ticket into history
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ticket_search USING fts5 (document, tokenize = 'unicode61 remove_diacritics 0')",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS tickets_search_insert AFTER INSERT ON tickets BEGIN
+            INSERT OR REPLACE INTO ticket_search (rowid, document) VALUES (new.channel_id, {SEARCH_DOCUMENT});
+        END
+        """
+    ]),
+    (2, 'app command sync', [
+        """
+        CREATE TABLE IF NOT EXISTS app_command_sync (
+            application_id INTEGER PRIMARY KEY,
+            command_hash TEXT NOT NULL,
+            synced_at TIMESTAMP
+        )
+        """
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# (name, sql, sample params, must be index-only) - the SQLite spelling of bot.HOT_QUERIES
+HOT_QUERIES = [
+    ('get_ticket', "SELECT * FROM tickets WHERE channel_id = ?", (0,), False),
+    ('get_mm_stats', "SELECT * FROM mm_stats WHERE user_id = ?", (0,), False),
+    ('leaderboard', "SELECT user_id, tickets_completed FROM mm_stats ORDER BY tickets_completed DESC, user_id DESC LIMIT ?", (10,), True),
+    ('leaderboard_page', """
+        SELECT user_id, tickets_completed FROM mm_stats
+        WHERE (tickets_completed, user_id) < (?, ?)
+        ORDER BY tickets_completed DESC, user_id DESC LIMIT ?
+    """, (100, 0, 10), True),
+    ('open_tickets_for_user', "SELECT channel_id FROM tickets WHERE user_id = ?", (0,), False),
+    ('claimed_by_mm', "SELECT channel_id FROM tickets WHERE claimed_by = ?", (0,), False),
+    ('unclaimed_for_tier', """
+        SELECT channel_id, created_at FROM tickets
+        WHERE claimed_by IS NULL AND ticket_type = 'mm' AND tier = ?
+        ORDER BY created_at
+    """, ('basic',), False),
+    ('search_tickets', "SELECT rowid FROM ticket_search WHERE ticket_search MATCH ?", ('"paypal"',), False),
+]
+
+
+# Timestamps are stored as fixed-width ISO text so they sort (and keyset-compare) as strings.
+# The conversion is done here rather than with sqlite3.register_adapter/register_converter,
+# which would change every sqlite3 connection in the process.
+def _to_sql(value):
+    if isinstance(value, datetime):
+        return value.isoformat(' ', 'microseconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _adapt(params):
+    if isinstance(params, dict):
+        return {key: _to_sql(value) for key, value in params.items()}
+    return tuple(_to_sql(value) for value in params)
+
+
+def _from_sql(column, value):
+    if isinstance(value, str):
+        if column in TIMESTAMP_COLUMNS:
+            return datetime.fromisoformat(value)
+        if column in DATE_COLUMNS:
+            return date.fromisoformat(value)
+    return value
+
+
+def _dict_row(cursor, row):
+    return {column[0]: _from_sql(column[0], value) for column, value in zip(cursor.description, row)}
+
+
+class _Connection(sqlite3.Connection):
+    """Connection that writes datetime and date parameters as ISO text"""
+    def execute(self, sql, params=()):
+        return super().execute(sql, _adapt(params))
+
+    def executemany(self, sql, seq_of_params):
+        return super().executemany(sql, (_adapt(params) for params in seq_of_params))
+
+
+def fts_query(query):
+    """Turn a search box string into an FTS5 query: every word must match, like websearch_to_tsquery"""
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{word}"' for word in words)
+
+
+class SQLiteStorage:
+    def __init__(self, path, search_page_size=5, batch_size=100, ticket_number_block=50,
+                 seq_scan_row_limit=1000, health_interval=30, cluster_count=1):
+        self.path = path
+        self.search_page_size = search_page_size
+        self.batch_size = batch_size
+        self.ticket_number_block = ticket_number_block
+        self.seq_scan_row_limit = seq_scan_row_limit
+        self.health_interval = health_interval
+        self.cluster_count = cluster_count
+        self._conn = None
+        self._readers = {}  # thread id -> that thread's read connection
+        self._lock = threading.RLock()
+
+    # Connection
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, factory=_Connection)
+        conn.row_factory = _dict_row
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def connect(self):
+        """Open the write connection, creating the database file on first use"""
+        with self._lock:
+            if self._conn is None:
+                if self.path != ':memory:' and os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                conn = self._open()
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute("PRAGMA synchronous = NORMAL")  # Durable at every checkpoint; WAL keeps it consistent
+                self._conn = conn
+            return self._conn
+
+    def reader(self):
+        """This thread's read connection (None for :memory:, which only the write connection can see)"""
+        if self.path == ':memory:':
+            return None
+        conn = self._readers.get(threading.get_ident())
+        if conn is None:
+            self.connect()  # The file exists and is in WAL mode before anyone reads it
+            conn = self._open()
+            with self._lock:
+                self._readers[threading.get_ident()] = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Hold the connection for one write transaction; commits on success, rolls back on error"""
+        with self._lock:
+            conn = self.connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def query(self, sql, params=()):
+        """Run a read and fetch every row"""
+        conn = self.reader()
+        if conn is None:
+            with self._lock:
+                return self.connect().execute(sql, params).fetchall()
+        return conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        """Run a read and fetch the first row"""
+        conn = self.reader()
+        if conn is None:
+            with self._lock:
+                return self.connect().execute(sql, params).fetchone()
+        cursor = conn.execute(sql, params)
+        try:
+            return cursor.fetchone()
+        finally:
+            cursor.close()  # Ends the read, so the next one on this thread sees newer commits
+
+    def close_pool(self):
+        """Close the connections (the Postgres backend closes its pool here)"""
+        with self._lock:
+            for conn in self._readers.values():
+                conn.close()
+            self._readers.clear()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Schema
+    def migrate_database_db(self):
+        """Bring the schema up to date, returning the versions applied"""
+        with self.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP
+                )
+            """)
+            applied = {row['version'] for row in conn.execute("SELECT version FROM schema_migrations")}
+            newly_applied = []
+            for version, name, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.utcnow())
+                )
+                newly_applied.append(version)
+        return newly_applied
+
+    def maintain_history_db(self):
+        """History is a single table here, so there are no partitions to create or detach"""
+        return []
+
+    def delete_guild_data_db(self, guild_id):
+        """Remove every ticket, history, event and rollup row of one guild"""
+        with self.transaction() as conn:
+            conn.execute("""
+                DELETE FROM ticket_search WHERE rowid IN (
+                    SELECT channel_id FROM tickets WHERE guild_id = :guild_id
+                    UNION SELECT channel_id FROM ticket_history WHERE guild_id = :guild_id
+                )
+            """, {'guild_id': guild_id})
+            for table in ('tickets', 'ticket_history', 'ticket_events', 'ticket_rollups'):
+                conn.execute(f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,))
+
+    def delete_mm_stats_db(self, user_ids):
+        """Remove the mm_stats rows of the given users"""
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM mm_stats WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+
+    # Tickets
+    def fetch_ticket_number_block(self):
+        """Reserve the next block of ticket numbers, returned as (start, end)"""
+        with self.transaction() as conn:
+            end = conn.execute(
+                "UPDATE counters SET value = value + ? WHERE name = 'ticket_number' RETURNING value",
+                (self.ticket_number_block,)
+            ).fetchone()['value']
+        return end - self.ticket_number_block, end
+
+    def save_ticket(self, channel_id, user_id, ticket_type, **kwargs):
+        """Save a ticket and return the stored row"""
+        with self.transaction() as conn:
+            return conn.execute("""
+                INSERT INTO tickets (channel_id, user_id, ticket_type, ticket_number, guild_id, tier, trader, giving, receiving, tip, reason, details, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING *
+            """, (
+                channel_id, user_id, ticket_type, kwargs.get('ticket_number'), kwargs.get('guild_id'),
+                kwargs.get('tier'), kwargs.get('trader'), kwargs.get('giving'),
+                kwargs.get('receiving'), kwargs.get('tip'),
+                kwargs.get('reason'), kwargs.get('details'), datetime.utcnow()
+            )).fetchone()
+
+    def get_ticket(self, channel_id):
+        """Get a ticket row"""
+        return self.query_one("SELECT * FROM tickets WHERE channel_id = ?", (channel_id,))
+
+    def claim_ticket_db(self, channel_id, user_id):
+        """Mark a ticket as claimed, returning the seconds it waited (None if no row)"""
+        with self.transaction() as conn:
+            row = conn.execute("""
+                UPDATE tickets SET claimed_by = ?, claimed_at = ? WHERE channel_id = ?
+                RETURNING (julianday(claimed_at) - julianday(created_at)) * 86400.0 AS seconds
+            """, (user_id, datetime.utcnow(), channel_id)).fetchone()
+        return float(row['seconds']) if row and row['seconds'] is not None else None
+
+    def unclaim_ticket_db(self, channel_id):
+        """Remove the claim from a ticket"""
+        with self.transaction() as conn:
+            conn.execute("UPDATE tickets SET claimed_by = NULL, claimed_at = NULL WHERE channel_id = ?", (channel_id,))
+
+    def _archive_tickets(self, conn, channel_ids, closed_by=None):
+        """Move tickets into history inside the caller's transaction, returning the archived rows"""
+        ids = json.dumps(list(channel_ids))
+        closed_at = datetime.utcnow()
+        rows = conn.execute(f"""
+            INSERT INTO ticket_history ({TICKET_COLUMNS}, closed_by, closed_at)
+            SELECT {TICKET_COLUMNS}, ?, ? FROM tickets WHERE channel_id IN (SELECT value FROM json_each(?))
+            RETURNING channel_id, guild_id, tier, ticket_number, claimed_by,
+                      (julianday(closed_at) - julianday(created_at)) * 86400.0 AS open_seconds
+        """, (closed_by, closed_at, ids)).fetchall()
+        conn.execute("DELETE FROM tickets WHERE channel_id IN (SELECT value FROM json_each(?))", (ids,))
+        return rows
+
+    def delete_ticket_db(self, channel_id, closed_by=None):
+        """Move a ticket into history, returning the archived row"""
+        with self.transaction() as conn:
+            closed = self._archive_tickets(conn, [channel_id], closed_by)
+        return closed[0] if closed else None
+
+    def save_ticket_activity_db(self, pairs):
+        """Write a batch of (channel_id, last_activity_at) in one transaction"""
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE tickets SET last_activity_at = ? WHERE channel_id = ?",
+                [(last_activity_at, channel_id) for channel_id, last_activity_at in pairs]
+            )
+
+    def get_live_tickets_db(self):
+        """Get every live ticket row (one process owns them all)"""
+        return self.query("SELECT * FROM tickets")
+
+    def backfill_ticket_guilds_db(self, pairs):
+        """Record guild_id on older tickets that were saved without one"""
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE tickets SET guild_id = ? WHERE channel_id = ?",
+                [(guild_id, channel_id) for channel_id, guild_id in pairs]
+            )
+
+    def archive_orphan_tickets_db(self, channel_ids):
+        """Move tickets whose channel is gone into history, in batches, returning the archived rows"""
+        archived = []
+        for i in range(0, len(channel_ids), self.batch_size):
+            with self.transaction() as conn:
+                archived.extend(self._archive_tickets(conn, channel_ids[i:i + self.batch_size]))
+        return archived
+
+    # MM Stats
+    def increment_mm_stats(self, user_id):
+        """Add 1 to an MM's completed tickets"""
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT INTO mm_stats (user_id, tickets_completed, last_updated) VALUES (?, 1, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    tickets_completed = tickets_completed + 1,
+                    last_updated = excluded.last_updated
+            """, (user_id, datetime.utcnow()))
+
+    def get_mm_stats_db(self, user_id):
+        """Get an MM's statistics"""
+        row = self.query_one("SELECT * FROM mm_stats WHERE user_id = ?", (user_id,))
+        return row if row else {'user_id': user_id, 'tickets_completed': 0}
+
+    def get_mm_leaderboard_db(self, limit=10, after=None):
+        """Get the top MMs, continuing after a (tickets_completed, user_id) cursor"""
+        if after is None:
+            return self.query(
+                "SELECT user_id, tickets_completed FROM mm_stats ORDER BY tickets_completed DESC, user_id DESC LIMIT ?",
+                (limit,)
+            )
+        return self.query("""
+            SELECT user_id, tickets_completed FROM mm_stats
+            WHERE (tickets_completed, user_id) < (?, ?)
+            ORDER BY tickets_completed DESC, user_id DESC LIMIT ?
+        """, (after[0], after[1], limit))
+
+    def count_mm_stats_db(self):
+        """Number of MMs with statistics"""
+        return self.query_one("SELECT count(*) AS n FROM mm_stats")['n']
+
+    # Search
+    def search_tickets_db(self, guild_id, query, before=None, limit=None):
+        """Full-text search over a guild's open and closed tickets, newest first.
+
+        Same contract as the Postgres helper: `before` is the (created_at, channel_id)
+        of the last row on the previous page, and up to limit + 1 rows come back.
+        """
+        limit = limit or self.search_page_size
+        match = fts_query(query)
+        if not match:
+            return []
+        columns = "ticket_number, channel_id, user_id, ticket_type, tier, trader, giving, receiving, reason, created_at"
+        conditions = "guild_id = :guild_id AND channel_id IN (SELECT rowid FROM ticket_search WHERE ticket_search MATCH :query)"
+        params = {'guild_id': guild_id, 'query': match, 'limit': limit + 1, 'before_at': None, 'before_id': None}
+        if before:
+            params['before_at'], params['before_id'] = before
+        return self.query(f"""
+            SELECT ticket_number, channel_id, user_id, ticket_type, tier, trader, giving, receiving, reason,
+                   created_at, closed_at
+            FROM (
+                SELECT {columns}, NULL AS closed_at FROM tickets WHERE {conditions}
+                UNION ALL
+                SELECT {columns}, closed_at FROM ticket_history WHERE {conditions}
+            )
+            WHERE :before_at IS NULL OR (created_at, channel_id) < (:before_at, :before_id)
+            ORDER BY created_at DESC, channel_id DESC
+            LIMIT :limit
+        """, params)
+
+    # Ticket Events
+    def write_ticket_events_db(self, events):
+        """Insert a batch of ticket events and fold them into the daily rollups, atomically"""
+        with self.transaction() as conn:
+            first_id = conn.execute("SELECT coalesce(max(id), 0) AS id FROM ticket_events").fetchone()['id']
+            conn.executemany("""
+                INSERT INTO ticket_events (occurred_at, event, guild_id, channel_id, ticket_number, tier, actor_id, target_id, seconds)
+                VALUES (:occurred_at, :event, :guild_id, :channel_id, :ticket_number, :tier, :actor_id, :target_id, :seconds)
+            """, events)
+            # Same grouping as the Postgres helper: claims count for the claimer, closes for the MM (0 = never claimed)
+            conn.execute("""
+                INSERT INTO ticket_rollups (guild_id, day, tier, mm_id, claims, claim_seconds, closes, close_seconds)
+                SELECT coalesce(guild_id, 0), date(occurred_at), coalesce(tier, 'support'),
+                       CASE WHEN event = 'claimed' THEN actor_id ELSE coalesce(target_id, 0) END AS mm,
+                       SUM(event = 'claimed'), SUM(CASE WHEN event = 'claimed' THEN seconds ELSE 0 END),
+                       SUM(event = 'closed'), SUM(CASE WHEN event = 'closed' THEN seconds ELSE 0 END)
+                FROM ticket_events
+                WHERE id > ? AND event IN ('claimed', 'closed') AND seconds IS NOT NULL
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (guild_id, day, tier, mm_id) DO UPDATE SET
+                    claims = claims + excluded.claims,
+                    claim_seconds = claim_seconds + excluded.claim_seconds,
+                    closes = closes + excluded.closes,
+                    close_seconds = close_seconds + excluded.close_seconds
+            """, (first_id,))
+
+    def get_ticket_rollups_db(self, guild_id, since, mm_id=None):
+        """Time-to-claim and time-to-close totals per tier since a date"""
+        return self.query("""
+            SELECT tier, SUM(claims) AS claims, SUM(claim_seconds) AS claim_seconds,
+                   SUM(closes) AS closes, SUM(close_seconds) AS close_seconds
+            FROM ticket_rollups
+            WHERE guild_id = ? AND day >= ? AND (? IS NULL OR mm_id = ?)
+            GROUP BY tier
+            ORDER BY tier
+        """, (guild_id, since, mm_id, mm_id))
+
+    # Guild Configuration
+    def get_guild_config_rows_db(self, guild_id=None):
+        """Get config rows - one guild, or all when guild_id is None"""
+        if guild_id is None:
+            rows = self.query("SELECT * FROM guild_config")
+        else:
+            rows = self.query("SELECT * FROM guild_config WHERE guild_id = ?", (guild_id,))
+        return [self._decode_json(row) for row in rows]
+
+    def set_guild_config_db(self, guild_id, key, value):
+        """Change one config value (no other process to notify)"""
+        if key in JSON_COLUMNS:
+            value = json.dumps(value)
+        with self.transaction() as conn:
+            conn.execute(f"""
+                INSERT INTO guild_config (guild_id, {key}, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (guild_id) DO UPDATE SET
+                    {key} = excluded.{key},
+                    updated_at = excluded.updated_at
+            """, (guild_id, value, datetime.utcnow()))
+
+    # Cluster Health
+    def save_cluster_health_db(self, heartbeat):
+        """Write a process heartbeat (see bot.cluster_heartbeat)"""
+        row = {key: json.dumps(value) if key in JSON_COLUMNS else value for key, value in heartbeat.items()}
+        row['started_at'] = datetime.utcfromtimestamp(heartbeat['started_at'])
+        row['updated_at'] = datetime.utcnow()
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO cluster_health (cluster_id, pid, shard_ids, shard_count, guilds, latencies, metrics, started_at, updated_at)
+                VALUES (:cluster_id, :pid, :shard_ids, :shard_count, :guilds, :latencies, :metrics, :started_at, :updated_at)
+            """, row)
+
+    def get_cluster_health_db(self):
+        """Get every cluster's latest heartbeat, flagging stale ones"""
+        rows = self.query("""
+            SELECT cluster_id, pid, shard_ids, shard_count, guilds, latencies, metrics, updated_at
+            FROM cluster_health
+            WHERE cluster_id < ?
+            ORDER BY cluster_id
+        """, (self.cluster_count,))
+        now = datetime.utcnow()
+        for row in rows:
+            self._decode_json(row)
+            row['age_seconds'] = (now - row.pop('updated_at')).total_seconds()
+            row['healthy'] = row['age_seconds'] < self.health_interval * 3
+        return rows
+
+    # Slash Commands
+    def get_app_command_hash_db(self, application_id):
+        """Hash of the command tree last synced for this application (None if never)"""
+        row = self.query_one("SELECT command_hash FROM app_command_sync WHERE application_id = ?", (application_id,))
+        return row['command_hash'] if row else None
+
+    def set_app_command_hash_db(self, application_id, command_hash):
+        """Record the hash of the command tree just synced"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO app_command_sync (application_id, command_hash, synced_at) VALUES (?, ?, ?)",
+                (application_id, command_hash, datetime.utcnow())
+            )
+
+    def delete_app_command_hash_db(self, application_id):
+        """Forget the synced command tree hash of an application"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM app_command_sync WHERE application_id = ?", (application_id,))
+
+    def _decode_json(self, row):
+        for key in JSON_COLUMNS:
+            if row.get(key) is not None:
+                row[key] = json.loads(row[key])
+        return row
+
+    # Query Plan Checks
+    def check_query_plans(self):
+        """EXPLAIN QUERY PLAN each hot query and flag full scans and sorts on big tables"""
+        table_rows = {
+            table: self.query_one(f"SELECT count(*) AS n FROM {table}")['n']
+            for table in ('tickets', 'mm_stats')
+        }
+        report = []
+        for name, sql, params, index_only in HOT_QUERIES:
+            steps = [row['detail'] for row in self.query("EXPLAIN QUERY PLAN " + sql, params)]
+            big = any(count >= self.seq_scan_row_limit for table, count in table_rows.items() if table in sql)
+            problems = []
+            if big:
+                for step in steps:
+                    if step.startswith('SCAN ') and 'VIRTUAL TABLE' not in step and 'USING' not in step:
+                        problems.append(f"Seq Scan on {step.split()[1]}")
+                    elif 'TEMP B-TREE' in step:
+                        problems.append('Sort')
+                if index_only and not any('COVERING INDEX' in step for step in steps):
+                    problems.append('not index-only')
+            report.append({'query': name, 'plan': ' > '.join(steps), 'problems': problems})
+        return report